@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GitLab / GitHub API 的公共部分
+reviews_scraper 和根目录的 git_commits_fetcher 共用：会话创建、提交列表请求、
+跟随 Link / X-Next-Page 的翻页，以及提交列表的条件请求缓存（ResponseCache）
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from records import json_default
+
+
+def create_session(platform='gitlab', access_token=None, pool_size=10, session=None):
+    """
+    创建共享的HTTP会话（连接池 + keep-alive）
+    
+    参数:
+        platform: 平台类型，'gitlab' 或 'github'
+        access_token: API访问令牌（写入会话默认请求头）
+        pool_size: 每个主机的连接池大小
+        session: 要配置的会话对象（可选，例如带限流的会话；不传则新建 requests.Session）
+    
+    返回:
+        requests.Session 对象
+    """
+    if session is None:
+        session = requests.Session()
+    
+    # 每个主机保持 pool_size 个长连接
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    
+    # 默认请求头只构建一次
+    if platform == 'github':
+        session.headers.update({
+            'Accept': 'application/vnd.github.v3+json',
+            'Content-Type': 'application/json'
+        })
+        if access_token:
+            session.headers['Authorization'] = f'token {access_token}'
+    else:  # GitLab
+        session.headers.update({
+            'Content-Type': 'application/json'
+        })
+        if access_token:
+            session.headers['Authorization'] = f'Bearer {access_token}'
+    
+    return session
+
+
+def build_commits_request(api_base_url, project_id, platform='gitlab', per_page=20, ref_name=None):
+    """
+    构建提交列表接口的URL和查询参数
+    
+    参数:
+        api_base_url: API基础URL
+        project_id: 项目ID
+        platform: 平台类型
+        per_page: 每页提交数量
+        ref_name: 分支或标签名称（可选）
+    
+    返回:
+        (url, params) 元组
+    """
+    if platform == 'gitlab':
+        url = f'{api_base_url}/projects/{project_id}/repository/commits'
+        params = {
+            'per_page': per_page,
+            'order_by': 'created_at',
+            'sort': 'desc'
+        }
+        if ref_name:
+            params['ref_name'] = ref_name
+    else:  # GitHub
+        url = f'{api_base_url}/repos/{project_id}/commits'
+        params = {'per_page': per_page}
+        if ref_name:
+            params['sha'] = ref_name
+    
+    return url, params
+
+
+class ResponseCache:
+    """
+    提交列表接口的条件请求缓存
+    
+    保存每个请求的 ETag / Last-Modified 和响应内容，之后的请求带上
+    If-None-Match / If-Modified-Since，服务端返回 304 时直接使用本地内容；
+    ttl 秒内的重复请求不发网络请求。指定 cache_dir 时缓存保存到磁盘，
+    可在多次运行（例如定时任务）之间复用
+    """
+    
+    def __init__(self, cache_dir=None, ttl=30):
+        """
+        参数:
+            cache_dir: 磁盘缓存目录（None 表示只缓存在内存中）
+            ttl: 在该秒数内直接使用缓存，不发请求
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.stats = {'fresh': 0, 'revalidated': 0, 'downloaded': 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+    
+    def _key(self, session, url, params):
+        # 不同令牌看到的内容可能不同，键中包含认证头的摘要
+        auth = session.headers.get('Authorization', '')
+        raw = json.dumps([url, sorted((params or {}).items()), auth], default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _load(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None or not self.cache_dir:
+            return entry
+        try:
+            with open(os.path.join(self.cache_dir, f'{key}.json'), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            self.entries[key] = entry
+        return entry
+    
+    def _store(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, f'{key}.json')
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+    
+    def get(self, session, url, params=None, timeout=30):
+        """
+        获取接口数据（必要时发送条件请求）
+        
+        返回:
+            (data, headers) 元组，data 为解析后的JSON，headers 为分页相关的响应头
+        """
+        key = self._key(session, url, params)
+        entry = self._load(key)
+        now = time.time()
+        
+        if entry is not None and now - entry['fetched_at'] < self.ttl:
+            self.stats['fresh'] += 1
+            return json.loads(entry['body']), entry['headers']
+        
+        request_headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+        
+        response = session.get(url, params=params, headers=request_headers, timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            # 内容没有变化，只刷新时间
+            self.stats['revalidated'] += 1
+            entry = dict(entry, fetched_at=now)
+            self._store(key, entry)
+            return json.loads(entry['body']), entry['headers']
+        
+        response.raise_for_status()
+        self.stats['downloaded'] += 1
+        entry = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'headers': {
+                name: response.headers[name]
+                for name in ('Link', 'X-Next-Page')
+                if response.headers.get(name)
+            },
+            'body': response.text,
+            'fetched_at': now
+        }
+        self._store(key, entry)
+        return json.loads(entry['body']), entry['headers']
+
+
+def next_page_request(url, params, headers):
+    """
+    根据分页响应头计算下一页的请求
+    
+    优先使用 Link 头（完整URL，已包含查询参数），否则使用 GitLab 的 X-Next-Page
+    
+    返回:
+        (url, params) 元组，没有下一页时返回 None
+    """
+    link_header = headers.get('Link')
+    if link_header:
+        for link in requests.utils.parse_header_links(link_header):
+            if link.get('rel') == 'next' and link.get('url'):
+                return link['url'], None
+    if headers.get('X-Next-Page'):
+        next_params = dict(params or {})
+        next_params['page'] = headers['X-Next-Page']
+        return url, next_params
+    return None
+
+
+def iter_pages(session, url, params=None, timeout=30, prefetch=True, response_cache=None, last_page=None):
+    """
+    逐页获取分页接口的数据，跟随 Link(rel="next") 或 X-Next-Page 响应头
+    
+    开启 prefetch 时，在调用方处理当前页的同时后台预取下一页，
+    任意时刻最多只持有两页数据
+    
+    参数:
+        session: 共享的HTTP会话
+        url: 第一页的URL
+        params: 第一页的查询参数
+        timeout: 请求超时时间
+        prefetch: 是否预取下一页
+        response_cache: ResponseCache 实例（可选，使用条件请求和短期缓存）
+        last_page: 判断函数（可选），对某一页返回True时不再获取（也不预取）后续页
+    
+    返回:
+        生成器，每次产出一页的JSON列表
+    """
+    def fetch(page_url, page_params):
+        if response_cache is not None:
+            data, headers = response_cache.get(session, page_url, page_params, timeout)
+        else:
+            page_response = session.get(page_url, params=page_params, timeout=timeout)
+            page_response.raise_for_status()
+            data, headers = page_response.json(), page_response.headers
+        return data, next_page_request(page_url, page_params, headers)
+    
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page, next_request = fetch(url, params)
+        while True:
+            if last_page is not None and last_page(page):
+                next_request = None
+            future = None
+            if next_request and executor:
+                future = executor.submit(fetch, *next_request)
+            
+            yield page
+            
+            if not next_request or not page:
+                break
+            if future is not None:
+                page, next_request = future.result()
+            else:
+                page, next_request = fetch(*next_request)
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_commit_items(session, api_base_url, project_id, platform='gitlab', ref_name=None, page_size=100, max_commits=None,
+                      prefetch=True, since_sha=None, response_cache=None):
+    """
+    流式获取提交列表接口返回的原始提交对象，自动翻页
+    
+    参数:
+        session: 共享的HTTP会话
+        api_base_url: API基础URL
+        project_id: 项目ID（GitLab）或仓库路径（GitHub格式：owner/repo）
+        platform: 平台类型，'gitlab' 或 'github'
+        ref_name: 分支或标签名称（可选）
+        page_size: 每页数量（GitLab/GitHub 最大 100）
+        max_commits: 最多产出的提交数量（None 表示遍历全部历史）
+        prefetch: 是否在处理当前页时预取下一页
+        since_sha: 水位线提交SHA（可选），遇到该提交即停止翻页，只产出比它新的提交
+        response_cache: ResponseCache 实例（可选，列表请求使用 ETag/Last-Modified 条件请求）
+    
+    返回:
+        生成器，逐条产出API返回的提交对象（由调用方格式化）
+    """
+    pager = CommitPager(max_commits, since_sha)
+    url, params = build_commits_request(api_base_url, project_id, platform, pager.page_size(page_size), ref_name)
+    
+    pages = iter_pages(session, url, params, prefetch=prefetch, response_cache=response_cache, last_page=pager.last_page)
+    try:
+        for page in pages:
+            yield from pager.take(page)
+            if pager.done:
+                return
+    finally:
+        pages.close()
+
+
+class CommitPager:
+    """
+    提交列表翻页的停止条件：数量上限和水位线
+    （iter_commit_items 和 async_fetcher.iter_commits 共用）
+    """
+    
+    def __init__(self, max_commits=None, since_sha=None):
+        """
+        参数:
+            max_commits: 最多产出的提交数量（None 表示不限制）
+            since_sha: 水位线提交SHA（可选），遇到该提交即停止
+        """
+        self.max_commits = max_commits
+        self.since_sha = since_sha
+        self.received = 0
+        self.count = 0
+        self.done = False
+    
+    def page_size(self, page_size):
+        """每页请求的数量（不超过数量上限和接口的最大值100）"""
+        if self.max_commits is not None:
+            page_size = min(page_size, self.max_commits)
+        return max(1, min(page_size, 100))
+    
+    def last_page(self, page):
+        """已够数量或本页包含水位线时返回 True，不再请求（也不预取）后续页"""
+        self.received += len(page)
+        if self.max_commits is not None and self.received >= self.max_commits:
+            return True
+        return bool(self.since_sha) and any((item.get('id') or item.get('sha')) == self.since_sha for item in page)
+    
+    def take(self, page):
+        """
+        返回本页中需要产出的提交，达到数量上限或遇到水位线时设置 done
+        
+        返回:
+            API返回的提交对象列表
+        """
+        items = []
+        for commit_item in page:
+            if self.max_commits is not None and self.count >= self.max_commits:
+                self.done = True
+                break
+            if self.since_sha and (commit_item.get('id') or commit_item.get('sha')) == self.since_sha:
+                self.done = True
+                break
+            items.append(commit_item)
+            self.count += 1
+        return items
+
+
+def write_ndjson_record(output, record):
+    """
+    以NDJSON格式写出一条记录（紧凑JSON + 换行），立即刷新，下游可以边获取边处理
+    
+    参数:
+        output: 可写的文本文件对象
+        record: 可JSON序列化的对象（可以包含提交记录）
+    """
+    output.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=json_default))
+    output.write('\n')
+    output.flush()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Git提交内容获取工具 - asyncio 版本
+与 reviews_scraper 中的同步函数返回相同结构的字典，适合嵌入 asyncio 服务，
+在一个事件循环里并发处理大量项目。提交列表和diff与同步版本一样跟随
+Link / X-Next-Page 翻页，diff 同样按 byte_budget 省略超出预算的文件
+
+依赖 aiohttp（可选依赖）：pip install aiohttp
+"""
+
+import asyncio
+import json
+from urllib.parse import quote
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp 是可选依赖，只有使用本模块时才需要
+    aiohttp = None
+
+from api_client import CommitPager, build_commits_request, next_page_request
+from records import CommitDiff
+from reviews_scraper import (
+    DIFF_PAGE_SIZE,
+    _limit_diff_bytes,
+    format_commit_item,
+    parse_diff_files,
+    resolve_api_base_url,
+)
+
+
+class ApiError(Exception):
+    """接口返回了错误状态码"""
+    
+    def __init__(self, status, reason, body=b''):
+        super().__init__(f'{status} {reason}')
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+
+def create_session(platform='gitlab', access_token=None, pool_size=10, timeout=30):
+    """
+    创建共享的 aiohttp 会话（连接池 + keep-alive）
+    
+    参数:
+        platform: 平台类型，'gitlab' 或 'github'
+        access_token: API访问令牌（写入会话默认请求头）
+        pool_size: 每个主机的连接池大小
+        timeout: 请求超时时间（秒）
+    
+    返回:
+        aiohttp.ClientSession 对象（需在事件循环中调用，用完后 await session.close()）
+    """
+    if aiohttp is None:
+        raise RuntimeError('async_fetcher 需要 aiohttp，请先执行: pip install aiohttp')
+    
+    if platform == 'github':
+        headers = {
+            'Accept': 'application/vnd.github.v3+json',
+            'Content-Type': 'application/json'
+        }
+        if access_token:
+            headers['Authorization'] = f'token {access_token}'
+    else:  # GitLab
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        if access_token:
+            headers['Authorization'] = f'Bearer {access_token}'
+    
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=pool_size)
+    return aiohttp.ClientSession(
+        headers=headers,
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout)
+    )
+
+
+async def get_commit_diff(api_base_url, project_id, commit_id, access_token, platform='gitlab', session=None, semaphore=None,
+                          rate_limiter=None, byte_budget=None):
+    """
+    获取单个提交的diff内容（异步）
+    
+    参数:
+        api_base_url: API基础URL
+        project_id: 项目ID
+        commit_id: 提交ID（GitLab）或SHA（GitHub）
+        access_token: API访问令牌
+        platform: 平台类型
+        session: 共享的 aiohttp 会话（可选，不传则临时创建）
+        semaphore: 限制并发请求数的 asyncio.Semaphore（可选）
+        rate_limiter: 共享的 reviews_scraper.RateLimiter（可选）
+        byte_budget: 本提交保留的diff总字节数上限（可选），超出预算的文件只保留增删行数（见 reviews_scraper.iter_commit_diff_files）
+    
+    返回:
+        与 reviews_scraper.get_commit_diff 相同的 CommitDiff 记录（分页取回全部文件）
+    """
+    result = CommitDiff(platform=platform)
+    
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
+    
+    try:
+        if platform == 'gitlab':
+            url = f'{api_base_url}/projects/{project_id}/repository/commits/{commit_id}/diff'
+        else:  # GitHub
+            url = f'{api_base_url}/repos/{project_id}/commits/{commit_id}'
+        
+        files = []
+        async for page in _iter_pages(session, url, {'per_page': DIFF_PAGE_SIZE}, semaphore, rate_limiter):
+            files.extend(parse_diff_files(page, platform))
+        result.files = list(_limit_diff_bytes(files, byte_budget))
+        result.success = True
+    
+    except (ApiError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        result['error'] = f'获取diff失败: {str(e)}'
+    finally:
+        if own_session:
+            await session.close()
+    
+    return result
+
+
+async def get_file_content_at_commit(api_base_url, project_id, commit_id, file_path, access_token, platform='gitlab', session=None,
+                                     semaphore=None, rate_limiter=None, blob_id=None):
+    """
+    获取文件在特定commit时的完整内容（异步）
+    
+    参数:
+        api_base_url: API基础URL
+        project_id: 项目ID
+        commit_id: 提交ID（GitLab）或SHA（GitHub）
+        file_path: 文件路径
+        access_token: API访问令牌
+        platform: 平台类型
+        session: 共享的 aiohttp 会话（可选，不传则临时创建）
+        semaphore: 限制并发请求数的 asyncio.Semaphore（可选）
+        rate_limiter: 共享的 reviews_scraper.RateLimiter（可选）
+        blob_id: 文件的blob SHA（可选，GitHub 按路径取不到时改用 git blob 接口）
+    
+    返回:
+        文件内容字符串，失败返回None
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
+    
+    try:
+        if platform == 'gitlab':
+            url = f'{api_base_url}/projects/{project_id}/repository/files/{quote(file_path, safe="")}/raw'
+            status, _, body, _ = await _fetch(
+                session, url, params={'ref': commit_id},
+                semaphore=semaphore, rate_limiter=rate_limiter
+            )
+            return body.decode('utf-8') if status == 200 else None
+        
+        # GitHub：raw 媒体类型直接返回文件内容，不经过JSON和base64
+        url = f'{api_base_url}/repos/{project_id}/contents/{quote(file_path, safe="/")}'
+        raw_headers = {'Accept': 'application/vnd.github.raw'}
+        status, _, body, _ = await _fetch(
+            session, url, params={'ref': commit_id}, headers=raw_headers,
+            semaphore=semaphore, rate_limiter=rate_limiter
+        )
+        if status != 200 and blob_id:
+            status, _, body, _ = await _fetch(
+                session, f'{api_base_url}/repos/{project_id}/git/blobs/{blob_id}', headers=raw_headers,
+                semaphore=semaphore, rate_limiter=rate_limiter
+            )
+        return body.decode('utf-8', errors='replace') if status == 200 else None
+    except Exception:
+        return None
+    finally:
+        if own_session:
+            await session.close()
+
+
+async def iter_commits(access_token, project_id, platform='gitlab', base_url=None, ref_name=None, page_size=100,
+                       max_commits=None, session=None, since_sha=None, semaphore=None, rate_limiter=None):
+    """
+    流式获取提交列表，自动翻页，逐条产出格式化后的提交（异步版 reviews_scraper.iter_commits）
+    
+    参数:
+        access_token: API访问令牌
+        project_id: 项目ID（GitLab）或仓库路径（GitHub格式：owner/repo）
+        platform: 平台类型，'gitlab' 或 'github'
+        base_url: 自定义API基础URL
+        ref_name: 分支或标签名称（可选）
+        page_size: 每页数量（GitLab/GitHub 最大 100）
+        max_commits: 最多产出的提交数量（None 表示遍历全部历史）
+        session: 共享的 aiohttp 会话（可选，不传则内部创建并在遍历结束时关闭）
+        since_sha: 水位线提交SHA（可选），遇到该提交即停止翻页，只产出比它新的提交
+        semaphore: 限制并发请求数的 asyncio.Semaphore（可选）
+        rate_limiter: 共享的 reviews_scraper.RateLimiter（可选）
+    
+    返回:
+        异步生成器，逐条产出 format_commit_item 格式的提交；请求失败时抛出 ApiError
+    """
+    platform = platform.lower()
+    api_base_url = resolve_api_base_url(platform, base_url)
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
+    
+    pager = CommitPager(max_commits, since_sha)
+    url, params = build_commits_request(api_base_url, project_id, platform, pager.page_size(page_size), ref_name)
+    pages = _iter_pages(session, url, params, semaphore, rate_limiter, last_page=pager.last_page)
+    try:
+        async for page in pages:
+            for commit_item in pager.take(page):
+                yield format_commit_item(commit_item, platform)
+            if pager.done:
+                return
+    finally:
+        await pages.aclose()
+        if own_session:
+            await session.close()
+
+
+async def fetch_commits(access_token, project_id, platform='gitlab', base_url=None, per_page=20, ref_name=None,
+                        include_diff=True, session=None, semaphore=None, concurrency=10, rate_limiter=None, byte_budget=None):
+    """
+    获取Git项目的最新提交内容（异步版 main）
+    
+    参数:
+        access_token: API访问令牌
+        project_id: 项目ID（GitLab）或仓库路径（GitHub格式：owner/repo）
+        platform: 平台类型，'gitlab' 或 'github'
+        base_url: 自定义API基础URL
+        per_page: 返回的提交数量，超过单页上限（100）时自动翻页
+        ref_name: 分支或标签名称（可选）
+        include_diff: 是否获取每个提交的diff
+        session: 共享的 aiohttp 会话（可选，不传则本次调用内部创建并在结束时关闭）
+        semaphore: 共享的 asyncio.Semaphore（可选，多个项目共用时可限制全局并发）
+        concurrency: 未传 semaphore 时，本次调用内部的最大并发请求数
+        rate_limiter: 共享的 reviews_scraper.RateLimiter（可选，按服务端限流响应头控制请求速率）
+        byte_budget: 每个提交保留的diff总字节数上限（可选）
+    
+    返回:
+        与 reviews_scraper.main 相同结构的字典:
+        {
+            'success': bool,
+            'commits': list,
+            'count': int,
+            'error': str
+        }
+    """
+    response = {
+        'success': False,
+        'commits': [],
+        'count': 0,
+        'error': None
+    }
+    
+    if not access_token or not project_id:
+        response['error'] = '缺少必需参数: access_token 和 project_id'
+        return response
+    
+    platform = platform.lower()
+    api_base_url = resolve_api_base_url(platform, base_url)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(concurrency)
+    
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token, pool_size=concurrency)
+    
+    try:
+        formatted_commits = [
+            commit_data
+            async for commit_data in iter_commits(
+                access_token, project_id, platform, base_url,
+                ref_name=ref_name, page_size=per_page, max_commits=per_page,
+                session=session, semaphore=semaphore, rate_limiter=rate_limiter
+            )
+        ]
+        
+        if include_diff:
+            # 并发获取所有diff，gather 保证结果顺序与提交列表一致
+            diff_results = await asyncio.gather(*[
+                get_commit_diff(
+                    api_base_url, project_id,
+                    commit_data.get('id') or commit_data.get('sha'),
+                    access_token, platform,
+                    session=session, semaphore=semaphore,
+                    rate_limiter=rate_limiter, byte_budget=byte_budget
+                )
+                for commit_data in formatted_commits
+            ])
+            for commit_data, diff_result in zip(formatted_commits, diff_results):
+                if diff_result['success']:
+                    commit_data['diff'] = diff_result
+                    commit_data['files_changed'] = diff_result['files']
+                else:
+                    commit_data['diff'] = {'error': diff_result['error']}
+        
+        response['success'] = True
+        response['commits'] = formatted_commits
+        response['count'] = len(formatted_commits)
+    
+    except ApiError as e:
+        response['error'] = f'API请求失败: {e.status} {e.reason} - {e.body.decode("utf-8", "replace")}'
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        response['error'] = f'网络请求错误: {str(e)}'
+    except ValueError as e:
+        response['error'] = f'API响应解析失败: {str(e)}'
+    except Exception as e:
+        response['error'] = f'发生错误: {str(e)}'
+    finally:
+        if own_session:
+            await session.close()
+    
+    return response
+
+
+async def fetch_many(projects, concurrency=20, rate_limiter=None):
+    """
+    在同一个事件循环中并发获取多个项目的提交
+    
+    参数:
+        projects: 项目参数字典列表，每项为 fetch_commits 的关键字参数
+                  （至少包含 access_token 和 project_id）
+        concurrency: 所有项目合计的最大并发请求数
+        rate_limiter: 所有项目共享的 reviews_scraper.RateLimiter（可选）
+    
+    返回:
+        结果字典列表，顺序与 projects 一致
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    sessions = {}
+    
+    try:
+        tasks = []
+        for project in projects:
+            platform = project.get('platform', 'gitlab')
+            # 相同平台和令牌的项目共享一个会话（连接池）
+            key = (platform, project.get('access_token'))
+            if key not in sessions:
+                sessions[key] = create_session(platform, project.get('access_token'), pool_size=concurrency)
+            tasks.append(fetch_commits(
+                **project, session=sessions[key], semaphore=semaphore, rate_limiter=rate_limiter
+            ))
+        return await asyncio.gather(*tasks)
+    finally:
+        for session in sessions.values():
+            await session.close()
+
+
+async def _iter_pages(session, url, params=None, semaphore=None, rate_limiter=None, last_page=None):
+    """
+    逐页获取分页接口的数据，跟随 Link(rel="next") 或 X-Next-Page 响应头（与 api_client.iter_pages 相同）
+    
+    参数:
+        last_page: 判断函数（可选），对某一页返回True时不再获取后续页
+    
+    返回:
+        异步生成器，每次产出一页的JSON；请求失败时抛出 ApiError
+    """
+    next_request = (url, params)
+    while next_request:
+        page_url, page_params = next_request
+        status, reason, body, headers = await _fetch(
+            session, page_url, params=page_params,
+            semaphore=semaphore, rate_limiter=rate_limiter
+        )
+        if status >= 400:
+            raise ApiError(status, reason, body)
+        page = json.loads(body)
+        next_request = next_page_request(page_url, page_params, headers)
+        if not page or (last_page is not None and last_page(page)):
+            next_request = None
+        yield page
+
+
+async def _fetch(session, url, params=None, semaphore=None, rate_limiter=None, max_retries=3, headers=None):
+    """
+    发送GET请求并读取完整响应体，按限流器控制速率，遇到429时按 Retry-After 重试
+    
+    返回:
+        (status, reason, body, headers) 元组
+    """
+    for attempt in range(max_retries + 1):
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            if rate_limiter is not None:
+                wait = rate_limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            async with session.get(url, params=params, headers=headers) as response:
+                body = await response.read()
+                retry_after = None
+                if rate_limiter is not None:
+                    retry_after = rate_limiter.update(response.headers, response.status)
+                status, reason, response_headers = response.status, response.reason, response.headers
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+        
+        limited = status == 429 or (status == 403 and retry_after is not None)
+        if not limited or attempt == max_retries:
+            break
+        if rate_limiter is None:
+            # 没有限流器时简单退避
+            await asyncio.sleep(2 ** attempt)
+    
+    return status, reason, body, response_headers
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多项目批量获取提交
+一个配置文件列出多个项目和分支，在同一个进程中统一调度：
+- 同一主机的项目共享连接池和限流器
+- 按主机限制同时进行的请求数，按项目限制同时处理的分支数
+- 输出一份汇总报告和每个项目的状态
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from diff_cache import DiffCache, cache_host
+from records import json_default
+from reviews_scraper import (
+    RateLimiter,
+    create_session,
+    load_config,
+    main,
+    resolve_api_base_url,
+)
+
+# 每个项目可以覆盖的键（未填写时使用配置文件顶层的同名键）
+PROJECT_KEYS = ['access_token', 'platform', 'base_url', 'per_page', 'include_diff', 'jobs', 'repo_path']
+
+
+def load_batch_config(config_file='batch_config.json'):
+    """
+    读取批量配置文件
+    
+    参数:
+        config_file: 配置文件路径，默认 'batch_config.json'
+    
+    返回:
+        (defaults, projects) 元组：
+        defaults 为顶层配置（与 reviews_scraper.load_config 的键相同，另加调度相关的键），
+        projects 为项目列表，每项至少包含 project_id（本地仓库为 repo_path），
+        可以用 refs 列出多个分支
+    """
+    with open(config_file, 'r', encoding='utf-8') as f:
+        user_config = json.load(f)
+    
+    defaults = load_config(config_file)
+    defaults['max_per_host'] = user_config.get('max_per_host', 8)
+    defaults['max_per_project'] = user_config.get('max_per_project', 1)
+    defaults['max_workers'] = user_config.get('max_workers', 8)
+    defaults['report_dir'] = user_config.get('report_dir', '批量获取报告')
+    return defaults, user_config.get('projects', [])
+
+
+def expand_tasks(defaults, projects):
+    """
+    把项目列表展开为 (项目, 分支) 任务列表
+    
+    返回:
+        任务字典列表，每项包含 main 所需的全部参数以及 name
+    """
+    tasks = []
+    for project in projects:
+        refs = project.get('refs') or [project.get('ref_name') or defaults.get('ref_name')]
+        for ref_name in refs:
+            task = {key: project.get(key, defaults.get(key)) for key in PROJECT_KEYS}
+            task['platform'] = (task['platform'] or 'gitlab').lower()
+            task['project_id'] = project.get('project_id')
+            task['ref_name'] = ref_name
+            task['name'] = project.get('name') or str(project.get('project_id') or project.get('repo_path'))
+            tasks.append(task)
+    return tasks
+
+
+def run_batch(defaults, projects, config_file='batch_config.json'):
+    """
+    在一个进程中获取所有项目的提交
+    
+    参数:
+        defaults: 顶层配置（load_batch_config 的第一个返回值）
+        projects: 项目列表（load_batch_config 的第二个返回值）
+        config_file: 传给 main 的配置文件（未填写的参数从中读取）
+    
+    返回:
+        每个任务的结果字典列表，顺序与展开后的任务一致:
+        {
+            'name': str, 'project_id': ..., 'ref_name': str,
+            'success': bool, 'count': int, 'error': str,
+            'elapsed': float,  # 耗时（秒）
+            'commits': list
+        }
+    """
+    tasks = expand_tasks(defaults, projects)
+    
+    sessions = {}
+    host_limits = {}
+    project_limits = {}
+    lock = threading.Lock()
+    
+    diff_cache = DiffCache(defaults['diff_cache']) if defaults.get('diff_cache') else None
+    
+    def session_for(task):
+        """同一主机共享信号量和限流器，不同令牌各用一个会话（请求头不同）"""
+        api_base_url = resolve_api_base_url(task['platform'], task['base_url'])
+        host = cache_host(api_base_url)
+        with lock:
+            if host not in host_limits:
+                host_limits[host] = (
+                    threading.BoundedSemaphore(defaults['max_per_host']),
+                    RateLimiter(rate=defaults.get('rate_limit', 10), burst=defaults['max_per_host'])
+                )
+            key = (host, task['platform'], task['access_token'])
+            if key not in sessions:
+                semaphore, rate_limiter = host_limits[host]
+                sessions[key] = create_session(
+                    task['platform'], task['access_token'],
+                    pool_size=defaults['max_per_host'],
+                    rate_limiter=rate_limiter,
+                    semaphore=semaphore
+                )
+            return sessions[key]
+    
+    def run_task(task):
+        project_key = (task['platform'], task['base_url'], task['project_id'] or task['repo_path'])
+        with lock:
+            if project_key not in project_limits:
+                project_limits[project_key] = threading.BoundedSemaphore(defaults['max_per_project'])
+            project_limit = project_limits[project_key]
+        
+        with project_limit:
+            start = time.monotonic()
+            result = main(
+                access_token=task['access_token'],
+                project_id=task['project_id'],
+                platform=task['platform'],
+                base_url=task['base_url'],
+                per_page=task['per_page'],
+                ref_name=task['ref_name'],
+                include_diff=task['include_diff'],
+                config_file=config_file,
+                session=None if task['platform'] == 'local' else session_for(task),
+                jobs=task['jobs'],
+                diff_cache=diff_cache,
+                repo_path=task['repo_path']
+            )
+            elapsed = time.monotonic() - start
+        
+        return {
+            'name': task['name'],
+            'project_id': task['project_id'],
+            'ref_name': task['ref_name'],
+            'success': result['success'],
+            'count': result['count'],
+            'error': result['error'],
+            'elapsed': round(elapsed, 2),
+            'commits': result['commits']
+        }
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, defaults['max_workers'])) as executor:
+            return list(executor.map(run_task, tasks))
+    finally:
+        for session in sessions.values():
+            session.close()
+        if diff_cache is not None:
+            diff_cache.close()
+
+
+def format_summary(results):
+    """
+    生成每个项目的状态汇总（纯文本表格）
+    
+    返回:
+        多行字符串
+    """
+    lines = [f"{'项目':<24}{'分支':<24}{'状态':<6}{'提交数':>6}{'耗时(秒)':>10}  错误"]
+    lines.append('-' * 80)
+    for item in results:
+        status = '成功' if item['success'] else '失败'
+        lines.append(
+            f"{item['name']:<24}{str(item['ref_name'] or '默认'):<24}{status:<6}"
+            f"{item['count']:>6}{item['elapsed']:>10.2f}  {item['error'] or ''}"
+        )
+    succeeded = sum(1 for item in results if item['success'])
+    lines.append('-' * 80)
+    lines.append(f"共 {len(results)} 个任务，成功 {succeeded}，失败 {len(results) - succeeded}，"
+                 f"提交 {sum(item['count'] for item in results)} 条")
+    return '\n'.join(lines)
+
+
+def save_report(results, report_dir='批量获取报告', output_file=None):
+    """
+    把所有项目的结果保存为一份JSON汇总报告
+    
+    参数:
+        results: run_batch 的返回值
+        report_dir: 报告目录（output_file 未指定时使用）
+        output_file: 报告文件路径（可选，默认 报告目录/批量获取_时间.json）
+    
+    返回:
+        报告文件路径
+    """
+    if output_file is None:
+        os.makedirs(report_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_file = os.path.join(report_dir, f'批量获取_{timestamp}.json')
+    
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'total': len(results),
+        'succeeded': sum(1 for item in results if item['success']),
+        'projects': results
+    }
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=json_default)
+    return output_file
+
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='批量获取多个项目的最新提交')
+    parser.add_argument('--config', default='batch_config.json', help='批量配置文件路径（默认: batch_config.json）')
+    parser.add_argument('--output', help='汇总报告路径（默认保存到 批量获取报告/ 目录）')
+    parser.add_argument('--max-per-host', type=int, help='每个主机同时进行的最大请求数（覆盖配置文件）')
+    parser.add_argument('--max-workers', type=int, help='同时处理的任务数（覆盖配置文件）')
+    
+    args = parser.parse_args()
+    defaults, projects = load_batch_config(args.config)
+    if args.max_per_host:
+        defaults['max_per_host'] = args.max_per_host
+    if args.max_workers:
+        defaults['max_workers'] = args.max_workers
+    
+    results = run_batch(defaults, projects, config_file=args.config)
+    print(format_summary(results))
+    
+    report_file = save_report(results, defaults['report_dir'], args.output)
+    print(f"\n[成功] 汇总报告已保存到: {report_file}")
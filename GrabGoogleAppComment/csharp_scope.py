@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+C# 作用域索引
+对文件做一次扫描（跳过字符串、字符和注释中的大括号），记录命名空间、类型和方法的行号范围，
+之后每个改动范围的查询只需二分查找，不必为每个hunk重新扫描文件
+"""
+
+import re
+from bisect import bisect_right
+
+NAMESPACE_PATTERN = re.compile(r'\bnamespace\s+([\w.]+)')
+TYPE_PATTERN = re.compile(r'\b(class|struct|interface|record|enum)\s+(\w+)')
+NAME_BEFORE_PAREN = re.compile(r'(\w+)\s*(?:<[^<>()]*(?:<[^<>()]*>[^<>()]*)*>)?\s*$')
+ATTRIBUTES = re.compile(r'\s*(?:\[[^\[\]]*(?:\[[^\[\]]*\][^\[\]]*)*\]\s*)*')
+STRING_PREFIX = re.compile(r'[@$]+"')
+SPECIAL_CHARS = re.compile(r'[{};"\'/@$]')
+
+# 形如 "xxx(...) {" 但不是方法声明的关键字
+NON_METHOD_WORDS = {
+    'if', 'for', 'foreach', 'while', 'switch', 'catch', 'using', 'lock', 'fixed',
+    'return', 'new', 'else', 'do', 'try', 'finally', 'base', 'this', 'when', 'nameof', 'typeof'
+}
+
+
+class Scope:
+    """一个作用域（命名空间、类型或方法）"""
+    
+    __slots__ = ('kind', 'name', 'start', 'end', 'signature', 'class_name', 'namespace')
+    
+    def __init__(self, kind, name, start, signature='', class_name='', namespace=''):
+        self.kind = kind              # 'namespace' / 'type' / 'method' / 'block'
+        self.name = name
+        self.start = start            # 声明所在行（0-based）
+        self.end = None               # 右大括号所在行（0-based）
+        self.signature = signature    # 声明所在行的文本（去掉首尾空白）
+        self.class_name = class_name  # 所在类型
+        self.namespace = namespace    # 所在命名空间的声明行文本
+
+
+class ScopeIndex:
+    """一个C#文件的作用域索引"""
+    
+    def __init__(self, namespaces, types, methods):
+        self.namespaces = namespaces
+        self.types = types
+        self.methods = sorted(methods, key=lambda scope: scope.start)
+        self.method_starts = [scope.start for scope in self.methods]
+    
+    def find_method(self, start_line, end_line):
+        """
+        查找与行号范围相关的方法（0-based）
+        
+        优先返回包含 start_line 的方法；start_line 落在方法之前的上下文行时，
+        返回范围内第一个开始的方法
+        
+        返回:
+            Scope 实例，没有找到时返回 None
+        """
+        i = bisect_right(self.method_starts, start_line) - 1
+        if i >= 0 and self.methods[i].end >= start_line:
+            return self.methods[i]
+        if i + 1 < len(self.methods) and self.methods[i + 1].start <= end_line:
+            return self.methods[i + 1]
+        return None
+    
+    def find_type(self, line):
+        """返回包含某行的最内层类型（类型数量很少，线性查找）"""
+        found = None
+        for scope in self.types:
+            if scope.start <= line <= scope.end and (found is None or scope.start >= found.start):
+                found = scope
+        return found
+    
+    def namespace_at(self, line):
+        """返回包含某行的命名空间声明行文本，没有时返回文件中第一个命名空间"""
+        found = None
+        for scope in self.namespaces:
+            if scope.start <= line <= scope.end and (found is None or scope.start >= found.start):
+                found = scope
+        if found is None and self.namespaces:
+            found = self.namespaces[0]
+        return found.signature if found else ''
+
+
+def build_scope_index(code_lines):
+    """
+    扫描一次C#代码，建立作用域索引
+    
+    参数:
+        code_lines: 代码行列表
+    
+    返回:
+        ScopeIndex 实例
+    """
+    namespaces = []
+    types = []
+    methods = []
+    stack = []
+    last_line = max(len(code_lines) - 1, 0)
+    
+    # 当前声明（上一个 ; { } 之后的代码）及每一段所在的行
+    decl = []
+    decl_lines = []
+    decl_length = 0
+    
+    in_block_comment = False
+    string_end = None  # 跨行的字符串（逐字字符串 @"..." 或原始字符串 """...""" ）的结束标记
+    
+    def reset_decl():
+        nonlocal decl, decl_lines, decl_length
+        decl = []
+        decl_lines = []
+        decl_length = 0
+    
+    def add_decl(text, line_no):
+        nonlocal decl_length
+        if text:
+            decl.append(text)
+            decl_lines.append((decl_length, line_no))
+            decl_length += len(text)
+    
+    def line_of(offset):
+        idx = bisect_right([start for start, _ in decl_lines], offset) - 1
+        return decl_lines[max(idx, 0)][1]
+    
+    def enclosing(kind):
+        for scope in reversed(stack):
+            if scope.kind == kind:
+                return scope
+        return None
+    
+    def current_namespace():
+        namespace = enclosing('namespace')
+        if namespace is not None:
+            return namespace.signature
+        if namespaces and namespaces[-1].end == last_line:
+            return namespaces[-1].signature  # 文件范围的命名空间
+        return ''
+    
+    def method_scope(text):
+        # 跳过声明前面的特性（[HttpGet]、[Obsolete("...")]），方法名是第一个左括号前的标识符
+        body = ATTRIBUTES.match(text).end()
+        paren = text.find('(', body)
+        if paren <= body or '=' in text[body:paren]:
+            return None
+        match = NAME_BEFORE_PAREN.search(text, body, paren)
+        if not match or match.group(1) in NON_METHOD_WORDS:
+            return None
+        name_line = line_of(match.start(1))
+        owner = enclosing('type')
+        return Scope('method', match.group(1), name_line, code_lines[name_line].strip(),
+                     class_name=owner.name if owner else '', namespace=current_namespace())
+    
+    def open_scope(line_no):
+        text = ''.join(decl)
+        parent = stack[-1].kind if stack else None
+        start = line_of(len(text) - len(text.lstrip())) if decl_lines else line_no
+        namespace_text = current_namespace()
+        
+        scope = None
+        if parent in (None, 'namespace'):
+            match = NAMESPACE_PATTERN.search(text)
+            if match:
+                scope = Scope('namespace', match.group(1), start, code_lines[start].strip())
+        if scope is None and parent in (None, 'namespace', 'type'):
+            match = TYPE_PATTERN.search(text)
+            if match:
+                type_line = line_of(match.start())
+                scope = Scope('type', match.group(2), type_line, code_lines[type_line].strip(), namespace=namespace_text)
+        if scope is None and parent == 'type' and '=>' not in text:
+            scope = method_scope(text)
+        if scope is None:
+            scope = Scope('block', '', line_no)
+        stack.append(scope)
+        reset_decl()
+    
+    def close_scope(line_no):
+        if stack:
+            scope = stack.pop()
+            scope.end = line_no
+            if scope.kind == 'namespace':
+                namespaces.append(scope)
+            elif scope.kind == 'type':
+                types.append(scope)
+            elif scope.kind == 'method':
+                methods.append(scope)
+        reset_decl()
+    
+    def end_statement(line_no):
+        text = ''.join(decl)
+        parent = stack[-1].kind if stack else None
+        if parent is None:
+            # 文件范围的命名空间: namespace Foo.Bar;
+            match = NAMESPACE_PATTERN.search(text)
+            if match:
+                start = line_of(match.start())
+                scope = Scope('namespace', match.group(1), start, code_lines[start].strip())
+                scope.end = last_line
+                namespaces.append(scope)
+        elif parent == 'type' and '=>' in text:
+            # 表达式体方法: public override string ToString() => ...;
+            scope = method_scope(text[:text.index('=>')])
+            if scope is not None:
+                scope.end = line_no
+                methods.append(scope)
+        reset_decl()
+    
+    for line_no, line in enumerate(code_lines):
+        if not in_block_comment and string_end is None and line.lstrip().startswith('#'):
+            continue  # 预处理指令
+        
+        i = 0
+        length = len(line)
+        segment_start = 0
+        while i < length:
+            if in_block_comment:
+                close = line.find('*/', i)
+                if close < 0:
+                    i = length
+                    break
+                in_block_comment = False
+                i = segment_start = close + 2
+                continue
+            if string_end is not None:
+                close = _find_string_end(line, i, string_end)
+                if close < 0:
+                    i = length
+                    break
+                i = segment_start = close
+                string_end = None
+                continue
+            
+            # 直接跳到下一个可能改变状态的字符
+            special = SPECIAL_CHARS.search(line, i)
+            if special is None:
+                break
+            i = special.start()
+            ch = line[i]
+            if ch == '/' and line.startswith('//', i):
+                add_decl(line[segment_start:i], line_no)
+                i = segment_start = length
+                break
+            if ch == '/' and line.startswith('/*', i):
+                add_decl(line[segment_start:i], line_no)
+                in_block_comment = True
+                i += 2
+                continue
+            if ch == '"' or (ch in '@$' and STRING_PREFIX.match(line, i)):
+                add_decl(line[segment_start:i] + '""', line_no)
+                i, string_end = _skip_string(line, i)
+                segment_start = i
+                continue
+            if ch == "'":
+                add_decl(line[segment_start:i] + "''", line_no)
+                i = segment_start = _skip_char(line, i)
+                continue
+            if ch in '{};':
+                add_decl(line[segment_start:i], line_no)
+                if ch == '{':
+                    open_scope(line_no)
+                elif ch == '}':
+                    close_scope(line_no)
+                else:
+                    end_statement(line_no)
+                i = segment_start = i + 1
+                continue
+            i += 1
+        
+        if not in_block_comment and string_end is None:
+            add_decl(line[segment_start:] + '\n', line_no)
+        elif string_end is not None:
+            add_decl('\n', line_no)
+    
+    # 没有闭合的作用域（文件不完整）延伸到文件末尾
+    while stack:
+        close_scope(last_line)
+    
+    return ScopeIndex(namespaces, types, methods)
+
+
+def _skip_string(line, i):
+    """
+    跳过从 i 开始的字符串字面量
+    
+    返回:
+        (字符串之后的位置, 跨行时的结束标记或 None)
+    """
+    j = i
+    verbatim = False
+    while line[j] in '@$':
+        verbatim = verbatim or line[j] == '@'
+        j += 1
+    if line.startswith('"""', j):
+        quotes = len(line[j:]) - len(line[j:].lstrip('"'))
+        marker = '"' * quotes
+        close = line.find(marker, j + quotes)
+        return (close + quotes, None) if close >= 0 else (len(line), marker)
+    marker = '@"' if verbatim else '"'
+    close = _find_string_end(line, j + 1, marker)
+    if close >= 0:
+        return close, None
+    # 普通字符串不能跨行，行尾视为结束；逐字字符串继续到下一行
+    return len(line), (marker if verbatim else None)
+
+
+def _find_string_end(line, i, marker):
+    """查找字符串结束位置（返回结束引号之后的位置，没找到时返回 -1）"""
+    if marker == '@"':
+        while True:
+            close = line.find('"', i)
+            if close < 0:
+                return -1
+            if line.startswith('""', close):
+                i = close + 2
+                continue
+            return close + 1
+    if marker == '"':
+        while i < len(line):
+            if line[i] == '\\':
+                i += 2
+                continue
+            if line[i] == '"':
+                return i + 1
+            i += 1
+        return -1
+    close = line.find(marker, i)
+    return close + len(marker) if close >= 0 else -1
+
+
+def _skip_char(line, i):
+    """跳过字符字面量 'x'、'\\n'、'\\u0041'（不是字符字面量时只跳过一个字符）"""
+    j = i + 1
+    if j < len(line) and line[j] == '\\':
+        j += 2
+        while j < len(line) and line[j] != "'" and j - i < 10:
+            j += 1
+    else:
+        j += 1
+    if j < len(line) and line[j] == "'":
+        return j + 1
+    return i + 1
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提交diff的本地持久化缓存
+提交的diff内容永远不会变化，按 (主机, 项目, 提交SHA) 缓存到SQLite中，
+内容使用zlib压缩，多个进程/线程可以安全地共享同一个缓存文件
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlparse
+
+
+class DiffCache:
+    """
+    基于SQLite的diff缓存
+    
+    - WAL模式 + busy_timeout：多个进程可以同时读写
+    - 每个线程使用独立的连接：可以在线程池中直接使用
+    """
+    
+    def __init__(self, path='diff_cache.sqlite3', timeout=30):
+        """
+        参数:
+            path: SQLite数据库文件路径
+            timeout: 等待其他进程释放写锁的最长秒数
+        """
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS commit_diffs (
+                host TEXT NOT NULL,
+                project_id TEXT NOT NULL,
+                sha TEXT NOT NULL,
+                data BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (host, project_id, sha)
+            )
+        ''')
+        conn.commit()
+    
+    def _connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+    
+    def get(self, host, project_id, sha):
+        """
+        读取缓存的diff
+        
+        返回:
+            get_commit_diff 格式的结果字典，未命中返回 None
+        """
+        row = self._connect().execute(
+            'SELECT data FROM commit_diffs WHERE host = ? AND project_id = ? AND sha = ?',
+            (host, str(project_id), sha)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+    
+    def put(self, host, project_id, sha, diff_result):
+        """
+        写入diff（只应缓存获取成功的结果）
+        
+        参数:
+            host: API主机
+            project_id: 项目ID
+            sha: 提交SHA
+            diff_result: get_commit_diff 返回结果的字典形式（CommitDiff.to_dict，可不含 diff_text）
+        """
+        data = zlib.compress(json.dumps(diff_result, ensure_ascii=False).encode('utf-8'))
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO commit_diffs (host, project_id, sha, data, created_at) VALUES (?, ?, ?, ?, ?)',
+                (host, str(project_id), sha, sqlite3.Binary(data), time.time())
+            )
+    
+    def close(self):
+        """关闭所有线程打开的连接"""
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+
+def cache_host(api_base_url):
+    """从API基础URL中取出缓存使用的主机名（含端口）"""
+    return urlparse(api_base_url).netloc or api_base_url
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+unified diff 解析
+一次顺序扫描得到所有hunk（含新旧行号对应关系）、新增/删除行数和改动行号集合，
+GitLab 的 diff 字段、GitHub 的 patch 字段和本地 git log --patch 的内容都可以直接解析
+"""
+
+import hashlib
+import re
+
+HUNK_HEADER = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+class Hunk:
+    """一个hunk：头部的行号范围，以及每一行的类型（' ' 上下文、'+' 新增、'-' 删除）"""
+    
+    __slots__ = ('old_start', 'old_count', 'new_start', 'new_count', 'ops')
+    
+    def __init__(self, old_start, old_count, new_start, new_count, ops=''):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.ops = ops
+    
+    @property
+    def old_end(self):
+        return self.old_start + self.old_count - 1
+    
+    @property
+    def new_end(self):
+        return self.new_start + self.new_count - 1
+    
+    def line_pairs(self):
+        """
+        逐行产出新旧行号的对应关系
+        
+        返回:
+            生成器，每行产出 (旧行号, 新行号)，新增行的旧行号和删除行的新行号为 None
+        """
+        old_line, new_line = self.old_start, self.new_start
+        for op in self.ops:
+            if op == '+':
+                yield None, new_line
+                new_line += 1
+            elif op == '-':
+                yield old_line, None
+                old_line += 1
+            else:
+                yield old_line, new_line
+                old_line += 1
+                new_line += 1
+
+
+class ParsedDiff:
+    """一个文件diff的解析结果"""
+    
+    __slots__ = ('hunks', 'additions', 'deletions', 'added_lines', 'removed_lines')
+    
+    def __init__(self):
+        self.hunks = []
+        self.additions = 0
+        self.deletions = 0
+        self.added_lines = set()    # 新增行在新文件中的行号
+        self.removed_lines = set()  # 删除行在旧文件中的行号
+    
+    @property
+    def ranges(self):
+        """每个hunk的行号范围: [(old_start, old_end, new_start, new_end), ...]"""
+        return [(h.old_start, h.old_end, h.new_start, h.new_end) for h in self.hunks]
+
+
+def parse_diff(diff):
+    """
+    解析一个文件的 unified diff（一次扫描）
+    
+    参数:
+        diff: diff 文本，或已经按行拆分的可迭代对象（行尾不含换行符）
+              hunk 之前的 diff --git / --- / +++ 等文件头会被忽略
+    
+    返回:
+        ParsedDiff 实例
+    """
+    result = ParsedDiff()
+    if not diff:
+        return result
+    lines = diff.split('\n') if isinstance(diff, str) else diff
+    
+    hunk = None
+    ops = []
+    old_left = new_left = 0
+    old_line = new_line = 0
+    
+    for line in lines:
+        if line.startswith('@@'):
+            match = HUNK_HEADER.match(line)
+            if match:
+                if hunk is not None:
+                    hunk.ops = ''.join(ops)
+                old_start, new_start = int(match.group(1)), int(match.group(3))
+                old_left = int(match.group(2) or 1)
+                new_left = int(match.group(4) or 1)
+                hunk = Hunk(old_start, old_left, new_start, new_left)
+                result.hunks.append(hunk)
+                ops = []
+                old_line, new_line = old_start, new_start
+                continue
+        # hunk 的行数用完后（例如下一个文件的文件头、提交之间的空行）不再属于diff内容
+        if hunk is None or (old_left <= 0 and new_left <= 0):
+            continue
+        
+        first = line[:1]
+        if first == '+':
+            result.additions += 1
+            result.added_lines.add(new_line)
+            new_line += 1
+            new_left -= 1
+        elif first == '-':
+            result.deletions += 1
+            result.removed_lines.add(old_line)
+            old_line += 1
+            old_left -= 1
+        elif first == '\\':
+            continue  # "\ No newline at end of file"
+        else:
+            # 上下文行（有的工具会去掉空行前面的空格）
+            first = ' '
+            old_line += 1
+            new_line += 1
+            old_left -= 1
+            new_left -= 1
+        ops.append(first)
+    
+    if hunk is not None:
+        hunk.ops = ''.join(ops)
+    return result
+
+
+def split_hunks(diff):
+    """
+    按hunk边界拆分diff文本（hunk的识别方式与 parse_diff 相同，第 i 段对应 parse_diff 的第 i 个hunk）
+    
+    参数:
+        diff: diff 文本
+    
+    返回:
+        (第一个hunk之前的文件头文本, [每个hunk的文本（含 @@ 头部行）, ...])
+    """
+    lines = diff.split('\n')
+    starts = [i for i, line in enumerate(lines) if line.startswith('@@') and HUNK_HEADER.match(line)]
+    if not starts:
+        return diff, []
+    bounds = starts + [len(lines)]
+    return '\n'.join(lines[:starts[0]]), ['\n'.join(lines[a:b]) for a, b in zip(bounds, bounds[1:])]
+
+
+def patch_id(files):
+    """
+    计算一组文件改动的补丁指纹（思路与 git patch-id 相同）
+    
+    只使用文件路径、改动类型和新增/删除的行，忽略hunk头部的行号、上下文行和所有空白，
+    因此 cherry-pick 到其他分支（行号、上下文不同）或回退后重新提交的同一改动得到相同的指纹
+    
+    参数:
+        files: 文件改动列表（含 old_path、new_path、change_type、diff）
+    
+    返回:
+        40位十六进制字符串；没有任何文件时返回 None
+    """
+    if not files:
+        return None
+    digest = hashlib.sha1()
+    for file_info in sorted(files, key=lambda f: (f.get('new_path') or '', f.get('old_path') or '')):
+        header = f"{file_info.get('old_path', '')}\0{file_info.get('new_path', '')}\0{file_info.get('change_type', '')}\n"
+        digest.update(header.encode('utf-8'))
+        diff = file_info.get('diff')
+        if not diff:
+            # 没有diff内容（二进制文件、超出预算被省略）时用大小和行数区分
+            stats = f"{file_info.get('diff_omitted')}\0{file_info.get('additions')}\0{file_info.get('deletions')}\n"
+            digest.update(stats.encode('utf-8'))
+            continue
+        in_hunk = False
+        for line in diff.split('\n'):
+            if line.startswith('@@') and HUNK_HEADER.match(line):
+                in_hunk = True
+            elif in_hunk and line[:1] in ('+', '-'):
+                digest.update((line[0] + ''.join(line[1:].split()) + '\n').encode('utf-8'))
+    return digest.hexdigest()
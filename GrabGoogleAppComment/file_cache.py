@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提交时文件内容的两级缓存（内存LRU + 磁盘）
+优先按blob标识缓存（同一份文件内容在多个提交/分支之间共享），
+没有blob标识时按 提交 + 路径 缓存
+"""
+
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+
+def make_key(host, project_id, blob_id=None, commit_id=None, file_path=None):
+    """
+    生成文件内容的缓存键
+    
+    GitHub 的提交接口返回每个文件的blob SHA，按blob缓存；GitLab 的 diff 接口不返回blob标识
+    （单独查询每个文件的blob需要额外请求，抵消了缓存的收益），因此 GitLab 的文件总是按 提交 + 路径 缓存，
+    不同提交中内容相同的文件不共享缓存
+    
+    参数:
+        host: API主机
+        project_id: 项目ID
+        blob_id: 文件的blob SHA（可选，优先使用）
+        commit_id: 提交ID（没有blob_id时使用）
+        file_path: 文件路径（没有blob_id时使用）
+    
+    返回:
+        字符串键
+    """
+    if blob_id:
+        return f'{host}|{project_id}|blob:{blob_id}'
+    return f'{host}|{project_id}|{commit_id}:{file_path}'
+
+
+class FileContentCache:
+    """
+    文件内容缓存
+    
+    - 内存层：按字节数限制的LRU
+    - 磁盘层（可选）：zlib压缩后保存在目录中，按字节数限制，淘汰最久未访问的文件
+    - stats 记录各层的命中/未命中/淘汰次数
+    """
+    
+    def __init__(self, memory_bytes=64 * 1024 * 1024, disk_dir=None, disk_bytes=512 * 1024 * 1024):
+        """
+        参数:
+            memory_bytes: 内存层的最大字节数（按UTF-8编码后的大小计算）
+            disk_dir: 磁盘层目录（None 表示只使用内存层）
+            disk_bytes: 磁盘层的最大字节数（按压缩后的文件大小计算）
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.lock = threading.Lock()
+        
+        self.memory = OrderedDict()  # key -> (content, size)
+        self.memory_used = 0
+        self.disk = OrderedDict()  # 文件名 -> 大小，按最近访问排序
+        self.disk_used = 0
+        
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0
+        }
+        
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+    
+    def _load_disk_index(self):
+        """启动时扫描磁盘层目录，按访问时间重建LRU顺序"""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.z'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.disk_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self.disk[name] = size
+            self.disk_used += size
+    
+    def get(self, key):
+        """
+        读取缓存
+        
+        返回:
+            文件内容字符串，未命中返回 None
+        """
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry[0]
+        
+        content = self._disk_get(key)
+        with self.lock:
+            if content is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['disk_hits'] += 1
+            self._memory_put(key, content)
+        return content
+    
+    def put(self, key, content):
+        """写入缓存（内存层和磁盘层）"""
+        if content is None:
+            return
+        with self.lock:
+            self._memory_put(key, content)
+        self._disk_put(key, content)
+    
+    def _memory_put(self, key, content):
+        """写入内存层（调用方需持有锁）"""
+        size = len(content.encode('utf-8'))
+        if size > self.memory_bytes:
+            return
+        old = self.memory.pop(key, None)
+        if old is not None:
+            self.memory_used -= old[1]
+        self.memory[key] = (content, size)
+        self.memory_used += size
+        while self.memory_used > self.memory_bytes:
+            _, (_, evicted_size) = self.memory.popitem(last=False)
+            self.memory_used -= evicted_size
+            self.stats['memory_evictions'] += 1
+    
+    def _disk_name(self, key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest() + '.z'
+    
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        name = self._disk_name(key)
+        path = os.path.join(self.disk_dir, name)
+        try:
+            with open(path, 'rb') as f:
+                content = zlib.decompress(f.read()).decode('utf-8')
+            os.utime(path)  # 更新访问时间，重启后仍能保持LRU顺序
+        except (OSError, zlib.error, UnicodeDecodeError):
+            return None
+        with self.lock:
+            if name in self.disk:
+                self.disk.move_to_end(name)
+        return content
+    
+    def _disk_put(self, key, content):
+        if not self.disk_dir:
+            return
+        data = zlib.compress(content.encode('utf-8'))
+        if len(data) > self.disk_bytes:
+            return
+        name = self._disk_name(key)
+        path = os.path.join(self.disk_dir, name)
+        # 先写临时文件再替换，多个进程同时写同一个键也不会读到半个文件
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        
+        evicted = []
+        with self.lock:
+            old_size = self.disk.pop(name, None)
+            if old_size is not None:
+                self.disk_used -= old_size
+            self.disk[name] = len(data)
+            self.disk_used += len(data)
+            while self.disk_used > self.disk_bytes and len(self.disk) > 1:
+                evicted_name, evicted_size = self.disk.popitem(last=False)
+                self.disk_used -= evicted_size
+                self.stats['disk_evictions'] += 1
+                evicted.append(evicted_name)
+        for evicted_name in evicted:
+            try:
+                os.remove(os.path.join(self.disk_dir, evicted_name))
+            except OSError:
+                pass
+    
+    def summary(self):
+        """返回一行可读的命中率统计"""
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        rate = hits / total * 100 if total else 0.0
+        return (f"文件缓存: 命中 {hits}/{total} ({rate:.1f}%)，"
+                f"内存 {self.stats['memory_hits']} / 磁盘 {self.stats['disk_hits']}，"
+                f"淘汰 内存 {self.stats['memory_evictions']} / 磁盘 {self.stats['disk_evictions']}")
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地Git仓库后端
+直接读取本地镜像仓库的对象库，代替GitLab/GitHub API：
+- 提交列表和每个提交的diff：一次 git log --patch 流式读取
+- 文件在某个提交时的内容：常驻的 git cat-file --batch 进程
+返回的数据结构与 reviews_scraper 中基于API的函数一致
+"""
+
+import subprocess
+import threading
+
+from diff_parser import parse_diff
+from records import CommitDiff, FileChange, GitLabCommit
+
+# git log 输出中用于分隔提交和字段的控制字符（不会出现在正常的diff行首）
+COMMIT_MARK = '\x1e'
+FIELD_SEP = '\x1f'
+HEADER_END = '\x1d'
+
+# git 路径引号中的单字符转义
+QUOTE_ESCAPES = {'a': 7, 'b': 8, 't': 9, 'n': 10, 'v': 11, 'f': 12, 'r': 13, '"': 34, '\\': 92}
+
+LOG_FORMAT = COMMIT_MARK + FIELD_SEP.join([
+    '%H', '%h', '%an', '%ae', '%aI', '%cn', '%ce', '%cI', '%B'
+]) + HEADER_END
+
+
+class LocalRepository:
+    """本地Git仓库（线程安全）"""
+    
+    def __init__(self, repo_path, git='git'):
+        """
+        参数:
+            repo_path: 仓库路径（工作区或裸仓库）
+            git: git 可执行文件
+        """
+        self.repo_path = repo_path
+        self.git = git
+        self.batch = None
+        self.lock = threading.Lock()
+    
+    def _command(self, *args):
+        return [self.git, '-C', self.repo_path, '-c', 'core.quotepath=false', *args]
+    
+    def iter_commits(self, ref_name=None, max_commits=None, since_sha=None, include_diff=True):
+        """
+        流式读取提交（新的在前），整个历史只启动一个 git log 进程
+        
+        参数:
+            ref_name: 分支或标签名称（默认 HEAD）
+            max_commits: 最多读取的提交数量
+            since_sha: 水位线提交SHA（可选），只读取比它新的提交
+            include_diff: 是否同时读取每个提交的diff
+        
+        返回:
+            生成器，逐条产出与 reviews_scraper.main 相同结构的提交字典
+        """
+        args = ['log', f'--format={LOG_FORMAT}', '--no-color', '--no-ext-diff']
+        if include_diff:
+            args += ['--patch', '-M']
+        if max_commits is not None:
+            args.append(f'-n{int(max_commits)}')
+        revision = ref_name or 'HEAD'
+        args.append(f'{since_sha}..{revision}' if since_sha else revision)
+        args.append('--')
+        
+        process = subprocess.Popen(
+            self._command(*args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        try:
+            header = None
+            patch_lines = []
+            in_header = False
+            for raw_line in process.stdout:
+                line = raw_line.decode('utf-8', errors='replace').rstrip('\n')
+                if line.startswith(COMMIT_MARK):
+                    if header is not None:
+                        yield _build_commit(header, patch_lines, include_diff)
+                    header = line[len(COMMIT_MARK):]
+                    patch_lines = []
+                    in_header = HEADER_END not in header
+                    if not in_header:
+                        header = header[:header.index(HEADER_END)]
+                elif in_header:
+                    # 提交说明可能有多行，一直读到结束标记
+                    if HEADER_END in line:
+                        header += '\n' + line[:line.index(HEADER_END)]
+                        in_header = False
+                    else:
+                        header += '\n' + line
+                elif header is not None:
+                    patch_lines.append(line)
+            if header is not None:
+                yield _build_commit(header, patch_lines, include_diff)
+            
+            process.wait()
+            if process.returncode != 0:
+                error = process.stderr.read().decode('utf-8', errors='replace').strip()
+                raise RuntimeError(f'git log 执行失败: {error}')
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+    
+    def read_file(self, commit_id, file_path):
+        """
+        读取文件在特定提交时的完整内容
+        
+        返回:
+            文件内容字符串，文件不存在时返回 None
+        """
+        with self.lock:
+            if self.batch is None or self.batch.poll() is not None:
+                self.batch = subprocess.Popen(
+                    self._command('cat-file', '--batch'),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE
+                )
+            self.batch.stdin.write(f'{commit_id}:{file_path}\n'.encode('utf-8'))
+            self.batch.stdin.flush()
+            
+            # 输出格式: "<sha> <type> <size>\n<content>\n" 或 "<object> missing\n"（<object> 中的路径可能含空格）
+            header = self.batch.stdout.readline().decode('utf-8', errors='replace').rstrip('\n')
+            info = header.split()
+            if header.endswith((' missing', ' ambiguous')) or len(info) != 3:
+                return None
+            size = int(info[2])
+            data = self.batch.stdout.read(size)
+            self.batch.stdout.read(1)
+        
+        if info[1] != 'blob':
+            return None
+        return data.decode('utf-8', errors='replace')
+    
+    def close(self):
+        """关闭常驻的 cat-file 进程"""
+        with self.lock:
+            if self.batch is not None:
+                self.batch.stdin.close()
+                self.batch.wait()
+                self.batch.stdout.close()
+                self.batch = None
+
+
+def _build_commit(header, patch_lines, include_diff):
+    """把 git log 的一条记录转换为提交字典"""
+    fields = header.split(FIELD_SEP)
+    sha, short_sha, author_name, author_email, authored_date, committer_name, committer_email, committed_date = fields[:8]
+    message = FIELD_SEP.join(fields[8:]).strip('\n')
+    
+    commit = GitLabCommit(
+        id=sha,
+        short_id=short_sha,
+        title=message.split('\n')[0] if message else '',
+        message=message,
+        author_name=author_name,
+        author_email=author_email,
+        authored_date=authored_date,
+        committer_name=committer_name,
+        committer_email=committer_email,
+        committed_date=committed_date
+    )
+    
+    if include_diff:
+        files = parse_patch(patch_lines)
+        commit.diff = CommitDiff(success=True, files=files)
+        commit.files_changed = files
+    
+    return commit
+
+
+def parse_patch(patch_lines):
+    """
+    把 git log --patch 的输出按文件拆分
+    
+    返回:
+        FileChange 列表，结构与 GitLab diff 接口解析结果相同
+        （'diff' 字段从第一个 @@ 开始，不含 ---/+++ 文件头）
+    """
+    files = []
+    current = None
+    hunk_lines = []
+    
+    def finish():
+        if current is not None:
+            # 新增和删除行数按hunk头部的行数统计，提交末尾的空行等不会计入
+            parsed = parse_diff(hunk_lines)
+            current['additions'] = parsed.additions
+            current['deletions'] = parsed.deletions
+            current['diff'] = '\n'.join(hunk_lines) + '\n' if hunk_lines else ''
+            files.append(current)
+    
+    for line in patch_lines:
+        if line.startswith('diff --git '):
+            finish()
+            hunk_lines = []
+            old_path, new_path = _paths_from_diff_header(line)
+            current = {
+                'old_path': old_path,
+                'new_path': new_path,
+                'change_type': 'modified',
+                'diff': '',
+                'additions': 0,
+                'deletions': 0
+            }
+            continue
+        if current is None:
+            continue
+        
+        if hunk_lines or line.startswith('@@'):
+            hunk_lines.append(line)
+        elif line.startswith('new file mode'):
+            current['change_type'] = 'added'
+        elif line.startswith('deleted file mode'):
+            current['change_type'] = 'deleted'
+        elif line.startswith('rename from '):
+            current['old_path'] = _unquote(line[len('rename from '):])
+            current['change_type'] = 'renamed'
+        elif line.startswith('rename to '):
+            current['new_path'] = _unquote(line[len('rename to '):])
+            current['change_type'] = 'renamed'
+        elif line.startswith('--- ') and line != '--- /dev/null':
+            current['old_path'] = _strip_prefix(line[4:], 'a/')
+        elif line.startswith('+++ ') and line != '+++ /dev/null':
+            current['new_path'] = _strip_prefix(line[4:], 'b/')
+    
+    finish()
+    # git log 在每个提交末尾输出一个空行，不属于diff内容
+    for file_info in files:
+        if file_info['diff'].endswith('\n\n'):
+            file_info['diff'] = file_info['diff'][:-1]
+    return [FileChange(**file_info) for file_info in files]
+
+
+def _paths_from_diff_header(line):
+    """
+    解析 'diff --git a/x b/y'
+    
+    路径含引号、反斜杠、制表符等字符时 git 会用C风格的引号包住（"a/x\\ty"）；
+    没有引号且路径相同时按中点拆分，可处理含空格的路径
+    """
+    rest = line[len('diff --git '):]
+    if rest.startswith('"'):
+        end = _quoted_end(rest)
+        return _strip_prefix(rest[:end + 1], 'a/'), _strip_prefix(rest[end + 2:], 'b/')
+    if rest.endswith('"') and ' "b/' in rest:
+        old_path, _, new_path = rest.rpartition(' "b/')
+        return _strip_prefix(old_path, 'a/'), _strip_prefix('"b/' + new_path, 'b/')
+    half = len(rest) // 2
+    if rest[half:half + 1] == ' ' and rest[:half][2:] == rest[half + 1:][2:]:
+        return _strip_prefix(rest[:half], 'a/'), _strip_prefix(rest[half + 1:], 'b/')
+    old_path, _, new_path = rest.partition(' b/')
+    return _strip_prefix(old_path, 'a/'), new_path
+
+
+def _quoted_end(text):
+    """返回以引号开头的字符串中对应的结束引号位置（跳过转义字符）"""
+    index = 1
+    while index < len(text):
+        if text[index] == '\\':
+            index += 2
+        elif text[index] == '"':
+            return index
+        else:
+            index += 1
+    return len(text) - 1
+
+
+def _unquote(path):
+    """还原 git 的C风格路径引号（"say \\"hi\\".txt"、八进制转义的 UTF-8 字节）"""
+    if len(path) < 2 or not (path.startswith('"') and path.endswith('"')):
+        return path
+    data = bytearray()
+    body = path[1:-1]
+    index = 0
+    while index < len(body):
+        char = body[index]
+        if char != '\\' or index + 1 >= len(body):
+            data += char.encode('utf-8')
+            index += 1
+        elif body[index + 1] in QUOTE_ESCAPES:
+            data.append(QUOTE_ESCAPES[body[index + 1]])
+            index += 2
+        else:
+            # 八进制转义，例如 \344\270\255
+            data.append(int(body[index + 1:index + 4], 8) & 0xFF)
+            index += 4
+    return data.decode('utf-8', errors='replace')
+
+
+def _strip_prefix(path, prefix):
+    path = _unquote(path.rstrip('\t'))
+    return path[len(prefix):] if path.startswith(prefix) else path
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提交和diff的紧凑记录
+使用 __slots__ 的记录类代替字典：每个文件的diff内容只保存一份，
+完整diff文本（diff_text）在访问时才拼接，文件路径等重复字符串共享同一个对象。
+记录类支持字典式访问（commit['diff']、file_info.get('old_path')），
+json.dump 时传入 default=json_default 即得到与之前完全相同的JSON结构
+"""
+
+import sys
+from collections.abc import MutableMapping
+
+
+class Record(MutableMapping):
+    """记录类基类：按 _fields 中的键提供字典式读写"""
+    
+    __slots__ = ()
+    _fields = ()
+    _optional = ()  # 值为 None 时不输出的键
+    
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def __delitem__(self, key):
+        raise TypeError(f'{type(self).__name__} 不支持删除键: {key}')
+    
+    def __iter__(self):
+        for key in self._fields:
+            if key in self._optional and getattr(self, key) is None:
+                continue
+            yield key
+    
+    def __len__(self):
+        return sum(1 for _ in self)
+    
+    def __contains__(self, key):
+        return key in self._fields and not (key in self._optional and getattr(self, key) is None)
+    
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+    
+    def to_dict(self):
+        """转换为普通字典（嵌套的记录也一并转换）"""
+        return {key: _plain(self[key]) for key in self}
+
+
+def _plain(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+def json_default(obj):
+    """
+    json.dump / json.dumps 的 default 参数：把记录转换为字典
+    
+    只做一层转换，嵌套的记录由 json 模块继续调用本函数，不需要先构建完整的字典树
+    """
+    if isinstance(obj, Record):
+        return dict(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class FileChange(Record):
+    """一个文件的改动"""
+    
+    __slots__ = ('old_path', 'new_path', 'change_type', 'diff', 'additions', 'deletions', 'blob_id', 'diff_omitted')
+    _fields = __slots__
+    _optional = ('blob_id', 'diff_omitted')
+    
+    def __init__(self, old_path='', new_path='', change_type='modified', diff='', additions=0, deletions=0, blob_id=None,
+                 diff_omitted=None):
+        # 同一路径在很多提交中反复出现，共享同一个字符串对象
+        self.old_path = _intern(old_path)
+        self.new_path = self.old_path if new_path == old_path else _intern(new_path)
+        self.change_type = _intern(change_type)
+        self.diff = diff
+        self.additions = additions
+        self.deletions = deletions
+        self.blob_id = blob_id
+        self.diff_omitted = diff_omitted  # 超出diff预算时省略的diff大小（字节），此时 diff 为空字符串
+    
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+        return cls(**{key: data[key] for key in cls._fields if key in data})
+
+
+class CommitDiff(Record):
+    """
+    一个提交的diff结果（与 get_commit_diff 之前返回的字典结构相同）
+    
+    diff_text 不单独保存，访问时按平台的格式由各文件的diff拼接
+    """
+    
+    __slots__ = ('success', 'files', 'error', 'platform', '__weakref__')
+    _fields = ('success', 'files', 'diff_text', 'error')
+    
+    def __init__(self, success=False, files=None, error=None, platform='gitlab'):
+        self.success = success
+        self.files = files if files is not None else []
+        self.error = error
+        self.platform = platform
+    
+    @property
+    def diff_text(self):
+        if self.platform == 'github':
+            return '\n\n'.join([f.diff for f in self.files if f.diff])
+        diff_lines = []
+        for file_info in self.files:
+            diff_lines.append(f"--- a/{file_info.old_path}")
+            diff_lines.append(f"+++ b/{file_info.new_path}")
+            diff_lines.append(file_info.diff)
+        return '\n'.join(diff_lines)
+    
+    def __setitem__(self, key, value):
+        if key == 'diff_text':
+            raise KeyError('diff_text 由 files 生成，不能直接赋值')
+        super().__setitem__(key, value)
+    
+    def to_dict(self, include_diff_text=True):
+        """
+        转换为普通字典
+        
+        参数:
+            include_diff_text: 是否包含拼接后的 diff_text（写入缓存时不需要，读取时可重新生成）
+        """
+        data = super().to_dict()
+        if not include_diff_text:
+            del data['diff_text']
+        return data
+    
+    @classmethod
+    def from_dict(cls, data, platform='gitlab'):
+        """从字典（例如缓存中读出的结果）创建，忽略其中的 diff_text"""
+        if isinstance(data, cls):
+            return data
+        return cls(
+            success=data.get('success', False),
+            files=[FileChange.from_dict(f) for f in data.get('files', [])],
+            error=data.get('error'),
+            platform=platform
+        )
+
+
+class GitLabCommit(Record):
+    """GitLab（以及本地仓库）格式的提交"""
+    
+    __slots__ = ('id', 'short_id', 'title', 'message', 'author_name', 'author_email', 'authored_date',
+                 'committer_name', 'committer_email', 'committed_date', 'web_url', 'diff', 'files_changed',
+                 'patch_id', 'duplicate_of')
+    _fields = __slots__
+    _optional = ('patch_id', 'duplicate_of')  # 补丁指纹，以及改动相同的更早提交（见 reviews_scraper.PatchIndex）
+    
+    def __init__(self, **fields):
+        for key in self._fields:
+            setattr(self, key, _intern_field(key, fields.get(key)))
+        if self.files_changed is None:
+            self.files_changed = []
+
+
+class GitHubCommit(Record):
+    """GitHub格式的提交"""
+    
+    __slots__ = ('sha', 'short_sha', 'message', 'title', 'author_name', 'author_email', 'authored_date',
+                 'committer_name', 'committer_email', 'committed_date', 'html_url', 'diff', 'files_changed',
+                 'patch_id', 'duplicate_of')
+    _fields = __slots__
+    _optional = ('patch_id', 'duplicate_of')
+    
+    def __init__(self, **fields):
+        for key in self._fields:
+            setattr(self, key, _intern_field(key, fields.get(key)))
+        if self.files_changed is None:
+            self.files_changed = []
+
+
+def _intern_field(key, value):
+    # 作者信息在大量提交中重复出现
+    if key in ('author_name', 'author_email', 'committer_name', 'committer_email'):
+        return _intern(value)
+    return value
@@ -6,16 +6,242 @@ Git提交内容获取工具
 """
 
 import requests
+import contextlib
 import json
 import time
 import os
+import posixpath
+import random
 import re
+import sys
+import tarfile
+import threading
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 
+from api_client import (
+    ResponseCache,
+    build_commits_request,
+    create_session as create_base_session,
+    iter_commit_items,
+    iter_pages,
+    write_ndjson_record,
+)
+from diff_cache import DiffCache, cache_host
+from csharp_scope import build_scope_index
+from diff_parser import parse_diff, patch_id, split_hunks
+from file_cache import FileContentCache, make_key as make_file_key
+from local_git import LocalRepository
+from records import CommitDiff, FileChange, GitHubCommit, GitLabCommit, json_default
 
-def get_commit_diff(api_base_url, project_id, commit_id, access_token, platform='gitlab', timeout=30):
+# 一个提交需要读取的文件数超过该值时，GitLab 改为一次下载仓库压缩包批量获取
+ARCHIVE_THRESHOLD = 20
+
+# 仓库压缩包的大小上限（字节），超过时放弃压缩包，改为逐个文件请求
+ARCHIVE_MAX_BYTES = 50 * 1024 * 1024
+
+# 按token预算拆分AI审核格式时，分块之间的分隔（Markdown中不显示，可以按它切分文件）
+CHUNK_SEPARATOR = "\n\n<!-- ai-review-chunk -->\n\n"
+
+# 提交信息本身已接近预算时，每个分块至少留给改动内容的token数
+MIN_CHUNK_BODY_TOKENS = 500
+
+# 分页获取提交diff时每页的文件数（与GitLab的默认值相同），峰值内存约为一页原始响应的几倍
+DIFF_PAGE_SIZE = 20
+
+# 带水位线（since_sha）获取时最多获取的提交数：水位线不在分支上时不会遍历整个历史
+INCREMENTAL_MAX_COMMITS = 500
+
+# 流式下载单个文件的最大字节数：解码时原始内容和字符串会短暂同时存在，更大的文件不下载（只使用diff）
+RAW_MAX_BYTES = 10 * 1024 * 1024
+
+
+class RateLimiter:
+    """
+    令牌桶限流器，根据服务端返回的限流响应头自适应调整速率
+    
+    支持 GitLab 的 RateLimit-*、GitHub 的 X-RateLimit-* 以及 Retry-After，
+    多个线程共享同一个实例时，所有请求合计不超过服务端的剩余额度
+    """
+    
+    def __init__(self, rate=10.0, burst=10, min_rate=0.5, max_rate=100.0, low_fraction=0.2, low_remaining=100):
+        """
+        参数:
+            rate: 初始速率（每秒请求数），收到限流响应头后自动调整
+            burst: 令牌桶容量（允许的瞬时并发请求数）
+            min_rate: 自适应调整的最低速率
+            max_rate: 自适应调整的最高速率
+            low_fraction: 剩余额度低于总额度的该比例时开始按剩余额度放慢速率
+            low_remaining: 服务端没有返回总额度时，剩余额度低于该值时开始放慢速率
+        """
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.low_fraction = float(low_fraction)
+        self.low_remaining = float(low_remaining)
+        self.rate = min(self.max_rate, max(self.min_rate, float(rate)))
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+    
+    def reserve(self):
+        """
+        预留一个令牌
+        
+        返回:
+            调用方在发送请求前需要等待的秒数（0 表示可立即发送）
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+    
+    def acquire(self):
+        """阻塞直到可以发送下一个请求"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+    
+    def update(self, headers, status_code=None):
+        """
+        根据响应头调整速率
+        
+        参数:
+            headers: 响应头（大小写不敏感的映射）
+            status_code: 响应状态码
+        
+        返回:
+            服务端要求的重试等待秒数（没有要求则为 None）
+        """
+        now = time.monotonic()
+        retry_after = _parse_retry_after(headers.get('Retry-After'))
+        remaining = _header_number(headers, 'RateLimit-Remaining', 'X-RateLimit-Remaining')
+        limit = _header_number(headers, 'RateLimit-Limit', 'X-RateLimit-Limit')
+        reset = _header_number(headers, 'RateLimit-Reset', 'X-RateLimit-Reset')
+        
+        # 重置时间可能是Unix时间戳（GitLab/GitHub）或相对秒数（IETF草案）
+        reset_in = None
+        if reset is not None:
+            reset_in = reset - time.time() if reset > 1e9 else reset
+            reset_in = max(reset_in, 0.0)
+        
+        with self.lock:
+            if remaining is not None and reset_in is not None:
+                if remaining <= 0:
+                    # 额度用尽，暂停到重置时间
+                    self.blocked_until = max(self.blocked_until, now + reset_in)
+                    if retry_after is None and status_code in (403, 429):
+                        retry_after = reset_in
+                elif reset_in > 0:
+                    low_water = limit * self.low_fraction if limit else self.low_remaining
+                    if remaining > low_water:
+                        # 额度充足，不限速（只受令牌桶容量限制）
+                        self.rate = self.max_rate
+                    else:
+                        # 额度不多时，把剩余额度均匀分摊到重置前的时间里
+                        self.rate = min(self.max_rate, max(self.min_rate, remaining / reset_in))
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                self.tokens = min(self.tokens, 0.0)
+        
+        return retry_after
+
+
+def _header_number(headers, *names):
+    """读取第一个存在的数值型响应头"""
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                continue
+    return None
+
+
+def _parse_retry_after(value):
+    """解析 Retry-After（秒数或HTTP日期），返回秒数"""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitedSession(requests.Session):
     """
-    获取单个提交的diff内容
+    带限流的会话：每次请求前从限流器取令牌，响应后用限流响应头更新限流器，
+    遇到 429（或GitHub额度用尽的403）时按 Retry-After 等待后重试；
+    传入 semaphore 时，同时进行的请求数不超过信号量的值（多个会话可以共享一个信号量）
+    """
+    
+    def __init__(self, rate_limiter, max_retries=3, semaphore=None):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.semaphore = semaphore
+    
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            # 信号量只包住一次请求（含重定向）：重定向时 requests 会在同一线程中再次调用 send，
+            # 在 send 中获取信号量会等待自己已经持有的信号量
+            if self.semaphore is None:
+                response = super().request(method, url, *args, **kwargs)
+            else:
+                with self.semaphore:
+                    response = super().request(method, url, *args, **kwargs)
+            retry_after = self.rate_limiter.update(response.headers, response.status_code)
+            
+            limited = response.status_code == 429 or (
+                response.status_code == 403 and retry_after is not None
+            )
+            if not limited or attempt == self.max_retries:
+                return response
+            
+            # 释放连接后重试，等待时间由限流器统一控制
+            response.close()
+        return response
+
+
+def create_session(platform='gitlab', access_token=None, pool_size=10, rate_limiter=None, semaphore=None):
+    """
+    创建共享的HTTP会话（连接池 + keep-alive）
+    
+    所有API调用都应复用同一个会话，避免每次请求重新建立TCP/TLS连接
+    
+    参数:
+        platform: 平台类型，'gitlab' 或 'github'
+        access_token: API访问令牌（写入会话默认请求头）
+        pool_size: 每个主机的连接池大小
+        rate_limiter: RateLimiter 实例（可选，传入后所有请求都经过限流）
+        semaphore: 限制同时进行的请求数的信号量（可选，需同时传入 rate_limiter）
+    
+    返回:
+        requests.Session 对象
+    """
+    session = None
+    if rate_limiter is not None:
+        session = RateLimitedSession(rate_limiter, semaphore=semaphore)
+    return create_base_session(platform, access_token, pool_size, session=session)
+
+
+def get_commit_diff(api_base_url, project_id, commit_id, access_token, platform='gitlab', timeout=30, session=None, cache=None,
+                    byte_budget=None):
+    """
+    获取单个提交的diff内容（分页获取，见 iter_commit_diff_files）
     
     参数:
         api_base_url: API基础URL
@@ -23,109 +249,190 @@ def get_commit_diff(api_base_url, project_id, commit_id, access_token, platform=
         commit_id: 提交ID（GitLab）或SHA（GitHub）
         access_token: API访问令牌
         platform: 平台类型
-        timeout: 请求超时时间
+        timeout: 每页请求的超时时间
+        session: 共享的HTTP会话（可选，不传则临时创建）
+        cache: DiffCache 实例（可选），命中时不发任何网络请求
+        byte_budget: 本提交保留的diff总字节数上限（可选），超出预算的文件只保留增删行数
     
     返回:
-        字典结构:
+        CommitDiff 记录（可按字典访问）:
         {
             'success': bool,
             'files': list,  # 文件改动列表
-            'diff_text': str,  # 完整diff文本
+            'diff_text': str,  # 完整diff文本（访问时由 files 拼接）
             'error': str
         }
     """
-    result = {
-        'success': False,
-        'files': [],
-        'diff_text': '',
-        'error': None
-    }
+    result = CommitDiff(platform=platform)
+    
+    # 提交的diff不会变化，优先读取本地缓存；
+    # 按预算省略过文件的结果记录了当时的预算，预算变大（或不限制）时重新获取
+    if cache is not None:
+        cached = cache.get(cache_host(api_base_url), project_id, commit_id)
+        cached_budget = cached.get('byte_budget') if cached is not None else None
+        if cached is not None and (cached_budget is None or (byte_budget is not None and byte_budget <= cached_budget)):
+            result = CommitDiff.from_dict(cached, platform)
+            result.files = list(_limit_diff_bytes(result.files, byte_budget))
+            return result
+    
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
     
     try:
-        if platform == 'gitlab':
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            url = f'{api_base_url}/projects/{project_id}/repository/commits/{commit_id}/diff'
-        else:  # GitHub
-            headers = {
-                'Authorization': f'token {access_token}',
-                'Accept': 'application/vnd.github.v3+json',
-                'Content-Type': 'application/json'
-            }
-            url = f'{api_base_url}/repos/{project_id}/commits/{commit_id}'
-        
-        response = requests.get(url, headers=headers, timeout=timeout)
-        response.raise_for_status()
-        data = response.json()
+        result.files = list(iter_commit_diff_files(
+            api_base_url, project_id, commit_id, platform,
+            session=session, timeout=timeout, byte_budget=byte_budget
+        ))
+        result.success = True
         
-        if platform == 'gitlab':
-            # GitLab直接返回diff列表
-            for diff_item in data:
-                old_path = diff_item.get('old_path', '')
-                new_path = diff_item.get('new_path', '')
-                diff_content = diff_item.get('diff', '')
-                
-                # 判断改动类型
-                change_type = 'modified'
-                if diff_item.get('deleted_file'):
-                    change_type = 'deleted'
-                elif diff_item.get('new_file'):
-                    change_type = 'added'
-                elif diff_item.get('renamed_file'):
-                    change_type = 'renamed'
-                
-                # 计算新增和删除的行数（排除diff头部的---和+++行）
-                diff_lines = diff_content.split('\n') if diff_content else []
-                additions = sum(1 for line in diff_lines if line.startswith('+') and not line.startswith('+++'))
-                deletions = sum(1 for line in diff_lines if line.startswith('-') and not line.startswith('---'))
-                
-                result['files'].append({
-                    'old_path': old_path,
-                    'new_path': new_path,
-                    'change_type': change_type,  # added, deleted, modified, renamed
-                    'diff': diff_content,
-                    'additions': additions,
-                    'deletions': deletions
-                })
-            
-            # 生成完整diff文本
-            diff_lines = []
-            for file_info in result['files']:
-                diff_lines.append(f"--- a/{file_info['old_path']}")
-                diff_lines.append(f"+++ b/{file_info['new_path']}")
-                diff_lines.append(file_info['diff'])
-            result['diff_text'] = '\n'.join(diff_lines)
-        else:  # GitHub
-            # GitHub返回的commit对象中包含files字段
-            files_data = data.get('files', [])
-            for file_item in files_data:
-                filename = file_item.get('filename', '')
-                patch = file_item.get('patch', '')
-                status = file_item.get('status', 'modified')
-                
-                result['files'].append({
-                    'old_path': file_item.get('previous_filename', filename),
-                    'new_path': filename,
-                    'change_type': status,  # added, removed, modified, renamed
-                    'diff': patch,
-                    'additions': file_item.get('additions', 0),
-                    'deletions': file_item.get('deletions', 0)
-                })
-            
-            # 生成完整diff文本
-            result['diff_text'] = '\n\n'.join([f['diff'] for f in result['files'] if f['diff']])
-        
-        result['success'] = True
+        if cache is not None:
+            data = result.to_dict(include_diff_text=False)
+            if any(f.diff_omitted is not None for f in result.files):
+                data['byte_budget'] = byte_budget
+            cache.put(cache_host(api_base_url), project_id, commit_id, data)
         
     except requests.exceptions.RequestException as e:
         result['error'] = f'获取diff失败: {str(e)}'
+    finally:
+        if own_session:
+            session.close()
     
     return result
 
 
-def get_file_content_at_commit(api_base_url, project_id, commit_id, file_path, access_token, platform='gitlab', timeout=30):
+def iter_commit_diff_files(api_base_url, project_id, commit_id, platform='gitlab', session=None, timeout=30, byte_budget=None):
+    """
+    分页获取提交的diff，逐个产出文件改动（内存中最多保留两页原始响应，而不是整个提交的diff）
+    
+    参数:
+        api_base_url: API基础URL
+        project_id: 项目ID
+        commit_id: 提交ID（GitLab）或SHA（GitHub）
+        platform: 平台类型
+        session: 共享的HTTP会话
+        timeout: 每页请求的超时时间
+        byte_budget: 本提交保留的diff总字节数上限（可选）。放不进剩余预算的文件只保留路径和增删行数，
+                     'diff' 为空字符串，'diff_omitted' 记录原diff的字节数
+    
+    返回:
+        生成器，逐个产出 FileChange；请求失败时抛出 requests 异常
+    """
+    if platform == 'gitlab':
+        url = f'{api_base_url}/projects/{project_id}/repository/commits/{commit_id}/diff'
+    else:  # GitHub
+        url = f'{api_base_url}/repos/{project_id}/commits/{commit_id}'
+    
+    files = (
+        file_info
+        for page in iter_pages(session, url, {'per_page': DIFF_PAGE_SIZE}, timeout)
+        for file_info in parse_diff_files(page, platform)
+    )
+    yield from _limit_diff_bytes(files, byte_budget)
+
+
+def _limit_diff_bytes(files, byte_budget):
+    """
+    按顺序把文件的diff计入预算，放不进剩余预算的文件清空 diff 并在 diff_omitted 记录原大小
+    （对已经按同一预算处理过的文件再次处理，结果不变）
+    
+    参数:
+        files: FileChange 的可迭代对象
+        byte_budget: diff总字节数上限，None 表示不限制
+    
+    返回:
+        生成器，逐个产出（原地修改后的）FileChange
+    """
+    remaining = byte_budget
+    for file_info in files:
+        if remaining is not None and file_info.diff:
+            size = len(file_info.diff.encode('utf-8'))
+            if size > remaining:
+                file_info.diff = ''
+                file_info.diff_omitted = size
+            else:
+                remaining -= size
+        yield file_info
+
+
+def parse_diff_response(data, platform='gitlab'):
+    """
+    将diff接口返回的JSON解析为统一的文件改动列表
+    
+    参数:
+        data: GitLab diff接口返回的列表，或GitHub单个commit接口返回的对象
+        platform: 平台类型
+    
+    返回:
+        (files, diff_text) 元组
+    """
+    diff_result = CommitDiff(success=True, files=parse_diff_files(data, platform), platform=platform)
+    return diff_result.files, diff_result.diff_text
+
+
+def parse_diff_files(data, platform='gitlab'):
+    """
+    将diff接口返回的JSON解析为 FileChange 列表（不生成 diff_text，每个文件的diff只保存一份）
+    
+    参数:
+        data: GitLab diff接口返回的列表，或GitHub单个commit接口返回的对象
+        platform: 平台类型
+    
+    返回:
+        FileChange 列表
+    """
+    files = []
+    
+    if platform == 'gitlab':
+        # GitLab直接返回diff列表
+        for diff_item in data:
+            old_path = diff_item.get('old_path', '')
+            new_path = diff_item.get('new_path', '')
+            diff_content = diff_item.get('diff', '')
+            
+            # 判断改动类型
+            change_type = 'modified'
+            if diff_item.get('deleted_file'):
+                change_type = 'deleted'
+            elif diff_item.get('new_file'):
+                change_type = 'added'
+            elif diff_item.get('renamed_file'):
+                change_type = 'renamed'
+            
+            # 计算新增和删除的行数（只统计hunk内的行，diff头部的---和+++行不计入）
+            parsed = parse_diff(diff_content)
+            
+            files.append(FileChange(
+                old_path=old_path,
+                new_path=new_path,
+                change_type=change_type,  # added, deleted, modified, renamed
+                diff=diff_content,
+                additions=parsed.additions,
+                deletions=parsed.deletions
+            ))
+    else:  # GitHub
+        # GitHub返回的commit对象中包含files字段
+        files_data = data.get('files', [])
+        for file_item in files_data:
+            filename = file_item.get('filename', '')
+            patch = file_item.get('patch', '')
+            status = file_item.get('status', 'modified')
+            
+            files.append(FileChange(
+                old_path=file_item.get('previous_filename', filename),
+                new_path=filename,
+                change_type=status,  # added, removed, modified, renamed
+                diff=patch,
+                additions=file_item.get('additions', 0),
+                deletions=file_item.get('deletions', 0),
+                blob_id=file_item.get('sha')  # 改动后文件的blob SHA
+            ))
+    
+    return files
+
+
+def get_file_content_at_commit(api_base_url, project_id, commit_id, file_path, access_token, platform='gitlab', timeout=30, session=None,
+                               cache=None, blob_id=None):
     """
     获取文件在特定commit时的完整内容
     
@@ -137,40 +444,275 @@ def get_file_content_at_commit(api_base_url, project_id, commit_id, file_path, a
         access_token: API访问令牌
         platform: 平台类型
         timeout: 请求超时时间
+        session: 共享的HTTP会话（可选，不传则临时创建）
+        cache: FileContentCache 实例（可选）
+        blob_id: 文件的blob SHA（可选，有则按blob缓存，不同提交的同一份内容共享缓存）
     
     返回:
         文件内容字符串，失败返回None
     """
+    cache_key = None
+    if cache is not None:
+        cache_key = make_file_key(cache_host(api_base_url), project_id, blob_id, commit_id, file_path)
+        content = cache.get(cache_key)
+        if content is not None:
+            return content
+    
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
+    
+    content = None
     try:
         if platform == 'gitlab':
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
             # 使用GitLab API获取文件内容
             url = f'{api_base_url}/projects/{project_id}/repository/files/{requests.utils.quote(file_path, safe="")}/raw'
-            params = {'ref': commit_id}
+            response = session.get(url, params={'ref': commit_id}, timeout=timeout)
+            if response.status_code == 200:
+                content = response.text
         else:  # GitHub
-            headers = {
-                'Authorization': f'token {access_token}',
-                'Accept': 'application/vnd.github.v3+json',
-                'Content-Type': 'application/json'
-            }
-            url = f'{api_base_url}/repos/{project_id}/contents/{requests.utils.quote(file_path, safe="")}'
-            params = {'ref': commit_id}
-        
-        response = requests.get(url, headers=headers, params=params, timeout=timeout)
-        if response.status_code == 200:
-            if platform == 'gitlab':
-                return response.text
-            else:  # GitHub
-                import base64
-                data = response.json()
-                if data.get('content'):
-                    return base64.b64decode(data['content']).decode('utf-8')
-        return None
+            # raw 媒体类型直接返回文件内容（最大100MB），不经过JSON和base64
+            url = f'{api_base_url}/repos/{project_id}/contents/{requests.utils.quote(file_path, safe="/")}'
+            content = _get_raw_text(session, url, {'ref': commit_id}, timeout)
+            if content is None and blob_id:
+                # 按路径取不到时（例如路径含特殊字符、文件过大）改用 git blob 接口
+                content = _get_raw_text(session, f'{api_base_url}/repos/{project_id}/git/blobs/{blob_id}', None, timeout)
     except Exception:
         return None
+    finally:
+        if own_session:
+            session.close()
+    
+    if cache_key is not None and content is not None:
+        cache.put(cache_key, content)
+    return content
+
+
+def _get_raw_text(session, url, params, timeout, chunk_size=64 * 1024, max_bytes=RAW_MAX_BYTES):
+    """
+    以 GitHub raw 媒体类型流式下载文件，分块追加到一个 bytearray，下载完成后一次解码
+    （没有JSON/base64形式的副本，也没有分块列表；解码时原始字节和解码后的字符串会短暂同时存在，
+    所以用 max_bytes 限制单个文件的大小）
+    
+    参数:
+        max_bytes: 文件大小上限（字节），Content-Length 或已下载的字节数超过时停止下载
+    
+    返回:
+        文件内容字符串，请求失败或文件超过上限时返回 None
+    """
+    headers = {'Accept': 'application/vnd.github.raw'}
+    with session.get(url, params=params, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            return None
+        if max_bytes is not None and int(response.headers.get('Content-Length') or 0) > max_bytes:
+            return None
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size):
+            data += chunk
+            if max_bytes is not None and len(data) > max_bytes:
+                return None
+    return data.decode('utf-8', errors='replace')
+
+
+def get_files_at_commit(api_base_url, project_id, commit_id, file_paths, access_token, platform='gitlab', timeout=120, session=None,
+                        cache=None, blob_ids=None):
+    """
+    批量获取多个文件在特定commit时的完整内容
+    - GitLab：一次 /repository/archive 请求（path 限定为所有文件的公共目录）下载压缩包，
+      边下载边解压，只保留需要的文件，全部找到后立即停止下载；
+      文件没有公共目录（需要下载整个仓库）或压缩包超过 ARCHIVE_MAX_BYTES 时返回 None
+    - GitHub：GraphQL 查询，一次请求取回多个文件，按返回的数据量自动调整每批的文件数
+    
+    参数:
+        api_base_url: API基础URL
+        project_id: 项目ID（GitHub为 'owner/repo'）
+        commit_id: 提交ID
+        file_paths: 文件路径列表
+        access_token: API访问令牌
+        platform: 平台类型
+        timeout: 请求超时时间
+        session: 共享的HTTP会话（可选，不传则临时创建）
+        cache: FileContentCache 实例（可选），已缓存的文件不再下载，下载到的文件写入缓存
+        blob_ids: {文件路径: blob SHA} 字典（可选，有则按blob缓存，与 get_file_content_at_commit 一致）
+    
+    返回:
+        {文件路径: 文件内容} 字典，没有取到的文件（例如已删除、二进制或内容过大）不在字典中；
+        平台不支持或请求失败时返回 None，由调用方逐个获取
+    """
+    if platform not in ('gitlab', 'github'):
+        return None
+    
+    blob_ids = blob_ids or {}
+    host = cache_host(api_base_url)
+    
+    def cache_key(file_path):
+        return make_file_key(host, project_id, blob_ids.get(file_path), commit_id, file_path)
+    
+    contents = {}
+    wanted = []
+    for file_path in dict.fromkeys(file_paths):
+        content = cache.get(cache_key(file_path)) if cache is not None else None
+        if content is not None:
+            contents[file_path] = content
+        else:
+            wanted.append(file_path)
+    if not wanted:
+        return contents
+    
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
+    
+    try:
+        if platform == 'gitlab':
+            fetched = _files_from_archive(session, api_base_url, project_id, commit_id, wanted, timeout)
+        else:  # GitHub
+            fetched = _files_from_graphql(session, api_base_url, project_id, commit_id, wanted, timeout)
+    finally:
+        if own_session:
+            session.close()
+    
+    if fetched is None:
+        return None
+    for file_path, content in fetched.items():
+        contents[file_path] = content
+        if cache is not None:
+            cache.put(cache_key(file_path), content)
+    return contents
+
+
+class _CappedReader:
+    """按读取的字节数限制压缩包的下载量（没有 Content-Length 的分块响应也适用）"""
+    
+    def __init__(self, raw, max_bytes):
+        self.raw = raw
+        self.remaining = max_bytes
+    
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise OSError('压缩包超过大小上限')
+        return data
+
+
+def _files_from_archive(session, api_base_url, project_id, commit_id, file_paths, timeout, max_bytes=ARCHIVE_MAX_BYTES):
+    """
+    GitLab：从仓库压缩包中流式取出指定文件
+    文件没有公共目录（压缩包就是整个仓库）、压缩包超过 max_bytes 或请求失败时返回 None，由调用方逐个获取
+    """
+    wanted = set(file_paths)
+    contents = {}
+    
+    # 只下载包含所有文件的公共目录
+    prefix = posixpath.commonpath([posixpath.dirname(path) for path in wanted])
+    if not prefix:
+        return None
+    params = {'sha': commit_id, 'path': prefix}
+    
+    url = f'{api_base_url}/projects/{project_id}/repository/archive.tar.gz'
+    try:
+        with session.get(url, params=params, timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                return None
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                return None
+            response.raw.decode_content = True
+            with tarfile.open(fileobj=_CappedReader(response.raw, max_bytes), mode='r|gz') as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    # 压缩包内的路径带有一层 "<项目>-<sha>" 目录
+                    _, _, file_path = member.name.partition('/')
+                    if file_path not in wanted:
+                        continue
+                    contents[file_path] = archive.extractfile(member).read().decode('utf-8', errors='replace')
+                    wanted.discard(file_path)
+                    if not wanted:
+                        break
+    except (requests.exceptions.RequestException, tarfile.TarError, EOFError, OSError):
+        return None
+    return contents
+
+
+# GraphQL 每次查询的文件数上限，以及期望的单次响应大小（按已返回文件的平均大小决定下一批的文件数）
+GRAPHQL_MAX_FILES = 100
+GRAPHQL_TARGET_BYTES = 4 * 1024 * 1024
+
+
+def graphql_url(api_base_url):
+    """由REST API地址得到GraphQL地址（api.github.com/graphql，GitHub Enterprise 为 /api/graphql）"""
+    api_base_url = api_base_url.rstrip('/')
+    if api_base_url.endswith('/api/v3'):
+        return api_base_url[:-len('/v3')] + '/graphql'
+    return f'{api_base_url}/graphql'
+
+
+def _blob_query(count):
+    """生成一次取回 count 个文件内容的GraphQL查询（每个文件一个别名 f0、f1...）"""
+    variables = ''.join(f', $e{i}: String!' for i in range(count))
+    fields = ' '.join(
+        f'f{i}: object(expression: $e{i}) {{ ... on Blob {{ text isTruncated byteSize }} }}' for i in range(count)
+    )
+    return f'query($owner: String!, $name: String!{variables}) {{ repository(owner: $owner, name: $name) {{ {fields} }} }}'
+
+
+def _files_from_graphql(session, api_base_url, project_id, commit_id, file_paths, timeout):
+    """
+    GitHub：分批用GraphQL查询文件内容，失败时返回 None
+    
+    每批的文件数根据已返回文件的平均大小调整，使单次响应约为 GRAPHQL_TARGET_BYTES；
+    请求超时、服务端错误或查询超出限制时把批量减半重试，只剩一个文件仍失败时停止，
+    已取到的内容照常返回，其余文件由调用方逐个获取
+    """
+    owner, _, name = str(project_id).partition('/')
+    url = graphql_url(api_base_url)
+    contents = {}
+    pending = list(file_paths)
+    batch_size = min(GRAPHQL_MAX_FILES, len(pending))
+    
+    while pending:
+        batch = pending[:batch_size]
+        variables = {'owner': owner, 'name': name}
+        for i, file_path in enumerate(batch):
+            variables[f'e{i}'] = f'{commit_id}:{file_path}'
+        
+        try:
+            response = session.post(url, json={'query': _blob_query(len(batch)), 'variables': variables}, timeout=timeout)
+            data = response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError):
+            data = None
+        else:
+            if response.status_code in (401, 403, 404):
+                return None  # 没有GraphQL权限等，整体改为逐个获取
+        
+        result = (data or {}).get('data')
+        if result is not None and result.get('repository') is None:
+            return None  # 仓库不存在或无权访问
+        if result is None or (data.get('errors') and len(batch) > 1):
+            # 查询过大或超时：减半重试
+            if len(batch) == 1:
+                break
+            batch_size = max(1, len(batch) // 2)
+            continue
+        repository = result['repository']
+        
+        total_bytes = 0
+        for i, file_path in enumerate(batch):
+            blob = repository.get(f'f{i}')
+            if not blob:
+                continue
+            total_bytes += blob.get('byteSize') or 0
+            if blob.get('text') is not None and not blob.get('isTruncated'):
+                contents[file_path] = blob['text']
+        pending = pending[len(batch):]
+        
+        average = total_bytes / len(batch)
+        batch_size = GRAPHQL_MAX_FILES if average <= 0 else int(GRAPHQL_TARGET_BYTES / average)
+        batch_size = max(1, min(GRAPHQL_MAX_FILES, batch_size))
+    
+    return contents
 
 
 def extract_changed_ranges_from_diff(diff_content):
@@ -180,162 +722,527 @@ def extract_changed_ranges_from_diff(diff_content):
     返回:
         list of tuples: [(old_start, old_end, new_start, new_end), ...]
     """
-    ranges = []
-    pattern = r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@'
+    return parse_diff(diff_content).ranges
+
+
+def extract_function_context(code_lines, line_range, language='csharp', scope_index=None):
+    """
+    从代码中提取函数上下文
+    
+    参数:
+        code_lines: 代码行列表
+        line_range: 行号范围 (start, end)
+        language: 编程语言类型
+        scope_index: csharp_scope.build_scope_index 建立的索引（可选，同一文件的多个改动范围共用一个索引）
+    
+    返回:
+        字典: {
+            'function_code': str,  # 完整函数代码
+            'function_signature': str,  # 函数签名
+            'class_name': str,  # 类名
+            'namespace': str  # 命名空间
+        }
+    """
+    start_line, end_line = line_range[0], line_range[1]
+    context = {
+        'function_code': '',
+        'function_signature': '',
+        'class_name': '',
+        'namespace': ''
+    }
+    
+    if language == 'csharp':
+        if scope_index is None:
+            scope_index = build_scope_index(code_lines)
+        
+        # 寻找包含改动行的方法（索引中方法互不重叠，二分查找）
+        method = scope_index.find_method(start_line, end_line)
+        if method is not None:
+            func_lines = code_lines[method.start:method.end + 1]
+            context['function_code'] = '\n'.join(func_lines)
+            context['function_signature'] = method.signature
+            context['class_name'] = method.class_name
+            context['namespace'] = method.namespace or scope_index.namespace_at(method.start)
+            context['function_start'] = method.start  # 保存函数开始的索引（0-based）
+            context['function_end'] = method.start + len(func_lines)  # 保存函数结束的索引
+        
+        # 如果没找到完整的函数，至少提取改动周围的代码（前后各30行）
+        if not context['function_code']:
+            owner = scope_index.find_type(start_line)
+            context['class_name'] = owner.name if owner else ''
+            context['namespace'] = scope_index.namespace_at(start_line)
+            context_start = max(0, start_line - 30)
+            context_end = min(len(code_lines), end_line + 30)
+            context['function_code'] = '\n'.join(code_lines[context_start:context_end])
+            context['function_start'] = context_start
+            context['function_end'] = context_end
+    
+    return context
+
+
+def format_for_ai_review(commit, api_base_url=None, project_id=None, access_token=None, platform='gitlab', session=None,
+                         file_cache=None, local_repo=None, archive_threshold=ARCHIVE_THRESHOLD,
+                         executor=None, patch_index=None):
+    """
+    将提交记录格式化为AI审核友好的格式，包含完整的代码上下文
+    
+    参数与 iter_ai_review_blocks 相同
+    
+    返回:
+        格式化的字符串，包含改动前后代码对比和完整上下文；提交没有diff时返回 None
+    """
+    if not commit.get('diff') or not commit.get('diff').get('success'):
+        return None
+    return "\n".join(iter_ai_review_blocks(
+        commit, api_base_url, project_id, access_token, platform, session, file_cache, local_repo, archive_threshold, executor,
+        patch_index
+    ))
+
+
+def write_ai_review(output, commit, api_base_url=None, project_id=None, access_token=None, platform='gitlab', session=None,
+                    file_cache=None, local_repo=None, separator=None, archive_threshold=ARCHIVE_THRESHOLD, max_tokens=None,
+                    executor=None, patch_index=None):
+    """
+    把一个提交的AI审核格式逐块写入文件或管道，写完后立即刷新
+    （内存中只保留一个文件的内容，使用进程池时最多保留进程数2倍个文件；中途退出时已写出的提交不会丢失）
+    
+    参数:
+        output: 可写的文本文件对象
+        commit: 提交记录字典
+        separator: 写在本提交之前的分隔内容（可选，用于多个提交写入同一个文件）
+        max_tokens: 每个分块的token预算（可选），传入后按 iter_ai_review_chunks 拆分，分块之间写入 CHUNK_SEPARATOR
+        其他参数与 iter_ai_review_blocks 相同
+    
+    返回:
+        是否写出了内容（提交没有diff时返回 False）
+    """
+    if not commit.get('diff') or not commit.get('diff').get('success'):
+        return False
+    if separator:
+        output.write(separator)
+    if max_tokens:
+        blocks = iter_ai_review_chunks(
+            commit, api_base_url, project_id, access_token, platform, session, file_cache, local_repo, archive_threshold,
+            max_tokens, executor, patch_index
+        )
+        joiner = CHUNK_SEPARATOR
+    else:
+        blocks = iter_ai_review_blocks(
+            commit, api_base_url, project_id, access_token, platform, session, file_cache, local_repo, archive_threshold, executor,
+        patch_index
+        )
+        joiner = "\n"
+    for idx, block in enumerate(blocks):
+        if idx:
+            output.write(joiner)
+        output.write(block)
+    output.flush()
+    return True
+
+
+def iter_ai_review_blocks(commit, api_base_url=None, project_id=None, access_token=None, platform='gitlab', session=None,
+                          file_cache=None, local_repo=None, archive_threshold=ARCHIVE_THRESHOLD,
+                          executor=None, patch_index=None):
+    """
+    逐块生成提交的AI审核格式：先产出提交信息和改动统计，之后每个文件产出一块
+    （各块用换行连接即为完整内容）
+    
+    参数:
+        commit: 提交记录字典
+        api_base_url: API基础URL（用于获取文件完整内容）
+        project_id: 项目ID（用于获取文件完整内容）
+        access_token: API访问令牌（用于获取文件完整内容）
+        platform: 平台类型
+        session: 共享的HTTP会话（可选，不传则本次提交内复用一个临时会话）
+        file_cache: FileContentCache 实例（可选，缓存获取到的文件内容）
+        local_repo: LocalRepository 实例（platform='local' 时使用，直接从本地仓库读取文件内容）
+        archive_threshold: 需要读取的文件数超过该值时通过仓库压缩包一次获取（GitLab），None 表示始终逐个获取；
+                           GitHub 不受此参数影响，总是通过一次GraphQL查询获取所有文件
+        executor: 进程池（可选，例如 ProcessPoolExecutor），传入后各文件的函数上下文提取和文本拼接
+                  （build_file_section）在进程池中并行执行，结果按文件顺序产出；文件内容仍在本进程中获取
+        patch_index: PatchIndex 实例（可选），提交的补丁指纹已出现过时直接复用之前生成的审核内容，
+                     不再获取文件内容和提取上下文
+    
+    返回:
+        生成器，逐块产出Markdown文本；提交没有diff时不产出任何内容
+    """
+    for part in _iter_ai_review_parts(
+        commit, api_base_url, project_id, access_token, platform, session, file_cache, local_repo, archive_threshold, executor,
+        patch_index
+    ):
+        yield part if isinstance(part, str) else part.render()
+
+
+def iter_ai_review_chunks(commit, api_base_url=None, project_id=None, access_token=None, platform='gitlab', session=None,
+                          file_cache=None, local_repo=None, archive_threshold=ARCHIVE_THRESHOLD, max_tokens=8000,
+                          executor=None, patch_index=None):
+    """
+    按token预算把提交的AI审核格式拆分为若干个独立的分块，便于并行审核
+    
+    每个分块都以提交信息和改动统计开头，后面是若干个文件的改动；放不进一个分块的文件按hunk拆分
+    （每段带上对应hunk所在函数的上下文），单个hunk仍然过大时按行拆分。
+    token数用 estimate_tokens 边生成边估算，不需要分词器。整个提交放得下时只产出一个分块，
+    内容与 format_for_ai_review 相同
+    
+    参数:
+        max_tokens: 每个分块的token预算
+        其他参数与 iter_ai_review_blocks 相同
+    
+    返回:
+        生成器，逐个产出分块的Markdown文本；提交没有diff时不产出任何内容
+    """
+    parts = _iter_ai_review_parts(
+        commit, api_base_url, project_id, access_token, platform, session, file_cache, local_repo, archive_threshold, executor,
+        patch_index
+    )
+    header = next(parts, None)
+    if header is None:
+        return
+    # 分块标记按最长的情况预留
+    budget = max(max_tokens - estimate_tokens(header) - estimate_tokens(_chunk_marker(999)), MIN_CHUNK_BODY_TOKENS)
+    
+    pending = []
+    pending_tokens = 0
+    chunk_no = 0
+    for section in parts:
+        for piece in section.pieces(budget):
+            piece_tokens = estimate_tokens(piece)
+            if pending and pending_tokens + piece_tokens > budget:
+                chunk_no += 1
+                yield "\n".join([header + "\n" + _chunk_marker(chunk_no)] + pending)
+                pending = []
+                pending_tokens = 0
+            pending.append(piece)
+            pending_tokens += piece_tokens
+    
+    if chunk_no == 0:
+        # 没有拆分，与 format_for_ai_review 的输出相同
+        yield "\n".join([header] + pending)
+    elif pending:
+        yield "\n".join([header + "\n" + _chunk_marker(chunk_no + 1)] + pending)
+
+
+def estimate_tokens(text):
+    """
+    快速估算文本的token数（不依赖分词器，偏保守）
+    
+    ASCII字符（代码、英文）按约3个字符一个token计算，中文等非ASCII字符按每个字符一个token计算；
+    UTF-8编码由C实现完成，比逐字符判断快得多
+    
+    参数:
+        text: 文本
+    
+    返回:
+        估算的token数
+    """
+    chars = len(text)
+    non_ascii = (len(text.encode('utf-8')) - chars) // 2  # 中文字符在UTF-8中多占2个字节
+    return (chars - non_ascii) // 3 + non_ascii + 1
+
+
+def _chunk_marker(chunk_no):
+    return f"> 📦 第 {chunk_no} 部分：本提交的改动按token预算拆分为多个部分分别审核，这里只包含其中一部分改动"
+
+
+class ReviewFileSection:
+    """
+    AI审核格式中一个文件的内容：标题、每个hunk所在函数的上下文、diff（没有diff时为说明文字）
+    
+    整体渲染的结果就是 iter_ai_review_blocks 中一个文件的块；超出token预算时可以按hunk拆分成多段
+    """
+    
+    __slots__ = ('heading', 'extra_lines', 'contexts', 'diff', 'note_lines')
+    
+    def __init__(self, heading, diff=''):
+        self.heading = heading
+        self.extra_lines = []  # 标题下的附加信息（重命名的原路径/新路径）
+        self.contexts = []     # 每个hunk一项：所在函数的上下文行（没有时为空列表）
+        self.diff = diff
+        self.note_lines = []   # 没有diff时的说明
+    
+    def render(self):
+        """渲染整个文件"""
+        return self._render('', [line for lines in self.contexts for line in lines],
+                            self.diff.rstrip() if self.diff else None)
     
-    for match in re.finditer(pattern, diff_content):
-        old_start = int(match.group(1))
-        old_count = int(match.group(2) or 1)
-        new_start = int(match.group(3))
-        new_count = int(match.group(4) or 1)
+    def _render(self, label, context_lines, diff_text):
+        lines = ["", "---", "", self.heading + label]
+        lines.extend(self.extra_lines)
+        lines.extend(context_lines)
+        if diff_text is not None:
+            lines.append("")
+            lines.append("#### 💡 代码差异（Diff）:")
+            lines.append("")
+            lines.append("```diff")
+            lines.append(diff_text)
+            lines.append("```")
+        else:
+            lines.extend(self.note_lines)
+        lines.append("")
+        return "\n".join(lines)
+    
+    def pieces(self, max_tokens):
+        """
+        按token预算拆分
+        
+        参数:
+            max_tokens: 每段的token预算
         
-        old_end = old_start + old_count - 1
-        new_end = new_start + new_count - 1
+        返回:
+            生成器，逐段产出Markdown文本；放得下（或无法拆分）时只产出整个文件
+        """
+        text = self.render()
+        if not self.diff or estimate_tokens(text) <= max_tokens:
+            yield text
+            return
+        preamble, hunks = split_hunks(self.diff.rstrip())
+        if not hunks:
+            yield text
+            return
         
-        ranges.append((old_start, old_end, new_start, new_end))
+        total = len(hunks)
+        prefix = preamble + "\n" if preamble else ""
+        overhead = estimate_tokens(self._render(f"（hunk {total}-{total}/{total}，第 {total} 段）", [], prefix))
+        costs = []
+        for idx, hunk in enumerate(hunks):
+            context_lines = self._context(idx)
+            costs.append(estimate_tokens(hunk) + (estimate_tokens("\n".join(context_lines)) if context_lines else 0))
+        
+        group_start = 0
+        group_tokens = overhead
+        for i, cost in enumerate(costs):
+            if i > group_start and group_tokens + cost > max_tokens:
+                yield self._render_hunks(prefix, hunks, group_start, i)
+                group_start = i
+                group_tokens = overhead
+            if overhead + cost > max_tokens:
+                # 单个hunk放不下，按行拆分
+                yield from self._split_hunk(prefix, hunks, i, max_tokens - overhead)
+                group_start = i + 1
+                group_tokens = overhead
+                continue
+            group_tokens += cost
+        if group_start < total:
+            yield self._render_hunks(prefix, hunks, group_start, total)
+    
+    def _context(self, idx):
+        return self.contexts[idx] if idx < len(self.contexts) else []
+    
+    def _render_hunks(self, prefix, hunks, start, end):
+        total = len(hunks)
+        label = f"（hunk {start + 1}/{total}）" if end - start == 1 else f"（hunk {start + 1}-{end}/{total}）"
+        context_lines = [line for idx in range(start, end) for line in self._context(idx)]
+        return self._render(label, context_lines, prefix + "\n".join(hunks[start:end]))
+    
+    def _split_hunk(self, prefix, hunks, idx, max_tokens):
+        # 函数上下文放在第一段；每段至少一行，保证总能向前推进
+        context_lines = self._context(idx)
+        segment = []
+        segment_tokens = estimate_tokens("\n".join(context_lines)) if context_lines else 0
+        segment_no = 0
+        for line in hunks[idx].split('\n'):
+            line_tokens = estimate_tokens(line)
+            if segment and segment_tokens + line_tokens > max_tokens:
+                segment_no += 1
+                yield self._render(f"（hunk {idx + 1}/{len(hunks)}，第 {segment_no} 段）",
+                                   context_lines if segment_no == 1 else [], prefix + "\n".join(segment))
+                segment = []
+                segment_tokens = 0
+            segment.append(line)
+            segment_tokens += line_tokens
+        segment_no += 1
+        yield self._render(f"（hunk {idx + 1}/{len(hunks)}，第 {segment_no} 段）",
+                           context_lines if segment_no == 1 else [], prefix + "\n".join(segment))
+
+
+def build_file_section(old_path, new_path, change_type='modified', diff_content='', diff_omitted=None, additions=0, deletions=0,
+                       new_file_content=None):
+    """
+    生成AI审核格式中一个文件的内容：提取每个改动范围所在的函数并拼接文本（纯计算，不读取网络或磁盘）
     
-    return ranges
+    输入只有路径、diff和改动后的文件内容，可以直接交给进程池执行（见 iter_ai_review_blocks 的 executor 参数）
+    
+    参数:
+        old_path: 原文件路径
+        new_path: 新文件路径
+        change_type: 改动类型
+        diff_content: 文件的diff
+        diff_omitted: 超出diff预算时省略的diff大小（字节）
+        additions: 新增行数
+        deletions: 删除行数
+        new_file_content: 改动后的文件内容（可选，没有时只显示diff）
+    
+    返回:
+        ReviewFileSection 实例
+    """
+    # 文件标题
+    change_type_names = {
+        'added': '➕ 新增文件',
+        'deleted': '🗑️ 删除文件',
+        'modified': '✏️ 修改文件',
+        'renamed': '📝 重命名文件'
+    }
+    heading = f"### {change_type_names.get(change_type, '✏️ 修改')}: `{new_path or old_path}`"
+    section = ReviewFileSection(heading, diff_content)
+    
+    if old_path != new_path and change_type == 'renamed':
+        section.extra_lines.append(f"  原路径: {old_path}")
+        section.extra_lines.append(f"  新路径: {new_path}")
+    
+    # 从改动后的文件内容中提取函数上下文
+    if diff_content and new_file_content:
+        try:
+            # 提取改动的行号范围
+            changed_ranges = parse_diff(diff_content).ranges
+            
+            if changed_ranges:
+                new_code_lines = new_file_content.split('\n')
+                
+                # 确定代码语言类型（根据文件扩展名）
+                file_ext = (new_path or old_path).split('.')[-1].lower()
+                language_map = {
+                    'cs': 'csharp', 'cpp': 'cpp', 'c': 'c',
+                    'java': 'java', 'py': 'python', 'js': 'javascript',
+                    'ts': 'typescript', 'go': 'go', 'rs': 'rust'
+                }
+                language = language_map.get(file_ext, 'unknown')
+                # 同一文件的所有改动范围共用一次扫描建立的作用域索引
+                scope_index = build_scope_index(new_code_lines) if language == 'csharp' else None
+                
+                # 为每个改动范围提取上下文
+                for range_idx, (_, _, new_start, new_end) in enumerate(changed_ranges):
+                    # 每个hunk的上下文单独保存，按token预算拆分时与对应的hunk放在一起
+                    context_lines = []
+                    section.contexts.append(context_lines)
+                    
+                    # 提取函数上下文（从改动后的版本）
+                    context = extract_function_context(
+                        new_code_lines,
+                        (new_start - 1, new_end - 1),  # 转换为0-based索引
+                        language,
+                        scope_index
+                    )
+                    
+                    # 保存function_start用于后续计算相对位置
+                    function_start_line = context.get('function_start', -1)
+                    
+                    if context.get('function_code'):
+                        context_lines.append(f"\n#### 改动 #{range_idx + 1} 所在函数（改动后）：")
+                        if context.get('namespace'):
+                            context_lines.append(f"**命名空间**: `{context['namespace']}`")
+                        if context.get('class_name'):
+                            context_lines.append(f"**类名**: `{context['class_name']}`")
+                        if context.get('function_signature'):
+                            context_lines.append(f"**函数签名**: `{context['function_signature'].strip()}`")
+                        
+                        context_lines.append("")
+                        
+                        # 函数代码就是文件行的一段，直接切片，不再把拼接好的代码重新拆分
+                        func_code = context['function_code']
+                        func_lines_list = new_code_lines[function_start_line:context['function_end']]
+                        
+                        # 检查代码长度，如果太长则智能截取
+                        total_lines = len(func_lines_list)
+                        
+                        # 如果函数超过80行，只显示改动附近的代码
+                        if total_lines > 80:
+                            # 找到改动行在函数中的相对位置
+                            # function_start_line 是函数开始的0-based索引
+                            # new_start - 1 是改动行的0-based索引
+                            if function_start_line >= 0:
+                                change_line_relative = (new_start - 1) - function_start_line
+                            else:
+                                change_line_relative = 0
+                            # 显示改动前后各30行
+                            display_start = max(0, change_line_relative - 30)
+                            display_end = min(total_lines, change_line_relative + 30)
+                            
+                            context_lines.append("<details>")
+                            context_lines.append("<summary>📝 展开查看完整函数代码（改动后）</summary>")
+                            context_lines.append("")
+                            context_lines.append("```csharp")
+                            if display_start > 0:
+                                context_lines.append(f"... (省略前 {display_start} 行) ...\n")
+                            context_lines.append('\n'.join(func_lines_list[display_start:display_end]))
+                            if display_end < total_lines:
+                                context_lines.append(f"\n... (省略后 {total_lines - display_end} 行) ...")
+                            context_lines.append("```")
+                            context_lines.append("</details>")
+                        else:
+                            # 函数不长，完整显示
+                            context_lines.append("<details>")
+                            context_lines.append("<summary>📝 展开查看完整函数代码（改动后）</summary>")
+                            context_lines.append("")
+                            context_lines.append("```csharp")
+                            context_lines.append(func_code.rstrip())
+                            context_lines.append("```")
+                            context_lines.append("</details>")
+        except Exception:
+            pass  # 提取上下文失败时继续使用diff
+    
+    # 没有diff内容时显示说明（diff内容由 ReviewFileSection 以标准unified diff格式输出）
+    if not diff_content:
+        if diff_omitted:
+            section.note_lines.append(
+                f"\n[diff 过大（{diff_omitted} 字节），已省略，"
+                f"+{additions} -{deletions}]"
+            )
+        elif change_type == 'deleted':
+            section.note_lines.append("\n[文件已完全删除]")
+        elif change_type == 'added':
+            section.note_lines.append("\n[新文件已添加]")
+    
+    return section
+
+
+def _build_file_section_args(args):
+    # 进程池任务只传一个参数
+    return build_file_section(*args)
 
 
-def extract_function_context(code_lines, line_range, language='csharp'):
+def _map_in_order(executor, fn, iterable, window=None):
     """
-    从代码中提取函数上下文
+    按输入顺序产出 executor 的计算结果，同时在途的任务不超过 window 个
+    
+    Executor.map 会立即取完整个输入，所有文件的内容在第一个结果返回前就已读取并序列化；
+    这里只在有结果产出后才继续读取后面的输入，读取与计算可以重叠，内存中最多保留 window 个文件的输入
     
     参数:
-        code_lines: 代码行列表
-        line_range: 行号范围 (start, end)
-        language: 编程语言类型
+        executor: concurrent.futures 的执行器
+        fn: 任务函数（单个参数）
+        iterable: 输入的可迭代对象（可以是按需读取的生成器）
+        window: 在途任务数上限，默认进程数的2倍
     
     返回:
-        字典: {
-            'function_code': str,  # 完整函数代码
-            'function_signature': str,  # 函数签名
-            'class_name': str,  # 类名
-            'namespace': str  # 命名空间
-        }
+        生成器，按输入顺序产出结果
     """
-    start_line, end_line = line_range[0], line_range[1]
-    context = {
-        'function_code': '',
-        'function_signature': '',
-        'class_name': '',
-        'namespace': ''
-    }
-    
-    if language == 'csharp':
-        # 提取命名空间
-        namespace_match = None
-        for i, line in enumerate(code_lines):
-            if re.match(r'^\s*namespace\s+', line):
-                namespace_match = line.strip()
-                break
-        context['namespace'] = namespace_match or ''
-        
-        # 提取类和函数
-        # 寻找包含改动行的函数
-        function_start = -1
-        class_start = -1
-        class_name = ''
-        
-        # 向前查找函数开始和类定义
-        current_brace_count = 0
-        for i in range(start_line, -1, -1):
-            if i >= len(code_lines):
-                continue
-            line = code_lines[i]
-            
-            # 计算当前的大括号层级
-            current_brace_count += line.count('}') - line.count('{')
-            
-            # 查找类定义（在函数之外）
-            if class_start == -1:
-                class_match = re.search(r'\bclass\s+(\w+)', line)
-                if class_match:
-                    class_name = class_match.group(1)
-                    class_start = i
-            
-            # 查找函数定义（方法签名）
-            # C#方法签名模式: [修饰符] [返回类型] [方法名]([参数])
-            method_pattern = r'\b(public|private|protected|internal|static)?\s*(static)?\s*(\w+)\s+(\w+)\s*\([^)]*\)'
-            method_match = re.search(method_pattern, line)
-            if method_match and '{' in line:
-                # 找到了函数定义且在同一行开始函数体
-                function_start = i
-                context['function_signature'] = line.strip()
-                break
-            elif method_match:
-                # 函数定义，但函数体在下一行
-                # 检查下一行是否有 '{'
-                if i + 1 < len(code_lines) and '{' in code_lines[i + 1]:
-                    function_start = i
-                    context['function_signature'] = line.strip()
-                    break
-        
-        # 提取完整函数体
-        if function_start >= 0:
-            func_lines = []
-            brace_count = 0
-            in_brace = False
-            
-            for i in range(function_start, min(end_line + 100, len(code_lines))):
-                if i >= len(code_lines):
-                    break
-                line = code_lines[i]
-                
-                # 检查是否到达下一个函数或类（通过检测注释、属性或新函数）
-                if i > function_start and i > end_line:
-                    # 如果遇到XML注释开头且大括号已闭合，说明到了下一个函数
-                    if brace_count == 0 and line.strip().startswith('///'):
-                        break
-                    # 如果遇到属性标记且大括号已闭合
-                    if brace_count == 0 and line.strip().startswith('['):
-                        break
-                
-                func_lines.append(line)
-                
-                # 计算大括号
-                brace_count += line.count('{') - line.count('}')
-                
-                if '{' in line:
-                    in_brace = True
-                
-                # 如果大括号闭合且已经过了改动行
-                if in_brace and brace_count == 0 and i >= end_line:
-                    break
-            
-            # 重新用换行符连接，保留格式
-            context['function_code'] = '\n'.join(func_lines) if func_lines else ''
-            context['class_name'] = class_name
-            context['function_start'] = function_start  # 保存函数开始的索引（0-based）
-            context['function_end'] = function_start + len(func_lines)  # 保存函数结束的索引
-        
-        # 如果没找到完整的函数，至少提取改动周围的代码（前后各30行）
-        if not context['function_code']:
-            context_start = max(0, start_line - 30)
-            context_end = min(len(code_lines), end_line + 30)
-            context['function_code'] = '\n'.join(code_lines[context_start:context_end])
-            context['function_start'] = context_start
-            context['function_end'] = context_end
-    
-    return context
+    if window is None:
+        window = 2 * (getattr(executor, '_max_workers', None) or os.cpu_count() or 1)
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # 调用方中途停止时取消还没开始的任务
+        for future in pending:
+            future.cancel()
 
 
-def format_for_ai_review(commit, api_base_url=None, project_id=None, access_token=None, platform='gitlab'):
+def _iter_ai_review_parts(commit, api_base_url, project_id, access_token, platform, session,
+                          file_cache, local_repo, archive_threshold, executor=None,
+                          patch_index=None):
     """
-    将提交记录格式化为AI审核友好的格式，包含完整的代码上下文
-    
-    参数:
-        commit: 提交记录字典
-        api_base_url: API基础URL（用于获取文件完整内容）
-        project_id: 项目ID（用于获取文件完整内容）
-        access_token: API访问令牌（用于获取文件完整内容）
-        platform: 平台类型
+    iter_ai_review_blocks / iter_ai_review_chunks 的共同实现
     
     返回:
-        格式化的字符串，包含改动前后代码对比和完整上下文
+        生成器，先产出提交信息和改动统计的文本，之后每个文件产出一个 ReviewFileSection
     """
     if not commit.get('diff') or not commit.get('diff').get('success'):
-        return None
+        return
     
     diff_info = commit['diff']
     output_lines = []
@@ -357,6 +1264,10 @@ def format_for_ai_review(commit, api_base_url=None, project_id=None, access_toke
             output_lines.append(f"- **提交说明**: {commit_msg[:200]}...")
         else:
             output_lines.append(f"- **提交说明**: {commit_msg}")
+    if commit.get('duplicate_of'):
+        output_lines.append(
+            f"- **重复改动**: 与提交 `{commit['duplicate_of'][:8]}` 的改动相同（补丁指纹 `{commit.get('patch_id', '')[:12]}`）"
+        )
     output_lines.append("")
     
     # 改动统计
@@ -373,144 +1284,411 @@ def format_for_ai_review(commit, api_base_url=None, project_id=None, access_toke
     
     # 每个文件的改动详情（包含完整上下文）
     output_lines.append("## 🔍 代码改动详情")
+    yield "\n".join(output_lines)
     
-    for file_info in diff_info.get('files', []):
-        old_path = file_info.get('old_path', '')
-        new_path = file_info.get('new_path', '')
-        change_type = file_info.get('change_type', 'modified')
-        diff_content = file_info.get('diff', '')
-        
-        # 文件标题
-        change_type_names = {
-            'added': '➕ 新增文件',
-            'deleted': '🗑️ 删除文件',
-            'modified': '✏️ 修改文件',
-            'renamed': '📝 重命名文件'
-        }
-        output_lines.append("")
-        output_lines.append("---")
-        output_lines.append("")
-        output_lines.append(f"### {change_type_names.get(change_type, '✏️ 修改')}: `{new_path or old_path}`")
-        
-        if old_path != new_path and change_type == 'renamed':
-            output_lines.append(f"  原路径: {old_path}")
-            output_lines.append(f"  新路径: {new_path}")
+    # 改动相同的提交（cherry-pick、回退后重新提交）直接复用之前生成的文件部分
+    fingerprint = commit.get('patch_id') if patch_index is not None else None
+    if fingerprint:
+        cached = patch_index.get_review(fingerprint)
+        if cached is not None:
+            yield from cached
+            return
+    
+    # 同一提交的所有文件请求复用一个会话
+    own_session = session is None and bool(api_base_url and project_id and access_token)
+    if own_session:
+        session = create_session(platform, access_token)
+    
+    try:
+        # 批量预取文件内容：GitHub 一次GraphQL查询取回所有文件；GitLab 文件较多时下载一次压缩包
+        can_read_file = local_repo is not None or (api_base_url and project_id and access_token)
+        prefetched = None
+        if local_repo is None and can_read_file and commit_id:
+            readable = [
+                f for f in diff_info.get('files', [])
+                if f.get('diff') and f.get('change_type') not in ('deleted', 'removed')
+            ]
+            paths = [f.get('new_path') or f.get('old_path', '') for f in readable]
+            if platform == 'github':
+                use_bulk = len(paths) > 1
+            else:
+                use_bulk = archive_threshold is not None and len(paths) > archive_threshold
+            if use_bulk:
+                prefetched = get_files_at_commit(
+                    api_base_url, project_id, commit_id, paths, access_token, platform,
+                    session=session, cache=file_cache,
+                    blob_ids={f.get('new_path') or f.get('old_path', ''): f.get('blob_id') for f in readable if f.get('blob_id')}
+                )
         
-        # 尝试获取文件完整内容和函数上下文
-        if diff_content and api_base_url and project_id and access_token and commit_id:
-            try:
-                # 获取改动后的文件内容
-                new_file_content = get_file_content_at_commit(
-                    api_base_url, project_id, commit_id, new_path or old_path,
-                    access_token, platform
+        # 文件内容在本进程中获取（网络、磁盘I/O），函数上下文提取和文本拼接由 build_file_section 完成；
+        # 传入 executor 时交给进程池，只传递路径、diff和文件内容等紧凑的输入
+        def file_inputs():
+            for file_info in diff_info.get('files', []):
+                path = file_info.get('new_path') or file_info.get('old_path', '')
+                new_file_content = None
+                if file_info.get('diff') and can_read_file and commit_id:
+                    try:
+                        if local_repo is not None:
+                            new_file_content = local_repo.read_file(commit_id, path)
+                        else:
+                            new_file_content = prefetched.get(path) if prefetched else None
+                            if new_file_content is None:
+                                # 压缩包中没有的文件（或没有批量获取）逐个请求
+                                new_file_content = get_file_content_at_commit(
+                                    api_base_url, project_id, commit_id, path,
+                                    access_token, platform, session=session,
+                                    cache=file_cache, blob_id=file_info.get('blob_id')
+                                )
+                    except Exception:
+                        new_file_content = None  # 如果获取文件内容失败，继续使用diff
+                yield (
+                    file_info.get('old_path', ''), file_info.get('new_path', ''), file_info.get('change_type', 'modified'),
+                    file_info.get('diff', ''), file_info.get('diff_omitted'),
+                    file_info.get('additions', 0), file_info.get('deletions', 0), new_file_content
                 )
-                
-                # 提取改动的行号范围
-                changed_ranges = extract_changed_ranges_from_diff(diff_content)
-                
-                if new_file_content and changed_ranges:
-                    # 保留原始文件内容用于完整显示
-                    original_file_content = new_file_content
-                    new_code_lines = new_file_content.split('\n')
-                    
-                    # 为每个改动范围提取上下文
-                    for range_idx, (_, _, new_start, new_end) in enumerate(changed_ranges):
-                        # 确定代码语言类型（根据文件扩展名）
-                        file_ext = (new_path or old_path).split('.')[-1].lower()
-                        language_map = {
-                            'cs': 'csharp', 'cpp': 'cpp', 'c': 'c',
-                            'java': 'java', 'py': 'python', 'js': 'javascript',
-                            'ts': 'typescript', 'go': 'go', 'rs': 'rust'
-                        }
-                        language = language_map.get(file_ext, 'unknown')
-                        
-                        # 提取函数上下文（从改动后的版本）
-                        context = extract_function_context(
-                            new_code_lines,
-                            (new_start - 1, new_end - 1),  # 转换为0-based索引
-                            language
-                        )
-                        
-                        # 保存function_start用于后续计算相对位置
-                        function_start_line = context.get('function_start', -1)
-                        
-                        if context.get('function_code'):
-                            output_lines.append(f"\n#### 改动 #{range_idx + 1} 所在函数（改动后）：")
-                            if context.get('namespace'):
-                                output_lines.append(f"**命名空间**: `{context['namespace']}`")
-                            if context.get('class_name'):
-                                output_lines.append(f"**类名**: `{context['class_name']}`")
-                            if context.get('function_signature'):
-                                output_lines.append(f"**函数签名**: `{context['function_signature'].strip()}`")
-                            
-                            output_lines.append("")
-                            
-                            # 格式化函数代码 - 确保有换行符
-                            func_code = context['function_code']
-                            # 如果代码中没有换行符，尝试从lines重新构建
-                            if '\n' not in func_code and function_start_line >= 0:
-                                # 从原始文件内容中提取对应的行范围
-                                func_start = function_start_line
-                                func_end_line = context.get('function_end', len(new_code_lines))
-                                if func_end_line > func_start:
-                                    func_code = '\n'.join(new_code_lines[func_start:func_end_line])
-                            
-                            # 检查代码长度，如果太长则智能截取
-                            func_lines_list = func_code.split('\n') if '\n' in func_code else [func_code]
-                            total_lines = len(func_lines_list)
-                            
-                            # 如果函数超过80行，只显示改动附近的代码
-                            if total_lines > 80:
-                                # 找到改动行在函数中的相对位置
-                                # function_start_line 是函数开始的0-based索引
-                                # new_start - 1 是改动行的0-based索引
-                                if function_start_line >= 0:
-                                    change_line_relative = (new_start - 1) - function_start_line
-                                else:
-                                    change_line_relative = 0
-                                # 显示改动前后各30行
-                                display_start = max(0, change_line_relative - 30)
-                                display_end = min(total_lines, change_line_relative + 30)
-                                
-                                output_lines.append("<details>")
-                                output_lines.append("<summary>📝 展开查看完整函数代码（改动后）</summary>")
-                                output_lines.append("")
-                                output_lines.append("```csharp")
-                                if display_start > 0:
-                                    output_lines.append(f"... (省略前 {display_start} 行) ...\n")
-                                output_lines.append('\n'.join(func_lines_list[display_start:display_end]))
-                                if display_end < total_lines:
-                                    output_lines.append(f"\n... (省略后 {total_lines - display_end} 行) ...")
-                                output_lines.append("```")
-                                output_lines.append("</details>")
-                            else:
-                                # 函数不长，完整显示
-                                output_lines.append("<details>")
-                                output_lines.append("<summary>📝 展开查看完整函数代码（改动后）</summary>")
-                                output_lines.append("")
-                                output_lines.append("```csharp")
-                                output_lines.append(func_code.rstrip())
-                                output_lines.append("```")
-                                output_lines.append("</details>")
-            except Exception:
-                pass  # 如果获取文件内容失败，继续使用diff
-        
-        # 显示diff内容（标准unified diff格式）
-        if diff_content:
-            output_lines.append("")
-            output_lines.append("#### 💡 代码差异（Diff）:")
-            output_lines.append("")
-            output_lines.append("```diff")
-            output_lines.append(diff_content.rstrip())
-            output_lines.append("```")
-        elif change_type == 'deleted':
-            output_lines.append("\n[文件已完全删除]")
-        elif change_type == 'added':
-            output_lines.append("\n[新文件已添加]")
         
-        output_lines.append("")
+        if executor is None:
+            sections = (build_file_section(*args) for args in file_inputs())
+        else:
+            # 按文件顺序返回结果，只提前读取少量文件的内容
+            sections = _map_in_order(executor, _build_file_section_args, file_inputs())
+        # 只有需要写入补丁索引时才保留已生成的内容
+        collected = [] if fingerprint else None
+        for section in sections:
+            if collected is not None:
+                collected.append(section)
+            yield section
+        if fingerprint:
+            patch_index.put_review(fingerprint, collected)
+    finally:
+        if own_session:
+            session.close()
+
+
+def resolve_api_base_url(platform='gitlab', base_url=None):
+    """
+    根据平台和配置的base_url得到API基础URL
+    
+    参数:
+        platform: 平台类型
+        base_url: 配置的站点地址或API地址（可选）
+    
+    返回:
+        API基础URL字符串
+    """
+    # GitLab API需要 /api/v4 路径，所以需要拼接
+    # base_url参数默认是 http://git.server.tongbu.com/，需要拼接 /api/v4
+    if platform == 'github':
+        # GitHub使用公共API
+        return 'https://api.github.com'
+    elif base_url:
+        # 如果base_url已经包含/api/v4，直接使用；否则自动拼接
+        base_url = base_url.rstrip('/')
+        if not base_url.endswith('/api/v4'):
+            if base_url.endswith('/api'):
+                return f'{base_url}/v4'
+            else:
+                # 自动拼接 /api/v4（例如：http://git.server.tongbu.com -> http://git.server.tongbu.com/api/v4）
+                return f'{base_url}/api/v4'
+        else:
+            return base_url
+    else:
+        # 默认使用内部GitLab（如果base_url为空）
+        return 'http://git.server.tongbu.com/api/v4'
+
+
+def iter_commits(access_token, project_id, platform='gitlab', base_url=None, ref_name=None, page_size=100,
+                 max_commits=None, session=None, prefetch=True, since_sha=None, response_cache=None):
+    """
+    流式获取提交列表，自动翻页，逐条产出格式化后的提交（不含diff）
+    
+    参数:
+        access_token: API访问令牌
+        project_id: 项目ID（GitLab）或仓库路径（GitHub格式：owner/repo）
+        platform: 平台类型，'gitlab' 或 'github'
+        base_url: 自定义API基础URL
+        ref_name: 分支或标签名称（可选）
+        page_size: 每页数量（GitLab/GitHub 最大 100）
+        max_commits: 最多产出的提交数量（None 表示遍历全部历史）
+        session: 共享的HTTP会话（可选，不传则内部创建并在遍历结束时关闭）
+        prefetch: 是否在处理当前页时预取下一页
+        since_sha: 水位线提交SHA（可选），遇到该提交即停止翻页，只产出比它新的提交
+        response_cache: ResponseCache 实例（可选，列表请求使用 ETag/Last-Modified 条件请求）
+    
+    返回:
+        生成器，逐条产出 format_commit_item 格式的提交字典
+    """
+    platform = platform.lower()
+    api_base_url = resolve_api_base_url(platform, base_url)
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
+    
+    items = iter_commit_items(
+        session, api_base_url, project_id, platform, ref_name, page_size, max_commits,
+        prefetch=prefetch, since_sha=since_sha, response_cache=response_cache
+    )
+    try:
+        for commit_item in items:
+            yield format_commit_item(commit_item, platform)
+    finally:
+        items.close()
+        if own_session:
+            session.close()
+
+
+def get_compare_commits(api_base_url, project_id, base, head, access_token=None, platform='gitlab', session=None, timeout=30):
+    """
+    获取 base..head 之间的提交（head 可达、base 不可达的提交），例如一次推送的 before..after
+    
+    参数:
+        api_base_url: API基础URL
+        project_id: 项目ID（GitLab）或仓库路径（GitHub格式：owner/repo）
+        base: 起点（提交SHA或分支名称，不包含）
+        head: 终点（提交SHA或分支名称，包含）
+        access_token: API访问令牌（不传 session 时使用）
+        platform: 平台类型
+        session: 共享的HTTP会话（可选，不传则内部创建并在结束时关闭）
+        timeout: 请求超时时间（秒）
+    
+    返回:
+        format_commit_item 格式的提交列表（旧的在前）；GitHub 的比较接口最多返回250个提交
+    """
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
+    try:
+        if platform == 'github':
+            url = f'{api_base_url}/repos/{project_id}/compare/{base}...{head}'
+            response = session.get(url, timeout=timeout)
+        else:
+            url = f'{api_base_url}/projects/{project_id}/repository/compare'
+            response = session.get(url, params={'from': base, 'to': head}, timeout=timeout)
+        response.raise_for_status()
+        return [format_commit_item(item, platform) for item in response.json().get('commits') or []]
+    finally:
+        if own_session:
+            session.close()
+
+
+def format_commit_item(commit_item, platform='gitlab'):
+    """
+    将API返回的单条提交转换为统一的提交字典（不含diff）
+    
+    参数:
+        commit_item: API返回的提交对象
+        platform: 平台类型
+    
+    返回:
+        提交记录（GitLabCommit 或 GitHubCommit，可按字典访问），'diff' 为 None，'files_changed' 为空列表
+    """
+    if platform == 'gitlab':
+        return GitLabCommit(
+            id=commit_item.get('id'),
+            short_id=commit_item.get('short_id'),
+            title=commit_item.get('title'),
+            message=commit_item.get('message'),
+            author_name=commit_item.get('author_name'),
+            author_email=commit_item.get('author_email'),
+            authored_date=commit_item.get('authored_date'),
+            committer_name=commit_item.get('committer_name'),
+            committer_email=commit_item.get('committer_email'),
+            committed_date=commit_item.get('committed_date'),
+            web_url=commit_item.get('web_url')
+        )
+    
+    # GitHub
+    commit_sha = commit_item.get('sha')
+    commit_info = commit_item.get('commit', {})
+    author_info = commit_info.get('author', {})
+    committer_info = commit_info.get('committer', {})
+    
+    return GitHubCommit(
+        sha=commit_sha,
+        short_sha=commit_sha[:7] if commit_sha else '',
+        message=commit_info.get('message', ''),
+        title=commit_info.get('message', '').split('\n')[0] if commit_info.get('message') else '',
+        author_name=author_info.get('name'),
+        author_email=author_info.get('email'),
+        authored_date=author_info.get('date'),
+        committer_name=committer_info.get('name'),
+        committer_email=committer_info.get('email'),
+        committed_date=committer_info.get('date'),
+        html_url=commit_item.get('html_url')
+    )
+
+
+class PatchIndex:
+    """
+    按补丁指纹（diff_parser.patch_id）记录处理过的提交
+    
+    同一改动被 cherry-pick 到其他分支、或回退后重新提交时，后出现的提交复用第一次出现时的diff对象
+    和已生成的审核内容，不再获取文件内容、重新提取上下文。
+    diff 只弱引用（第一次出现的提交已经释放时不额外占用内存）；审核内容只保留最近 max_reviews 个。
+    线程安全，Webhook 的多个工作线程可以共用一个实例
+    """
+    
+    def __init__(self, max_entries=10000, max_reviews=64):
+        """
+        参数:
+            max_entries: 记住的指纹数量上限（超出时淘汰最久未出现的）
+            max_reviews: 保留审核内容的指纹数量上限
+        """
+        self.max_entries = max_entries
+        self.max_reviews = max_reviews
+        self.entries = OrderedDict()  # 指纹 -> (第一次出现的提交ID, diff的弱引用或None)
+        self.reviews = OrderedDict()  # 指纹 -> ReviewFileSection 列表
+        self.duplicates = 0
+        self.lock = threading.Lock()
+    
+    def add(self, commit):
+        """
+        记录一个带diff的提交：设置 commit['patch_id']；改动与更早的提交相同时设置 commit['duplicate_of']，
+        并让 commit['diff'] / commit['files_changed'] 指向更早提交的diff（仍在内存中时）
+        
+        参数:
+            commit: 提交记录（diff 获取失败或没有diff时不做任何处理）
+        
+        返回:
+            改动相同的更早提交ID，没有时返回 None
+        """
+        diff_info = commit.get('diff')
+        if not diff_info or not diff_info.get('success'):
+            return None
+        fingerprint = patch_id(diff_info.get('files', []))
+        if fingerprint is None:
+            return None
+        commit_id = commit.get('id') or commit.get('sha')
+        commit['patch_id'] = fingerprint
+        
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                diff_ref = weakref.ref(diff_info) if isinstance(diff_info, CommitDiff) else None
+                self.entries[fingerprint] = (commit_id, diff_ref)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                return None
+            self.entries.move_to_end(fingerprint)
+            first_id, diff_ref = entry
+            if first_id == commit_id:
+                return None  # 同一个提交再次出现（例如推送到多个分支）
+            self.duplicates += 1
+        
+        commit['duplicate_of'] = first_id
+        earlier_diff = diff_ref() if diff_ref is not None else None
+        if earlier_diff is not None:
+            commit['diff'] = earlier_diff
+            commit['files_changed'] = earlier_diff['files']
+        return first_id
+    
+    def iter_dedup(self, commits):
+        """
+        对提交逐个调用 add
+        
+        参数:
+            commits: 提交的可迭代对象（列表或生成器）
+        
+        返回:
+            生成器，按原顺序产出提交
+        """
+        for commit_data in commits:
+            self.add(commit_data)
+            yield commit_data
+    
+    def get_review(self, fingerprint):
+        """返回该指纹已生成的审核内容（ReviewFileSection 列表），没有时返回 None"""
+        with self.lock:
+            sections = self.reviews.get(fingerprint)
+            if sections is not None:
+                self.reviews.move_to_end(fingerprint)
+            return sections
+    
+    def put_review(self, fingerprint, sections):
+        """保存该指纹的审核内容"""
+        with self.lock:
+            self.reviews[fingerprint] = sections
+            self.reviews.move_to_end(fingerprint)
+            while len(self.reviews) > self.max_reviews:
+                self.reviews.popitem(last=False)
+
+
+def attach_commit_diffs(commits, api_base_url, project_id, access_token, platform='gitlab', session=None, jobs=1, cache=None,
+                        byte_budget=None):
+    """
+    为提交列表获取diff，结果直接写入每个提交字典的 'diff' 和 'files_changed'
+    
+    参数:
+        commits: format_commit_item 生成的提交字典列表
+        api_base_url: API基础URL
+        project_id: 项目ID
+        access_token: API访问令牌
+        platform: 平台类型
+        session: 共享的HTTP会话
+        jobs: 并发获取diff的线程数，1 表示逐个获取
+        cache: DiffCache 实例（可选）
+        byte_budget: 每个提交保留的diff总字节数上限（可选）
+    
+    返回:
+        传入的 commits 列表（顺序不变）
+    """
+    def fetch_diff(commit_data):
+        return get_commit_diff(
+            api_base_url=api_base_url,
+            project_id=project_id,
+            commit_id=commit_data.get('id') or commit_data.get('sha'),
+            access_token=access_token,
+            platform=platform,
+            session=session,
+            cache=cache,
+            byte_budget=byte_budget
+        )
+    
+    if jobs and jobs > 1:
+        # 有界线程池并发获取，map 保证结果顺序与 commits 一致
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            diff_results = list(executor.map(fetch_diff, commits))
+    else:
+        diff_results = []
+        for commit_data in commits:
+            diff_results.append(fetch_diff(commit_data))
+            # 会话没有限流器时，避免请求过快，稍微延迟
+            if getattr(session, 'rate_limiter', None) is None:
+                time.sleep(0.1)
+    
+    for commit_data, diff_result in zip(commits, diff_results):
+        if diff_result['success']:
+            commit_data['diff'] = diff_result
+            commit_data['files_changed'] = diff_result['files']
+        else:
+            commit_data['diff'] = {'error': diff_result['error']}
+    
+    return commits
+
+
+def iter_commit_diffs(commits, api_base_url, project_id, access_token, platform='gitlab', session=None, jobs=1, cache=None,
+                      byte_budget=None):
+    """
+    流式版 attach_commit_diffs：每凑满 jobs 个提交并发获取一批diff，然后逐条产出
+    
+    参数:
+        commits: 提交字典的可迭代对象（例如 iter_commits 生成器）
+        其他参数同 attach_commit_diffs
     
-    return "\n".join(output_lines)
+    返回:
+        生成器，按原顺序逐条产出带diff的提交字典
+    """
+    batch_size = max(1, jobs or 1)
+    batch = []
+    for commit_data in commits:
+        batch.append(commit_data)
+        if len(batch) >= batch_size:
+            yield from attach_commit_diffs(batch, api_base_url, project_id, access_token, platform, session, jobs, cache,
+                                           byte_budget)
+            batch = []
+    if batch:
+        yield from attach_commit_diffs(batch, api_base_url, project_id, access_token, platform, session, jobs, cache,
+                                       byte_budget)
 
 
 def load_config(config_file='config.json'):
@@ -530,7 +1708,28 @@ def load_config(config_file='config.json'):
         'base_url': 'http://git.server.tongbu.com/',
         'per_page': 10,
         'ref_name': None,
-        'include_diff': True
+        'include_diff': True,
+        'jobs': 1,
+        'rate_limit': 10,
+        'diff_cache': None,
+        'file_cache_dir': None,
+        'file_cache_memory_mb': 64,
+        'file_cache_disk_mb': 512,
+        'archive_threshold': ARCHIVE_THRESHOLD,
+        'diff_budget_mb': 10,
+        'ai_review_max_tokens': None,
+        'format_processes': 1,
+        'dedup_patches': True,
+        'max_commits': INCREMENTAL_MAX_COMMITS,
+        'list_cache_dir': None,
+        'list_cache_ttl': 30,
+        'repo_path': None,
+        'watch_refs': None,
+        'webhook_host': '0.0.0.0',
+        'webhook_port': 8080,
+        'webhook_secret': None,
+        'webhook_workers': 4,
+        'webhook_queue_size': 100
     }
     
     if os.path.exists(config_file):
@@ -547,28 +1746,74 @@ def load_config(config_file='config.json'):
     return default_config
 
 
-def main(access_token=None, project_id=None, platform=None, base_url=None, per_page=None, ref_name=None, include_diff=None, config_file='config.json'):
+def _cap_commits(commits, max_commits, since_sha, response):
+    """
+    限制带水位线获取的提交数量
+    
+    参数:
+        commits: 按 max_commits + 1 获取的提交生成器（多出的一条表示上限之内没有遇到水位线）
+        max_commits: 最多产出的提交数量
+        since_sha: 水位线提交SHA（只用于说明）
+        response: main 的结果字典，超出上限时设置 response['watermark_stale'] = True（由调用方决定如何提示）
+    
+    返回:
+        生成器，最多产出 max_commits 条提交
+    """
+    try:
+        for count, commit_data in enumerate(commits):
+            if count >= max_commits:
+                response['watermark_stale'] = True
+                return
+            yield commit_data
+    finally:
+        commits.close()
+
+
+def main(access_token=None, project_id=None, platform=None, base_url=None, per_page=None, ref_name=None, include_diff=None, config_file='config.json', session=None, jobs=None, rate_limit=None,
+         diff_cache=None, response_cache=None, repo_path=None, since_sha=None, ndjson_output=None,
+         diff_budget_mb=None, patch_index=None, max_commits=None, exclude_ids=None):
     """
     获取Git项目的最新提交内容
     
     参数:
         access_token: API访问令牌（如果为None，从配置文件读取）
         project_id: 项目ID（GitLab）或仓库路径（GitHub格式：owner/repo）（如果为None，从配置文件读取）
-        platform: 平台类型，'gitlab' 或 'github'（如果为None，从配置文件读取）
+        platform: 平台类型，'gitlab'、'github' 或 'local'（本地仓库）（如果为None，从配置文件读取）
         base_url: 自定义API基础URL（如果为None，从配置文件读取）
-        per_page: 返回的提交数量（如果为None，从配置文件读取）
+        per_page: 返回的提交数量，超过单页上限（100）时自动翻页（如果为None，从配置文件读取）
         ref_name: 分支或标签名称（如果为None，从配置文件读取）
         include_diff: 是否获取每个提交的改动内容（diff）（如果为None，从配置文件读取）
         config_file: 配置文件路径，默认 'config.json'
+        session: 共享的HTTP会话（可选，不传则本次调用内部创建并在结束时关闭）
+        jobs: 并发获取diff的线程数（如果为None，从配置文件读取，默认1即逐个获取）
+        rate_limit: 初始限流速率，每秒请求数（如果为None，从配置文件读取；之后按服务端限流响应头自适应）
+        diff_cache: diff缓存，DiffCache 实例或SQLite文件路径（如果为None，从配置文件读取；未配置则不缓存）
+        response_cache: 提交列表的条件请求缓存，ResponseCache 实例（如果为None，按配置文件的
+                        list_cache_dir / list_cache_ttl 创建；未配置则不缓存）
+        repo_path: 本地仓库路径，platform='local' 时使用（如果为None，从配置文件读取）
+        since_sha: 水位线提交SHA（可选），只获取比它新的提交
+        ndjson_output: 可写的文本文件对象（可选），传入后每条提交（含diff）准备好即写出一行JSON，
+                       提交不再保存在返回的 commits 中（内存占用不随提交数量增长）
+        diff_budget_mb: 每个提交保留的diff总大小上限（MB），超出预算的文件只保留增删行数
+                        （如果为None，从配置文件读取，默认10；配置为 null 或 0 时不限制）
+        patch_index: PatchIndex 实例（可选），为每个提交设置补丁指纹，改动与更早的提交相同时标记 duplicate_of
+                     并共享diff（如果为None，按配置文件的 dedup_patches 创建，默认开启；传入 False 时不识别；
+                     多次调用可传入同一个实例）
+        max_commits: 传入 since_sha 时最多获取的提交数（如果为None，从配置文件读取，默认500）；
+                     翻页到该数量仍没有遇到水位线时停止，结果中 'watermark_stale' 为 True
+        exclude_ids: 已处理过的提交ID集合（可选），这些提交不获取diff，也不出现在结果中
     
     返回:
         字典结构:
         {
             'success': bool,  # 是否成功获取
-            'commits': list,  # 提交列表，每个提交包含diff信息
+            'commits': list,  # 提交列表，每个提交包含diff信息（传入 ndjson_output 时为空列表）
             'count': int,     # 提交数量
             'error': str      # 错误信息（如果有）
         }
+        传入 ndjson_output 时另有 'newest_commit'：最新的一条提交，没有提交时为 None；
+        传入 since_sha 时另有 'watermark_stale'：是否在 max_commits 条之内没有遇到水位线
+        （此时只包含最新的 max_commits 条，更早的新提交没有获取）
     """
     # 加载配置文件
     config = load_config(config_file)
@@ -588,6 +1833,27 @@ def main(access_token=None, project_id=None, platform=None, base_url=None, per_p
         ref_name = config.get('ref_name')
     if include_diff is None:
         include_diff = config.get('include_diff', True)
+    if jobs is None:
+        jobs = config.get('jobs', 1)
+    if rate_limit is None:
+        rate_limit = config.get('rate_limit', 10)
+    if diff_cache is None:
+        diff_cache = config.get('diff_cache')
+    if response_cache is None and config.get('list_cache_dir'):
+        response_cache = ResponseCache(config['list_cache_dir'], config.get('list_cache_ttl', 30))
+    if repo_path is None:
+        repo_path = config.get('repo_path')
+    if diff_budget_mb is None:
+        diff_budget_mb = config.get('diff_budget_mb')
+    byte_budget = int(diff_budget_mb * 1024 * 1024) if diff_budget_mb else None
+    if patch_index is None and config.get('dedup_patches', True):
+        patch_index = PatchIndex()
+    if since_sha:
+        max_commits = max_commits or config.get('max_commits') or INCREMENTAL_MAX_COMMITS
+        # 多取一条，用于判断上限之内是否遇到了水位线
+        list_limit = max_commits + 1
+    else:
+        list_limit = per_page
     
     # 初始化返回字典，确保结构一致
     response = {
@@ -596,161 +1862,113 @@ def main(access_token=None, project_id=None, platform=None, base_url=None, per_p
         'count': 0,
         'error': None
     }
+    if since_sha:
+        response['watermark_stale'] = False
+    own_session = False
+    own_cache = False
     
     try:
-        # 参数验证
-        if not access_token or not project_id:
-            response['error'] = '缺少必需参数: access_token 和 project_id'
-            return response
-        
         platform = platform.lower()
         
-        # 设置API基础URL
-        # GitLab API需要 /api/v4 路径，所以需要拼接
-        # base_url参数默认是 http://git.server.tongbu.com/，需要拼接 /api/v4
-        if platform == 'github':
-            # GitHub使用公共API
-            api_base_url = 'https://api.github.com'
-        elif base_url:
-            # 如果base_url已经包含/api/v4，直接使用；否则自动拼接
-            base_url = base_url.rstrip('/')
-            if not base_url.endswith('/api/v4'):
-                if base_url.endswith('/api'):
-                    api_base_url = f'{base_url}/v4'
-                else:
-                    # 自动拼接 /api/v4（例如：http://git.server.tongbu.com -> http://git.server.tongbu.com/api/v4）
-                    api_base_url = f'{base_url}/api/v4'
-            else:
-                api_base_url = base_url
+        # 本地仓库：一次 git log --patch 同时读出提交和diff，不访问API
+        if platform == 'local':
+            if not repo_path:
+                response['error'] = '缺少必需参数: repo_path'
+                return response
+            commits = LocalRepository(repo_path).iter_commits(
+                ref_name,
+                max_commits=list_limit,
+                since_sha=since_sha,
+                include_diff=include_diff
+            )
+            if since_sha:
+                commits = _cap_commits(commits, max_commits, since_sha, response)
+            if exclude_ids:
+                commits = (c for c in commits if c.get('id') not in exclude_ids)
         else:
-            # 默认使用内部GitLab（如果base_url为空）
-            api_base_url = 'http://git.server.tongbu.com/api/v4'
-        
-        # 设置请求头
-        if platform == 'gitlab':
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-        else:  # GitHub
-            headers = {
-                'Authorization': f'token {access_token}',
-                'Accept': 'application/vnd.github.v3+json',
-                'Content-Type': 'application/json'
-            }
-        
-        # 构建API URL和参数
-        if platform == 'gitlab':
-            url = f'{api_base_url}/projects/{project_id}/repository/commits'
-            params = {
-                'per_page': per_page,
-                'order_by': 'created_at',
-                'sort': 'desc'
-            }
-            if ref_name:
-                params['ref_name'] = ref_name
-        else:  # GitHub
-            url = f'{api_base_url}/repos/{project_id}/commits'
-            params = {'per_page': per_page}
-            if ref_name:
-                params['sha'] = ref_name
-        
-        # 发起API请求
-        api_response = requests.get(url, headers=headers, params=params, timeout=30)
-        api_response.raise_for_status()
-        
-        commits_data = api_response.json()
-        
-        # 格式化提交数据
-        formatted_commits = []
-        
-        if platform == 'gitlab':
-            for commit_item in commits_data:
-                commit_id = commit_item.get('id')
-                commit_data = {
-                    'id': commit_id,
-                    'short_id': commit_item.get('short_id'),
-                    'title': commit_item.get('title'),
-                    'message': commit_item.get('message'),
-                    'author_name': commit_item.get('author_name'),
-                    'author_email': commit_item.get('author_email'),
-                    'authored_date': commit_item.get('authored_date'),
-                    'committer_name': commit_item.get('committer_name'),
-                    'committer_email': commit_item.get('committer_email'),
-                    'committed_date': commit_item.get('committed_date'),
-                    'web_url': commit_item.get('web_url'),
-                    'diff': None,
-                    'files_changed': []
-                }
-                
-                # 如果需要获取diff
-                if include_diff:
-                    diff_result = get_commit_diff(
+            # 参数验证
+            if not access_token or not project_id:
+                response['error'] = '缺少必需参数: access_token 和 project_id'
+                return response
+            
+            # 设置API基础URL
+            api_base_url = resolve_api_base_url(platform, base_url)
+            
+            # 配置的是缓存文件路径时，本次调用内部打开并在结束时关闭
+            if isinstance(diff_cache, str):
+                diff_cache = DiffCache(diff_cache)
+                own_cache = True
+            
+            # 创建共享会话（请求头在会话中只构建一次）
+            if session is None:
+                session = create_session(
+                    platform, access_token,
+                    pool_size=max(10, jobs or 1),
+                    rate_limiter=RateLimiter(rate=rate_limit, burst=max(1, jobs or 1))
+                )
+                own_session = True
+            
+            # 获取并格式化提交数据（超过单页上限时自动翻页）
+            commits = iter_commits(
+                access_token, project_id, platform, base_url,
+                ref_name=ref_name,
+                max_commits=list_limit,
+                session=session,
+                since_sha=since_sha,
+                response_cache=response_cache
+            )
+            if since_sha:
+                commits = _cap_commits(commits, max_commits, since_sha, response)
+            if exclude_ids:
+                # 已处理过的提交不再获取diff
+                commits = (c for c in commits if (c.get('id') or c.get('sha')) not in exclude_ids)
+            
+            # 如果需要获取diff
+            if include_diff:
+                if ndjson_output is not None:
+                    # 流式输出时逐批获取，内存中最多保留 jobs 个提交
+                    commits = iter_commit_diffs(
+                        commits,
                         api_base_url=api_base_url,
                         project_id=project_id,
-                        commit_id=commit_id,
                         access_token=access_token,
-                        platform=platform
+                        platform=platform,
+                        session=session,
+                        jobs=jobs,
+                        cache=diff_cache,
+                        byte_budget=byte_budget
                     )
-                    
-                    if diff_result['success']:
-                        commit_data['diff'] = diff_result
-                        commit_data['files_changed'] = diff_result['files']
-                    else:
-                        commit_data['diff'] = {'error': diff_result['error']}
-                    
-                    # 避免请求过快，稍微延迟
-                    time.sleep(0.1)
-                
-                formatted_commits.append(commit_data)
-        else:  # GitHub
-            for commit_item in commits_data:
-                commit_sha = commit_item.get('sha')
-                commit_info = commit_item.get('commit', {})
-                author_info = commit_info.get('author', {})
-                committer_info = commit_info.get('committer', {})
-                
-                commit_data = {
-                    'sha': commit_sha,
-                    'short_sha': commit_sha[:7] if commit_sha else '',
-                    'message': commit_info.get('message', ''),
-                    'title': commit_info.get('message', '').split('\n')[0] if commit_info.get('message') else '',
-                    'author_name': author_info.get('name'),
-                    'author_email': author_info.get('email'),
-                    'authored_date': author_info.get('date'),
-                    'committer_name': committer_info.get('name'),
-                    'committer_email': committer_info.get('email'),
-                    'committed_date': committer_info.get('date'),
-                    'html_url': commit_item.get('html_url'),
-                    'diff': None,
-                    'files_changed': []
-                }
-                
-                # 如果需要获取diff
-                if include_diff:
-                    diff_result = get_commit_diff(
+                else:
+                    commits = attach_commit_diffs(
+                        list(commits),
                         api_base_url=api_base_url,
                         project_id=project_id,
-                        commit_id=commit_sha,
                         access_token=access_token,
-                        platform=platform
+                        platform=platform,
+                        session=session,
+                        jobs=jobs,
+                        cache=diff_cache,
+                        byte_budget=byte_budget
                     )
-                    
-                    if diff_result['success']:
-                        commit_data['diff'] = diff_result
-                        commit_data['files_changed'] = diff_result['files']
-                    else:
-                        commit_data['diff'] = {'error': diff_result['error']}
-                    
-                    # 避免请求过快，稍微延迟
-                    time.sleep(0.1)
-                
-                formatted_commits.append(commit_data)
+        
+        # 按补丁指纹标记 cherry-pick / 重新提交的相同改动
+        if include_diff and patch_index:
+            commits = patch_index.iter_dedup(commits)
+        
+        if ndjson_output is not None:
+            # 流式输出：逐条写出，只保留最新的一条
+            response['newest_commit'] = None
+            for commit_data in commits:
+                if response['newest_commit'] is None:
+                    response['newest_commit'] = commit_data
+                write_ndjson_record(ndjson_output, commit_data)
+                response['count'] += 1
+        else:
+            response['commits'] = list(commits)
+            response['count'] = len(response['commits'])
         
         # 设置成功响应
         response['success'] = True
-        response['commits'] = formatted_commits
-        response['count'] = len(formatted_commits)
         
     except requests.exceptions.HTTPError as e:
         # HTTP错误处理
@@ -776,10 +1994,99 @@ def main(access_token=None, project_id=None, platform=None, base_url=None, per_p
         print(error_msg)
         response['error'] = error_msg
     
+    finally:
+        if own_session:
+            session.close()
+        if own_cache:
+            diff_cache.close()
+    
     # 返回结果字典，确保所有情况下都有相同的键
     return response
 
 
+
+def watch_commits(interval, refs, handle_commits, jitter=0.2, stop_event=None, seen_limit=10000, **main_kwargs):
+    """
+    常驻轮询模式：定时检查每个分支，只把之前没有见过的提交交给 handle_commits
+    
+    - 第一次轮询只记录当前最新提交作为基线（不获取diff，不处理历史提交）
+    - 之后每次轮询带上 since_sha，翻页获取比上次最新提交更新的全部提交（最多 max_commits 条）；
+      提交列表请求配合 ResponseCache 使用时，分支没有变化只需一次304请求
+    - 超过上限仍没有遇到上次的最新提交时打印警告，只处理获取到的提交，并且不移动起点，
+      之后的轮询仍从上次的最新提交开始（已处理过的提交不再获取diff）
+    - 各分支的轮询时间均匀错开，并加入随机抖动，避免同时请求服务器
+    
+    参数:
+        interval: 每个分支的轮询间隔（秒）
+        refs: 分支名称列表
+        handle_commits: 回调函数 handle_commits(ref_name, commits)，commits 为新提交列表（旧的在前）
+        jitter: 轮询间隔的随机抖动比例（0.2 表示 ±20%）
+        stop_event: threading.Event（可选），设置后退出循环
+        seen_limit: 每个分支记住的已处理提交数量上限
+        **main_kwargs: 传给 main 的其他参数（session、diff_cache、response_cache 等应传入共享实例）
+    """
+    refs = list(refs) or [None]
+    heads = {}
+    seen = {}
+    stale = {}  # 分支 -> 超出上限时的起点（同一起点只警告一次）
+    now = time.monotonic()
+    # 初次轮询在一个间隔内均匀错开
+    due = {ref_name: now + interval * idx / len(refs) for idx, ref_name in enumerate(refs)}
+    
+    while stop_event is None or not stop_event.is_set():
+        ref_name = min(due, key=due.get)
+        wait = due[ref_name] - time.monotonic()
+        if wait > 0:
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    break
+            else:
+                time.sleep(wait)
+        
+        baseline = ref_name not in heads
+        options = dict(main_kwargs)
+        if baseline:
+            options['include_diff'] = False
+        else:
+            options['exclude_ids'] = seen.get(ref_name)
+        result = main(ref_name=ref_name, since_sha=heads.get(ref_name), **options)
+        
+        if not result['success']:
+            print(f"[{ref_name or '默认分支'}] 轮询失败: {result['error']}")
+        else:
+            ref_seen = seen.setdefault(ref_name, OrderedDict())
+            new_commits = []
+            for commit in result['commits']:
+                commit_id = commit.get('id') or commit.get('sha')
+                if commit_id not in ref_seen:
+                    ref_seen[commit_id] = True
+                    new_commits.append(commit)
+            while len(ref_seen) > seen_limit:
+                ref_seen.popitem(last=False)
+            
+            if result.get('watermark_stale'):
+                # 上限之外还有没处理的提交（或上次的最新提交已不在分支上），不移动起点
+                if stale.get(ref_name) != heads[ref_name]:
+                    stale[ref_name] = heads[ref_name]
+                    print(f"[{ref_name or '默认分支'}] 警告: 在 max_commits 上限内没有找到上次的最新提交 "
+                          f"{heads[ref_name][:8]}（新提交超过上限，或分支被强制推送、变基），更早的提交没有处理；"
+                          f"之后的轮询仍从该提交开始")
+            elif result['commits']:
+                heads[ref_name] = result['commits'][0].get('id') or result['commits'][0].get('sha')
+                stale.pop(ref_name, None)
+            elif baseline:
+                heads[ref_name] = None
+            
+            if baseline:
+                print(f"[{ref_name or '默认分支'}] 开始监听，基线提交: {(heads[ref_name] or '无')[:8]}")
+            elif new_commits:
+                handle_commits(ref_name, list(reversed(new_commits)))
+        
+        due[ref_name] += interval * random.uniform(1 - jitter, 1 + jitter)
+        # 处理耗时超过间隔时，从当前时间重新计算，不连续补跑
+        due[ref_name] = max(due[ref_name], time.monotonic())
+
+
 if __name__ == '__main__':
     # 命令行使用示例
     import argparse
@@ -787,17 +2094,39 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='获取Git项目的最新提交内容')
     parser.add_argument('--token', help='API访问令牌（如果不传，从config.json读取）')
     parser.add_argument('--project-id', type=int, help='项目ID (GitLab) 或仓库路径 (GitHub: owner/repo)，如果不传，从config.json读取）')
-    parser.add_argument('--platform', choices=['gitlab', 'github'], help='平台类型（如果不传，从config.json读取）')
+    parser.add_argument('--platform', choices=['gitlab', 'github', 'local'], help='平台类型（如果不传，从config.json读取）')
+    parser.add_argument('--repo-path', help='本地仓库路径，--platform local 时使用（如果不传，从config.json读取）')
     parser.add_argument('--base-url', help='自定义API基础URL（如果不传，从config.json读取）')
     parser.add_argument('--per-page', type=int, help='返回的提交数量（如果不传，从config.json读取）')
     parser.add_argument('--ref', help='分支或标签名称（如果不传，从config.json读取）')
     parser.add_argument('--config', default='config.json', help='配置文件路径（默认: config.json）')
     parser.add_argument('--output', help='保存到JSON文件')
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='json',
+                        help='输出格式（默认: json）；ndjson 每条提交准备好即输出一行，未指定 --output 时写到标准输出')
     parser.add_argument('--no-diff', action='store_true', help='不获取改动内容（diff），只获取提交基本信息')
+    parser.add_argument('--no-dedup', action='store_true', help='不按补丁指纹识别 cherry-pick / 重新提交的相同改动（默认识别，相同改动复用之前的diff和AI审核内容）')
+    parser.add_argument('--processes', type=int, help='AI审核格式中函数上下文提取和文本拼接使用的进程数，大于1时按文件并行（如果不传，从config.json读取，默认1即在当前进程中执行）')
+    parser.add_argument('--jobs', type=int, help='并发获取diff的线程数（如果不传，从config.json读取，默认1）')
+    parser.add_argument('--diff-budget-mb', type=float, help='每个提交保留的diff总大小上限（MB），超出预算的文件只保留增删行数（如果不传，从config.json读取，默认10）')
+    parser.add_argument('--diff-cache', help='diff缓存的SQLite文件路径（如果不传，从config.json读取；未配置则不缓存）')
+    parser.add_argument('--file-cache-dir', help='文件内容磁盘缓存目录（如果不传，从config.json读取；未配置则只使用内存缓存）')
+    parser.add_argument('--ai-review-max-tokens', type=int, help='AI审核格式按token预算拆分为多个独立分块（每块都带提交信息，可并行审核），分块之间用 <!-- ai-review-chunk --> 分隔（如果不传，从config.json读取，默认不拆分）')
+    parser.add_argument('--archive-threshold', type=int, help=f'AI审核时一个提交需要读取的文件数超过该值，GitLab 改为下载一次仓库压缩包获取（如果不传，从config.json读取，默认{ARCHIVE_THRESHOLD}）')
+    parser.add_argument('--list-cache-dir', help='提交列表的条件请求缓存目录（如果不传，从config.json读取；内容未变化时服务端返回304，不重新下载）')
+    parser.add_argument('--rate-limit', type=float, help='初始限流速率，每秒请求数（如果不传，从config.json读取，默认10，之后按服务端限流响应头自适应）')
     parser.add_argument('--ai-review', action='store_true', help='输出AI审核格式（Markdown格式，便于传给AI审核）')
     parser.add_argument('--ai-review-output', help='将AI审核格式保存到文件（Markdown格式）')
+    parser.add_argument('--watch', type=float, metavar='INTERVAL', help='常驻轮询模式：每 INTERVAL 秒检查一次新提交，只为新提交生成AI审核格式')
+    parser.add_argument('--max-commits', type=int, help='轮询模式每次最多获取的新提交数，超出时打印警告（如果不传，从config.json读取，默认500）')
+    parser.add_argument('--watch-refs', help='轮询模式下监听的分支，逗号分隔（如果不传，从config.json的watch_refs读取，默认使用--ref）')
     
     args = parser.parse_args()
+    if args.format == 'ndjson' and (args.ai_review or args.ai_review_output):
+        parser.error('--format ndjson 不能与 --ai-review / --ai-review-output 同时使用')
+    cli_config = load_config(args.config)
+    archive_threshold = args.archive_threshold if args.archive_threshold is not None else cli_config.get('archive_threshold')
+    ai_review_max_tokens = args.ai_review_max_tokens if args.ai_review_max_tokens is not None else cli_config.get('ai_review_max_tokens')
+    format_processes = args.processes if args.processes is not None else cli_config.get('format_processes', 1)
     
     # 调用main函数，如果命令行没有传参数，传None，让main函数从配置文件读取
     call_kwargs = {
@@ -813,6 +2142,111 @@ if __name__ == '__main__':
     call_kwargs['ref_name'] = args.ref if args.ref else None
     # 处理diff参数：如果指定了--no-diff，则设为False；否则传None让函数从配置文件读取
     call_kwargs['include_diff'] = False if args.no_diff else None
+    call_kwargs['jobs'] = args.jobs if args.jobs is not None else None
+    call_kwargs['diff_cache'] = args.diff_cache if args.diff_cache else None
+    call_kwargs['diff_budget_mb'] = args.diff_budget_mb
+    call_kwargs['max_commits'] = args.max_commits
+    call_kwargs['repo_path'] = args.repo_path if args.repo_path else None
+    # 补丁指纹索引在整个运行期间共用（轮询模式下可以识别之后 cherry-pick 到其他分支的提交）
+    patch_index = PatchIndex() if not args.no_dedup and cli_config.get('dedup_patches', True) else None
+    call_kwargs['patch_index'] = patch_index or False
+    if args.list_cache_dir:
+        call_kwargs['response_cache'] = ResponseCache(args.list_cache_dir, cli_config.get('list_cache_ttl', 30))
+    
+    # 整个运行过程（提交列表、diff、AI审核的文件内容）共享一个连接池
+    cli_jobs = args.jobs or cli_config.get('jobs', 1)
+    shared_session = create_session(
+        args.platform or cli_config.get('platform', 'gitlab'),
+        args.token or cli_config.get('access_token'),
+        pool_size=max(10, cli_jobs),
+        rate_limiter=RateLimiter(
+            rate=args.rate_limit or cli_config.get('rate_limit', 10),
+            burst=max(1, cli_jobs)
+        )
+    )
+    call_kwargs['session'] = shared_session
+    
+    if args.watch:
+        # 常驻轮询：会话、diff缓存、文件缓存、提交列表缓存在整个运行期间保持
+        watch_platform = (args.platform or cli_config.get('platform', 'gitlab')).lower()
+        watch_refs = args.watch_refs.split(',') if args.watch_refs else cli_config.get('watch_refs') or [args.ref or cli_config.get('ref_name')]
+        watch_diff_cache = args.diff_cache or cli_config.get('diff_cache')
+        call_kwargs['diff_cache'] = DiffCache(watch_diff_cache) if watch_diff_cache else None
+        # 每次轮询都要向服务端确认（304很便宜），不使用 ttl 内的本地结果
+        call_kwargs['response_cache'] = ResponseCache(args.list_cache_dir or cli_config.get('list_cache_dir'), ttl=0)
+        call_kwargs.pop('ref_name')
+        watch_file_cache = FileContentCache(
+            memory_bytes=cli_config.get('file_cache_memory_mb', 64) * 1024 * 1024,
+            disk_dir=args.file_cache_dir or cli_config.get('file_cache_dir'),
+            disk_bytes=cli_config.get('file_cache_disk_mb', 512) * 1024 * 1024
+        )
+        watch_local_repo = None
+        if watch_platform == 'local':
+            watch_local_repo = LocalRepository(args.repo_path or cli_config.get('repo_path'))
+        # CPU密集的上下文提取和文本拼接交给进程池，进程在整个运行期间复用
+        watch_executor = ProcessPoolExecutor(max_workers=format_processes) if format_processes and format_processes > 1 else None
+        
+        def review_new_commits(ref_name, commits):
+            output_dir = "代码提交记录"
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            ref_label = re.sub(r'[\\/:*?"<>|]', '_', ref_name or 'default')
+            output_file = os.path.join(output_dir, f"ai审核_{ref_label}_{timestamp}.md")
+            separator = CHUNK_SEPARATOR if ai_review_max_tokens else "\n\n" + "="*80 + "\n\n"
+            written = 0
+            with open(output_file, 'w', encoding='utf-8') as f:
+                for commit in commits:
+                    if write_ai_review(
+                        f, commit,
+                        api_base_url=resolve_api_base_url(watch_platform, args.base_url or cli_config.get('base_url')),
+                        project_id=args.project_id if args.project_id is not None else cli_config.get('project_id'),
+                        access_token=args.token or cli_config.get('access_token'),
+                        platform=watch_platform,
+                        session=shared_session,
+                        file_cache=watch_file_cache,
+                        local_repo=watch_local_repo,
+                        separator=separator if written else None,
+                        archive_threshold=archive_threshold,
+                        max_tokens=ai_review_max_tokens,
+                        executor=watch_executor,
+                        patch_index=patch_index
+                    ):
+                        written += 1
+            if not written:
+                os.remove(output_file)
+                return
+            print(f"[{ref_name or '默认分支'}] {len(commits)} 个新提交，AI审核格式已保存到: {output_file}")
+        
+        print(f"开始监听 {len(watch_refs)} 个分支，每 {args.watch:g} 秒检查一次（Ctrl+C 退出）")
+        try:
+            watch_commits(args.watch, watch_refs, review_new_commits, **call_kwargs)
+        except KeyboardInterrupt:
+            print("\n已停止监听")
+        finally:
+            if call_kwargs['diff_cache'] is not None:
+                call_kwargs['diff_cache'].close()
+            if watch_local_repo is not None:
+                watch_local_repo.close()
+            if watch_executor is not None:
+                watch_executor.shutdown()
+            print(watch_file_cache.summary())
+            shared_session.close()
+        raise SystemExit(0)
+    
+    if args.format == 'ndjson':
+        # 流式输出：数据写到文件或标准输出，提示信息改写到标准错误，避免混入数据
+        ndjson_output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                result = main(**call_kwargs, ndjson_output=ndjson_output)
+        finally:
+            if args.output:
+                ndjson_output.close()
+            shared_session.close()
+        if not result['success']:
+            print(f"错误: {result['error']}", file=sys.stderr)
+        raise SystemExit(0 if result['success'] else 1)
     
     # 调用main函数（None参数会从配置文件读取）
     result = main(**call_kwargs)
@@ -850,6 +2284,8 @@ if __name__ == '__main__':
                 print(f"  改动文件: {files_count} 个")
                 print(f"  新增行数: +{total_additions}")
                 print(f"  删除行数: -{total_deletions}")
+                if commit.get('duplicate_of'):
+                    print(f"  重复改动: 与提交 {commit['duplicate_of'][:8]} 的改动相同")
                 
                 # 显示每个文件的完整改动内容
                 if diff_info.get('files'):
@@ -884,6 +2320,8 @@ if __name__ == '__main__':
                             print("\n" + "-"*80)
                             print(diff_content)
                             print("-"*80)
+                        elif file_change.get('diff_omitted'):
+                            print(f"\n[diff 过大（{file_change['diff_omitted']} 字节），已省略]")
                         elif change_type == 'deleted':
                             print("\n[文件已完全删除]")
                         elif change_type == 'added':
@@ -898,12 +2336,17 @@ if __name__ == '__main__':
         # 保存到文件
         if args.output:
             with open(args.output, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
+                json.dump(result, f, indent=2, ensure_ascii=False, default=json_default)
             print(f"结果已保存到: {args.output}")
         
         # 输出AI审核格式
         if args.ai_review or args.ai_review_output:
-            ai_review_contents = []
+            # 文件内容缓存：内存LRU + 可选的磁盘层
+            file_cache = FileContentCache(
+                memory_bytes=cli_config.get('file_cache_memory_mb', 64) * 1024 * 1024,
+                disk_dir=args.file_cache_dir or cli_config.get('file_cache_dir'),
+                disk_bytes=cli_config.get('file_cache_disk_mb', 512) * 1024 * 1024
+            )
             
             # 获取API配置用于获取文件完整内容
             call_kwargs_for_api = {}
@@ -935,50 +2378,67 @@ if __name__ == '__main__':
             else:
                 api_base_url_for_format = 'http://git.server.tongbu.com/api/v4' if api_platform == 'gitlab' else 'https://api.github.com'
             
-            for idx, commit in enumerate(result['commits'], 1):
-                formatted = format_for_ai_review(
-                    commit,
-                    api_base_url=api_base_url_for_format,
-                    project_id=api_project_id,
-                    access_token=api_token,
-                    platform=api_platform
-                )
-                if formatted:
-                    ai_review_contents.append(formatted)
-                    if args.ai_review:
-                        print(f"\n{'='*80}")
-                        print(f"【AI审核格式 - 提交 #{idx}】")
-                        print(f"{'='*80}\n")
-                        # 避免Windows控制台编码问题，只输出提示信息
-                        print("[内容已生成，将保存到文件，请查看输出文件]")
+            # 本地仓库直接通过 git cat-file 读取文件内容
+            local_repo = None
+            if api_platform == 'local':
+                local_repo = LocalRepository(args.repo_path or config_for_api.get('repo_path'))
             
-            # 保存AI审核格式到文件
-            if args.ai_review or args.ai_review_output:
-                # 创建输出文件夹
-                output_dir = "代码提交记录"
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-                
-                # 生成文件名（如果指定了文件名则使用，否则自动生成）
-                if args.ai_review_output:
-                    # 如果指定了完整路径，直接使用
-                    if os.path.dirname(args.ai_review_output):
-                        output_file = args.ai_review_output
-                    else:
-                        # 如果只是文件名，保存到代码提交记录文件夹
-                        output_file = os.path.join(output_dir, args.ai_review_output)
+            # 创建输出文件夹
+            output_dir = "代码提交记录"
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            
+            # 生成文件名（如果指定了文件名则使用，否则自动生成）
+            if args.ai_review_output:
+                # 如果指定了完整路径，直接使用
+                if os.path.dirname(args.ai_review_output):
+                    output_file = args.ai_review_output
                 else:
-                    # 自动生成文件名：ai审核_时间
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"ai审核_{timestamp}.md"
-                    output_file = os.path.join(output_dir, filename)
-                
-                # 保存文件
-                separator = "\n\n" + "="*80 + "\n\n"
-                all_content = separator.join(ai_review_contents)
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(all_content)
-                print(f"\n[成功] AI审核格式已保存到: {output_file}")
+                    # 如果只是文件名，保存到代码提交记录文件夹
+                    output_file = os.path.join(output_dir, args.ai_review_output)
+            else:
+                # 自动生成文件名：ai审核_时间
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = f"ai审核_{timestamp}.md"
+                output_file = os.path.join(output_dir, filename)
+            
+            # CPU密集的上下文提取和文本拼接交给进程池（--processes 大于1时）
+            format_executor = ProcessPoolExecutor(max_workers=format_processes) if format_processes and format_processes > 1 else None
+            
+            # 逐个提交写入文件并刷新，不在内存中拼接全部内容
+            separator = CHUNK_SEPARATOR if ai_review_max_tokens else "\n\n" + "="*80 + "\n\n"
+            written = 0
+            with open(output_file, 'w', encoding='utf-8') as f:
+                for idx, commit in enumerate(result['commits'], 1):
+                    if write_ai_review(
+                        f, commit,
+                        api_base_url=api_base_url_for_format,
+                        project_id=api_project_id,
+                        access_token=api_token,
+                        platform=api_platform,
+                        session=shared_session,
+                        file_cache=file_cache,
+                        local_repo=local_repo,
+                        separator=separator if written else None,
+                        archive_threshold=archive_threshold,
+                        max_tokens=ai_review_max_tokens,
+                        executor=format_executor,
+                        patch_index=patch_index
+                    ):
+                        written += 1
+                        if args.ai_review:
+                            print(f"\n{'='*80}")
+                            print(f"【AI审核格式 - 提交 #{idx}】")
+                            print(f"{'='*80}\n")
+                            # 避免Windows控制台编码问题，只输出提示信息
+                            print("[内容已写入文件，请查看输出文件]")
+            print(f"\n[成功] AI审核格式已保存到: {output_file}")
+            if format_executor is not None:
+                format_executor.shutdown()
+            if local_repo is not None:
+                local_repo.close()
+            print(file_cache.summary())
     else:
         print(f"\n错误: {result['error']}")
-
+    
+    shared_session.close()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+api_client 的单元测试（条件请求缓存和翻页，API 由本地的模拟服务代替）
+运行: python -m pytest -q test_api_client.py
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from api_client import ResponseCache, create_session, iter_commit_items, iter_pages, next_page_request
+
+ETAG = '"v1"'
+COMMITS = [{'id': f'{i:040x}', 'title': f'提交 {i}'} for i in range(7, 0, -1)]
+
+
+class CommitsHandler(BaseHTTPRequestHandler):
+    """
+    /gitlab/projects/1/repository/commits：按 X-Next-Page 翻页，支持 If-None-Match
+    /github/repos/o/r/commits：按 Link 头翻页
+    """
+    
+    requests_seen = []
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        CommitsHandler.requests_seen.append((url.path, query, self.headers.get('If-None-Match')))
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query['per_page'][0])
+        items = COMMITS[(page - 1) * per_page:page * per_page]
+        has_next = page * per_page < len(COMMITS)
+        
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+        
+        body = json.dumps(items).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', ETAG)
+        if has_next and url.path.startswith('/gitlab/'):
+            self.send_header('X-Next-Page', str(page + 1))
+        if has_next and url.path.startswith('/github/'):
+            host = self.headers['Host']
+            next_url = f'http://{host}{url.path}?per_page={per_page}&page={page + 1}'
+            self.send_header('Link', f'<{next_url}>; rel="next", <http://{host}{url.path}?page=1>; rel="first"')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def api():
+    CommitsHandler.requests_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CommitsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = create_session('gitlab', 'token')
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}', session
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_response_cache_revalidates_with_304(api, tmp_path):
+    base, session = api
+    url = f'{base}/gitlab/projects/1/repository/commits'
+    cache = ResponseCache(str(tmp_path), ttl=0)
+    
+    first, headers = cache.get(session, url, {'per_page': 3})
+    assert [item['id'] for item in first] == [c['id'] for c in COMMITS[:3]]
+    assert headers == {'X-Next-Page': '2'}
+    
+    # 304 时使用缓存的内容和分页头
+    second, headers = cache.get(session, url, {'per_page': 3})
+    assert second == first
+    assert headers == {'X-Next-Page': '2'}
+    assert CommitsHandler.requests_seen[-1][2] == ETAG
+    assert cache.stats == {'fresh': 0, 'revalidated': 1, 'downloaded': 1}
+    
+    # 新的实例从磁盘读取 ETag，同样得到 304
+    disk_cache = ResponseCache(str(tmp_path), ttl=0)
+    third, _ = disk_cache.get(session, url, {'per_page': 3})
+    assert third == first
+    assert disk_cache.stats['revalidated'] == 1
+
+
+def test_response_cache_ttl_skips_request(api):
+    base, session = api
+    url = f'{base}/gitlab/projects/1/repository/commits'
+    cache = ResponseCache(ttl=60)
+    cache.get(session, url, {'per_page': 3})
+    cache.get(session, url, {'per_page': 3})
+    assert len(CommitsHandler.requests_seen) == 1
+    assert cache.stats == {'fresh': 1, 'revalidated': 0, 'downloaded': 1}
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_iter_commit_items_follows_x_next_page(api, prefetch):
+    base, session = api
+    items = list(iter_commit_items(session, base + '/gitlab', 1, 'gitlab', page_size=3, prefetch=prefetch))
+    assert [item['id'] for item in items] == [c['id'] for c in COMMITS]
+    assert [query.get('page') for _, query, _ in CommitsHandler.requests_seen] == [None, ['2'], ['3']]
+
+
+def test_iter_commit_items_follows_link_header(api):
+    base, session = api
+    items = list(iter_commit_items(session, base + '/github', 'o/r', 'github', page_size=3))
+    assert [item['id'] for item in items] == [c['id'] for c in COMMITS]
+    assert len(CommitsHandler.requests_seen) == 3
+
+
+def test_iter_commit_items_stops_at_watermark(api):
+    """水位线在第二页时只请求两页，只产出比水位线新的提交"""
+    base, session = api
+    items = list(iter_commit_items(session, base + '/gitlab', 1, 'gitlab', page_size=3, since_sha=COMMITS[4]['id']))
+    assert [item['id'] for item in items] == [c['id'] for c in COMMITS[:4]]
+    assert len(CommitsHandler.requests_seen) == 2
+
+
+def test_iter_pages_with_response_cache(api):
+    """翻页时每一页都经过条件请求缓存"""
+    base, session = api
+    cache = ResponseCache(ttl=0)
+    url = f'{base}/gitlab/projects/1/repository/commits'
+    for _ in range(2):
+        pages = list(iter_pages(session, url, {'per_page': 3}, prefetch=False, response_cache=cache))
+        assert sum(len(page) for page in pages) == len(COMMITS)
+    assert cache.stats == {'fresh': 0, 'revalidated': 3, 'downloaded': 3}
+
+
+def test_next_page_request_prefers_link():
+    headers = {'Link': '<https://api.example.com/items?page=2>; rel="next"', 'X-Next-Page': '5'}
+    assert next_page_request('https://api.example.com/items', {'page': 1}, headers) == ('https://api.example.com/items?page=2', None)
+    assert next_page_request('u', {'per_page': 3}, {'X-Next-Page': '2'}) == ('u', {'per_page': 3, 'page': '2'})
+    assert next_page_request('u', {}, {'X-Next-Page': ''}) is None
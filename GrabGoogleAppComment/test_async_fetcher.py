@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+async_fetcher 的单元测试（GitLab API 由本地的模拟服务代替，结果与同步版本逐项比较）
+运行: python -m pytest -q test_async_fetcher.py
+"""
+
+import asyncio
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from async_fetcher import fetch_commits, get_commit_diff
+from records import json_default
+from reviews_scraper import main
+
+COMMIT_IDS = [f'{i:040x}' for i in range(102, 0, -1)]
+# 最新的提交改动45个文件（diff 接口分3页），其他提交各1个文件
+BIG_COMMIT_FILES = 45
+
+
+def diff_files(commit_id):
+    count = BIG_COMMIT_FILES if commit_id == COMMIT_IDS[0] else 1
+    return [
+        {'old_path': f'src/File{i}.cs', 'new_path': f'src/File{i}.cs', 'diff': f'@@ -1 +1 @@\n-old {i}\n+new {i} ' + 'x' * 40 + '\n',
+         'new_file': False, 'deleted_file': False, 'renamed_file': False}
+        for i in range(count)
+    ]
+
+
+class GitLabHandler(BaseHTTPRequestHandler):
+    """提交列表和diff接口，都按 X-Next-Page 翻页"""
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        per_page = int(query.get('per_page', 20))
+        page = int(query.get('page', 1))
+        if url.path == '/api/v4/projects/1/repository/commits':
+            items = [
+                {'id': commit_id, 'short_id': commit_id[:8], 'title': f'提交 {commit_id[-3:]}', 'message': f'提交 {commit_id[-3:]}\n',
+                 'author_name': '张三', 'author_email': 'zs@tongbu.com', 'authored_date': '2025-01-01T00:00:00+08:00',
+                 'committer_name': '张三', 'committer_email': 'zs@tongbu.com', 'committed_date': '2025-01-01T00:00:00+08:00',
+                 'web_url': f'http://git.example.com/c/{commit_id}'}
+                for commit_id in COMMIT_IDS
+            ]
+        elif url.path.startswith('/api/v4/projects/1/repository/commits/') and url.path.endswith('/diff'):
+            items = diff_files(url.path.split('/')[-2])
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        
+        body = json.dumps(items[(page - 1) * per_page:page * per_page]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if page * per_page < len(items):
+            self.send_header('X-Next-Page', str(page + 1))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GitLabHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def as_json(value):
+    return json.loads(json.dumps(value, default=json_default))
+
+
+def test_fetch_commits_matches_sync_main(base_url, tmp_path):
+    """翻页的提交列表、分页的diff和diff预算，结果与同步版本相同"""
+    budget_mb = 0.001
+    sync_result = main(
+        'token', '1', 'gitlab', base_url, per_page=101, include_diff=True,
+        config_file=os.path.join(str(tmp_path), 'missing.json'), rate_limit=1000,
+        diff_budget_mb=budget_mb, patch_index=False
+    )
+    async_result = asyncio.run(fetch_commits(
+        'token', '1', 'gitlab', base_url, per_page=101, byte_budget=int(budget_mb * 1024 * 1024)
+    ))
+    
+    assert sync_result['success'], sync_result['error']
+    assert async_result['success'], async_result['error']
+    assert async_result['count'] == 101
+    assert as_json(async_result) == as_json(sync_result)
+    
+    files = async_result['commits'][0]['diff']['files']
+    assert len(files) == BIG_COMMIT_FILES
+    omitted = [f for f in files if f.get('diff_omitted')]
+    assert omitted and all(f['diff'] == '' for f in omitted)
+
+
+def test_get_commit_diff_pages_and_errors(base_url):
+    api_base_url = base_url + '/api/v4'
+    result = asyncio.run(get_commit_diff(api_base_url, '1', COMMIT_IDS[0], 'token'))
+    assert result['success']
+    assert [f['new_path'] for f in result['files']] == [f'src/File{i}.cs' for i in range(BIG_COMMIT_FILES)]
+    assert result['diff_text'].count('+++ b/') == BIG_COMMIT_FILES
+    
+    missing = asyncio.run(get_commit_diff(api_base_url, '2', COMMIT_IDS[0], 'token'))
+    assert not missing['success']
+    assert missing['error'].startswith('获取diff失败: 404')
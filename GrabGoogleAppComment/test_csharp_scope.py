@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+csharp_scope 的单元测试
+运行: python -m pytest -q test_csharp_scope.py
+"""
+
+from csharp_scope import build_scope_index
+
+CODE = '''using System;
+
+namespace Demo.App
+{
+    // 注释里的大括号 { 不影响作用域
+    public class Outer
+    {
+        private int count = 0;
+        
+        public void Run(string name)
+        {
+            var text = "字符串里的 { 和 }";
+            var path = @"C:\\dir\\{x}""
+                 续行 }";
+            var ch = '{';
+            /* 块注释 } */
+            if (count > 0)
+            {
+                count--;
+            }
+        }
+        
+        public override string ToString() => $"Outer {count}";
+        
+        public class Inner
+        {
+            [Obsolete("old")]
+            public int Calc<T>(T value)
+            {
+                return 1;
+            }
+        }
+        
+        public int Last() { return count; }
+    }
+}
+'''.split('\n')
+
+
+def line_of(text):
+    return next(i for i, line in enumerate(CODE) if text in line)
+
+
+def test_methods_and_lines():
+    index = build_scope_index(CODE)
+    assert [(m.name, m.class_name) for m in index.methods] == [
+        ('Run', 'Outer'), ('ToString', 'Outer'), ('Calc', 'Inner'), ('Last', 'Outer')
+    ]
+    run = index.methods[0]
+    # 字符串、逐字字符串、字符和注释中的大括号不影响方法的结束行
+    assert (run.start, run.end) == (line_of('public void Run'), line_of('count--;') + 2)
+    assert run.signature == 'public void Run(string name)'
+    assert run.namespace == 'namespace Demo.App'
+
+
+def test_find_method_bisect():
+    index = build_scope_index(CODE)
+    assert index.find_method(line_of('count--;'), line_of('count--;')).name == 'Run'
+    assert index.find_method(line_of('续行'), line_of('续行')).name == 'Run'
+    # 表达式体方法只占一行
+    to_string = index.find_method(line_of('ToString'), line_of('ToString'))
+    assert (to_string.name, to_string.start, to_string.end) == ('ToString',) + (line_of('ToString'),) * 2
+    # 嵌套类中的方法，方法前有特性
+    assert index.find_method(line_of('return 1;'), line_of('return 1;')).class_name == 'Inner'
+    assert index.find_method(line_of('public int Last'), line_of('public int Last')).name == 'Last'
+
+
+def test_line_outside_methods():
+    index = build_scope_index(CODE)
+    field = line_of('private int count')
+    assert index.find_method(field, field) is None
+    assert index.find_method(0, 2) is None
+    # 范围从方法之前的上下文行开始时，返回范围内第一个开始的方法
+    assert index.find_method(field, line_of('public void Run')).name == 'Run'
+    
+    assert index.find_type(field).name == 'Outer'
+    assert index.find_type(line_of('return 1;')).name == 'Inner'
+    assert index.find_type(0) is None
+    assert index.namespace_at(field) == 'namespace Demo.App'
+
+
+def test_file_scoped_namespace_and_unclosed():
+    index = build_scope_index(['namespace Demo;', 'class A', '{', '    void M()', '    {', '        x();'])
+    assert index.namespace_at(5) == 'namespace Demo;'
+    assert [(m.name, m.start, m.end) for m in index.methods] == [('M', 3, 5)]
+    assert build_scope_index([]).find_method(0, 0) is None
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+diff_parser 的单元测试
+运行: python -m pytest -q test_diff_parser.py
+"""
+
+from diff_parser import parse_diff, patch_id, split_hunks
+
+DIFF = (
+    'diff --git a/src/A.cs b/src/A.cs\n'
+    '--- a/src/A.cs\n'
+    '+++ b/src/A.cs\n'
+    '@@ -1,3 +1,3 @@\n'
+    ' class A\n'
+    '---- 以减号开头的删除行\n'
+    '++++ 以加号开头的新增行\n'
+    ' }\n'
+    '@@ -10 +10,2 @@ void Run()\n'
+    '-old();\n'
+    '\\ No newline at end of file\n'
+    '+new();\n'
+    '+done();\n'
+    '\\ No newline at end of file'
+)
+
+
+def test_parse_diff_content_lines_like_file_headers():
+    """hunk 内以 ---/+++ 开头的行按内容计算，文件头不计入"""
+    parsed = parse_diff(DIFF)
+    assert parsed.ranges == [(1, 3, 1, 3), (10, 10, 10, 11)]
+    assert (parsed.additions, parsed.deletions) == (3, 2)
+    assert parsed.added_lines == {2, 10, 11}
+    assert parsed.removed_lines == {2, 10}
+    assert parsed.hunks[0].ops == ' -+ '
+    assert list(parsed.hunks[0].line_pairs()) == [(1, 1), (2, None), (None, 2), (3, 3)]
+
+
+def test_parse_diff_no_newline_marker_and_omitted_count():
+    """"\\ No newline at end of file" 不占行号；省略行数的 hunk 头按1行计算"""
+    parsed = parse_diff('@@ -1 +1 @@\n-a\n\\ No newline at end of file\n+b\n\\ No newline at end of file\n')
+    assert parsed.ranges == [(1, 1, 1, 1)]
+    assert parsed.hunks[0].ops == '-+'
+    assert list(parsed.hunks[0].line_pairs()) == [(1, None), (None, 1)]
+
+
+def test_parse_diff_ignores_lines_after_hunk():
+    """hunk 的行数用完后，后面的文件头和空行不属于diff"""
+    parsed = parse_diff(['@@ -0,0 +1 @@', '+x', '', 'diff --git a/b b/b', '--- a/b', '+++ b/b'])
+    assert (parsed.additions, parsed.deletions) == (1, 0)
+    assert parse_diff('').hunks == []
+    assert parse_diff(None).ranges == []
+
+
+def test_split_hunks_matches_parse_diff():
+    header, hunks = split_hunks(DIFF)
+    assert header == 'diff --git a/src/A.cs b/src/A.cs\n--- a/src/A.cs\n+++ b/src/A.cs'
+    assert len(hunks) == len(parse_diff(DIFF).hunks) == 2
+    assert hunks[0].startswith('@@ -1,3 +1,3 @@\n class A\n---- ')
+    assert hunks[1].startswith('@@ -10 +10,2 @@ void Run()')
+    assert '\n'.join([header] + hunks) == DIFF
+    assert split_hunks('Binary files differ') == ('Binary files differ', [])
+
+
+def make_file(diff, **extra):
+    return dict({'old_path': 'src/A.cs', 'new_path': 'src/A.cs', 'change_type': 'modified', 'diff': diff}, **extra)
+
+
+def test_patch_id_ignores_line_numbers_context_and_whitespace():
+    base = patch_id([make_file('@@ -1,3 +1,3 @@\n ctx\n-int x = 1;\n+int x = 2;\n ctx\n')])
+    moved = patch_id([make_file('@@ -40,2 +42,2 @@ other\n-int  x=1;\n+\tint x = 2 ;\n other\n')])
+    changed = patch_id([make_file('@@ -1,3 +1,3 @@\n ctx\n-int x = 1;\n+int x = 3;\n ctx\n')])
+    assert len(base) == 40
+    assert moved == base
+    assert changed != base
+    # 文件顺序不影响指纹，路径不同则不同
+    other = make_file('@@ -1 +1 @@\n-a\n+b\n', old_path='B.cs', new_path='B.cs')
+    assert patch_id([make_file('@@ -1 +1 @@\n-a\n+b\n'), other]) == patch_id([other, make_file('@@ -1 +1 @@\n-a\n+b\n')])
+    assert patch_id([other]) != patch_id([make_file('@@ -1 +1 @@\n-a\n+b\n')])
+
+
+def test_patch_id_binary_and_empty_use_stats():
+    """没有diff内容时按省略标记和行数计算"""
+    binary = patch_id([make_file('', additions=0, deletions=0)])
+    assert binary == patch_id([make_file(None, additions=0, deletions=0)])
+    assert binary != patch_id([make_file('', additions=3, deletions=0, diff_omitted=True)])
+    assert patch_id([make_file('', change_type='added')]) != patch_id([make_file('', change_type='deleted')])
+    assert patch_id([]) is None
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+file_cache 和 diff_cache 的单元测试
+运行: python -m pytest -q test_file_cache.py
+"""
+
+import os
+import threading
+
+from diff_cache import DiffCache, cache_host
+from file_cache import FileContentCache, make_key
+
+
+def test_make_key_prefers_blob():
+    assert make_key('h', 1, 'b' * 40, 'c1', 'a.cs') == make_key('h', 1, 'b' * 40, 'c2', 'b.cs')
+    assert make_key('h', 1, None, 'c1', 'a.cs') != make_key('h', 1, None, 'c2', 'a.cs')
+
+
+def test_memory_lru_eviction():
+    """超过内存上限时淘汰最久未访问的项，读取会刷新访问顺序"""
+    cache = FileContentCache(memory_bytes=30)
+    cache.put('a', 'x' * 10)
+    cache.put('b', 'y' * 10)
+    cache.put('c', 'z' * 10)
+    assert cache.get('a') == 'x' * 10
+    cache.put('d', '中' * 3 + 'w')  # 按UTF-8字节数计算：10字节
+    assert cache.get('b') is None
+    assert [cache.get(key) is not None for key in 'acd'] == [True, True, True]
+    assert cache.memory_used == 30
+    assert cache.stats['memory_evictions'] == 1
+    # 比整个内存层还大的内容不进入内存层
+    cache.put('big', 'x' * 31)
+    assert cache.get('big') is None
+
+
+def test_disk_tier_round_trip_and_promotion(tmp_path):
+    """磁盘层压缩保存；新的实例从磁盘命中后提升到内存层"""
+    content = '// 文件内容\n' * 100
+    FileContentCache(disk_dir=str(tmp_path)).put('k', content)
+    files = os.listdir(str(tmp_path))
+    assert len(files) == 1 and files[0].endswith('.z')
+    assert os.path.getsize(os.path.join(str(tmp_path), files[0])) < len(content.encode('utf-8'))
+    
+    cache = FileContentCache(disk_dir=str(tmp_path))
+    assert cache.get('k') == content
+    assert cache.get('k') == content
+    assert cache.get('missing') is None
+    assert (cache.stats['disk_hits'], cache.stats['memory_hits'], cache.stats['misses']) == (1, 1, 1)
+
+
+def test_disk_tier_eviction(tmp_path):
+    cache = FileContentCache(memory_bytes=0, disk_dir=str(tmp_path), disk_bytes=60)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key * 1000)  # 压缩后约20字节
+    cache.put('d', 'd' * 1000)
+    assert cache.stats['disk_evictions'] >= 1
+    assert cache.get('a') is None
+    assert cache.get('d') == 'd' * 1000
+    assert len(os.listdir(str(tmp_path))) == len(cache.disk)
+
+
+def test_diff_cache_round_trip(tmp_path):
+    path = str(tmp_path / 'diff_cache.sqlite3')
+    diff = {'success': True, 'files': [{'new_path': '中文.cs', 'diff': '@@ -1 +1 @@\n-a\n+b\n'}], 'error': None}
+    cache = DiffCache(path)
+    host = cache_host('http://git.example.com:8080/api/v4')
+    assert host == 'git.example.com:8080'
+    assert cache.get(host, 1, 'abc') is None
+    cache.put(host, 1, 'abc', diff)
+    cache.close()
+    
+    # 重新打开后仍能读取，项目ID按字符串保存
+    reopened = DiffCache(path)
+    assert reopened.get(host, '1', 'abc') == diff
+    assert reopened.get('other', 1, 'abc') is None
+    reopened.close()
+
+
+def test_diff_cache_per_thread_connections(tmp_path):
+    """每个线程使用独立的连接，并发读写互不影响"""
+    cache = DiffCache(str(tmp_path / 'diff_cache.sqlite3'))
+    errors = []
+    
+    def work(n):
+        try:
+            for i in range(20):
+                cache.put('h', 1, f'{n}-{i}', {'success': True, 'n': n, 'i': i})
+                assert cache.get('h', 1, f'{n}-{i}')['i'] == i
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(cache.connections) == 5  # 创建时的连接 + 4个线程
+    assert len({id(conn) for conn in cache.connections}) == 5
+    cache.close()
+    assert cache.connections == []
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+local_git 的单元测试（git log --patch 输出的解析，以及临时仓库上的读取）
+运行: python -m pytest -q test_local_git.py
+"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from local_git import LocalRepository, _paths_from_diff_header, parse_patch
+
+
+def test_paths_from_diff_header_plain_and_spaces():
+    assert _paths_from_diff_header('diff --git a/src/app.cs b/src/app.cs') == ('src/app.cs', 'src/app.cs')
+    # 路径相同且含空格（以及 " b/"）时按中点拆分
+    assert _paths_from_diff_header('diff --git a/my b/x.cs b/my b/x.cs') == ('my b/x.cs', 'my b/x.cs')
+
+
+def test_paths_from_diff_header_quoted():
+    line = 'diff --git "a/say \\"hi\\".txt" "b/new \\"q\\".txt"'
+    assert _paths_from_diff_header(line) == ('say "hi".txt', 'new "q".txt')
+    assert _paths_from_diff_header('diff --git "a/tab\\tname.txt" "b/tab\\tname.txt"') == ('tab\tname.txt', 'tab\tname.txt')
+    # 八进制转义的 UTF-8 字节
+    assert _paths_from_diff_header('diff --git "a/\\344\\270\\255.txt" "b/\\344\\270\\255.txt"') == ('中.txt', '中.txt')
+
+
+def test_parse_patch_rename():
+    files = parse_patch([
+        'diff --git a/old/name.cs b/new/name.cs',
+        'similarity index 90%',
+        'rename from old/name.cs',
+        'rename to new/name.cs',
+        'index 1111111..2222222 100644',
+        '--- a/old/name.cs',
+        '+++ b/new/name.cs',
+        '@@ -1,2 +1,2 @@',
+        ' class A {}',
+        '-int x;',
+        '+int y;',
+    ])
+    assert len(files) == 1
+    assert files[0]['old_path'] == 'old/name.cs'
+    assert files[0]['new_path'] == 'new/name.cs'
+    assert files[0]['change_type'] == 'renamed'
+    assert files[0]['diff'] == '@@ -1,2 +1,2 @@\n class A {}\n-int x;\n+int y;\n'
+    assert (files[0]['additions'], files[0]['deletions']) == (1, 1)
+
+
+def test_parse_patch_quoted_rename_without_content():
+    files = parse_patch([
+        'diff --git "a/say \\"hi\\".txt" "b/new \\"q\\".txt"',
+        'similarity index 100%',
+        'rename from "say \\"hi\\".txt"',
+        'rename to "new \\"q\\".txt"',
+    ])
+    assert [(f['old_path'], f['new_path'], f['change_type'], f['diff']) for f in files] == [
+        ('say "hi".txt', 'new "q".txt', 'renamed', '')
+    ]
+
+
+def test_parse_patch_binary_and_added():
+    files = parse_patch([
+        'diff --git a/img/logo.png b/img/logo.png',
+        'new file mode 100644',
+        'index 0000000..e69de29',
+        'Binary files /dev/null and b/img/logo.png differ',
+        'diff --git "a/dir/x\\ty.txt" "b/dir/x\\ty.txt"',
+        'new file mode 100644',
+        'index 0000000..587be6b',
+        '--- /dev/null',
+        '+++ "b/dir/x\\ty.txt"\t',
+        '@@ -0,0 +1 @@',
+        '+x',
+        '',
+    ])
+    assert len(files) == 2
+    assert (files[0]['new_path'], files[0]['change_type'], files[0]['diff']) == ('img/logo.png', 'added', '')
+    assert (files[0]['additions'], files[0]['deletions']) == (0, 0)
+    assert files[1]['new_path'] == 'dir/x\ty.txt'
+    # 提交末尾的空行不属于diff
+    assert files[1]['diff'] == '@@ -0,0 +1 @@\n+x\n'
+    assert files[1]['additions'] == 1
+
+
+def test_parse_patch_empty_commit():
+    assert parse_patch([]) == []
+    assert parse_patch(['']) == []
+
+
+def _git(repo, *args):
+    subprocess.run(['git', '-C', str(repo), *args], check=True, capture_output=True)
+
+
+@pytest.mark.skipif(shutil.which('git') is None, reason='需要 git')
+def test_iter_commits_reads_local_repo(tmp_path):
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    _git(repo, 'init', '-q')
+    _git(repo, 'config', 'user.name', '测试')
+    _git(repo, 'config', 'user.email', 'test@example.com')
+    (repo / 'say "hi".txt').write_text('a\n', encoding='utf-8')
+    (repo / 'logo.bin').write_bytes(b'\x00\x01\x02')
+    _git(repo, 'add', '.')
+    _git(repo, 'commit', '-q', '-m', '初始提交\n\n第二行说明')
+    _git(repo, 'mv', 'say "hi".txt', 'renamed.txt')
+    _git(repo, 'commit', '-q', '-m', '重命名')
+    _git(repo, 'commit', '-q', '--allow-empty', '-m', '空提交')
+    
+    local = LocalRepository(str(repo))
+    try:
+        commits = list(local.iter_commits())
+        assert [c['title'] for c in commits] == ['空提交', '重命名', '初始提交']
+        assert commits[2]['message'] == '初始提交\n\n第二行说明'
+        assert commits[0]['files_changed'] == []
+        assert [(f['old_path'], f['new_path'], f['change_type']) for f in commits[1]['files_changed']] == [
+            ('say "hi".txt', 'renamed.txt', 'renamed')
+        ]
+        added = {f['new_path']: f for f in commits[2]['files_changed']}
+        assert set(added) == {'logo.bin', 'say "hi".txt'}
+        assert added['logo.bin']['diff'] == ''
+        assert added['say "hi".txt']['diff'] == '@@ -0,0 +1 @@\n+a\n'
+        
+        # 水位线之后的提交，以及文件内容
+        newer = list(local.iter_commits(since_sha=commits[2]['id'], include_diff=False))
+        assert [c['id'] for c in newer] == [commits[0]['id'], commits[1]['id']]
+        assert local.read_file(commits[1]['id'], 'renamed.txt') == 'a\n'
+        assert local.read_file(commits[1]['id'], 'say "hi".txt') is None
+    finally:
+        local.close()
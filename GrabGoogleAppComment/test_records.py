@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+records 的单元测试：记录类序列化的JSON与改用记录类之前的字典输出逐字节相同
+（record_fixtures/expected.json 由改动之前的 format_commit_item / parse_diff_response 生成）
+运行: python -m pytest -q test_records.py
+"""
+
+import json
+import os
+
+import pytest
+
+from records import CommitDiff, FileChange, json_default
+from reviews_scraper import format_commit_item, parse_diff_files
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'record_fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def commits():
+    """按 attach_commit_diffs 的方式构建的提交记录"""
+    gitlab = load_fixture('gitlab_commit.json')
+    github = load_fixture('github_commit.json')
+    
+    gitlab_commit = format_commit_item(gitlab['commit'], 'gitlab')
+    gitlab_commit['diff'] = CommitDiff(success=True, files=parse_diff_files(gitlab['diff'], 'gitlab'), platform='gitlab')
+    gitlab_commit['files_changed'] = gitlab_commit['diff']['files']
+    
+    failed_commit = format_commit_item(gitlab['commit'], 'gitlab')
+    failed_commit['diff'] = {'error': '获取diff失败: 404'}
+    
+    github_commit = format_commit_item(github, 'github')
+    github_commit['diff'] = CommitDiff(success=True, files=parse_diff_files(github, 'github'), platform='github')
+    github_commit['files_changed'] = github_commit['diff']['files']
+    return {'gitlab': gitlab_commit, 'gitlab_failed': failed_commit, 'github': github_commit}
+
+
+def dumps(value, **kwargs):
+    return json.dumps(value, ensure_ascii=False, indent=2, **kwargs)
+
+
+def test_json_matches_previous_dict_output(commits):
+    """键的顺序、可选键的省略和拼接的 diff_text 都与之前相同"""
+    expected = load_fixture('expected.json')
+    for name, commit in commits.items():
+        assert dumps(commit, default=json_default) == dumps(expected[name]), name
+        assert dumps(commit.to_dict()) == dumps(expected[name]), name
+
+
+def test_optional_keys(commits):
+    commit = commits['gitlab']
+    assert 'patch_id' not in commit and 'patch_id' not in json.loads(json.dumps(commit, default=json_default))
+    commit['patch_id'] = 'f' * 40
+    assert list(commit)[-1] == 'patch_id'
+    assert json.loads(json.dumps(commit, default=json_default))['patch_id'] == 'f' * 40
+    
+    change = FileChange('a.cs', 'a.cs', diff='', diff_omitted=1024)
+    assert list(change) == ['old_path', 'new_path', 'change_type', 'diff', 'additions', 'deletions', 'diff_omitted']
+    with pytest.raises(KeyError):
+        change['unknown'] = 1
+    with pytest.raises(TypeError):
+        json.dumps(object(), default=json_default)
+
+
+def test_commit_diff_cache_round_trip(commits):
+    """写入缓存时不含 diff_text，读出后按平台重新拼接"""
+    for name in ('gitlab', 'github'):
+        diff = commits[name]['diff']
+        stored = json.loads(json.dumps(diff.to_dict(include_diff_text=False)))
+        assert 'diff_text' not in stored
+        restored = CommitDiff.from_dict(stored, platform=diff.platform)
+        assert restored.diff_text == diff.diff_text
+        assert dumps(restored, default=json_default) == dumps(diff, default=json_default)
+    with pytest.raises(KeyError):
+        commits['gitlab']['diff']['diff_text'] = ''
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+reviews_scraper 的单元测试（不访问外部网络）
+运行: python -m pytest -q test_reviews_scraper.py
+"""
+
+import io
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from reviews_scraper import (
+    RateLimiter, _files_from_archive, _get_raw_text, _map_in_order, create_session, estimate_tokens, format_for_ai_review,
+    get_file_content_at_commit, get_files_at_commit, iter_ai_review_chunks
+)
+
+BLOB_SHA = 'c' * 40
+# 超过 1MB，并且多字节字符会跨越下载分块的边界
+BIG_CONTENT = '// 大文件\n' + '数据行 abc\n' * 120000
+
+
+class RedirectHandler(BaseHTTPRequestHandler):
+    """/old 重定向到 /new"""
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        if self.path == '/old':
+            self.send_response(302)
+            self.send_header('Location', '/new')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RawFileHandler(BaseHTTPRequestHandler):
+    """按路径取 big.cs 时返回403（GitHub 对大文件的行为），按 blob 取时返回 raw 内容"""
+    
+    requests_seen = []
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        RawFileHandler.requests_seen.append((self.path, self.headers.get('Accept')))
+        if self.path.startswith(f'/repos/o/r/git/blobs/{BLOB_SHA}'):
+            body = BIG_CONTENT.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        body = b'{"message": "This API returns blobs up to 1 MB in size."}'
+        self.send_response(403)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_raw_file_falls_back_to_blob():
+    """大于1MB的文件按路径取不到时改用 git blob 接口，完整解码多字节字符"""
+    RawFileHandler.requests_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RawFileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    session = create_session('github', 'token')
+    try:
+        assert len(BIG_CONTENT.encode('utf-8')) > 1024 * 1024
+        content = get_file_content_at_commit(
+            api_base_url, 'o/r', 'd' * 40, 'src/big.cs', 'token', 'github', session=session, blob_id=BLOB_SHA
+        )
+        assert content == BIG_CONTENT
+        assert [path.split('?')[0] for path, _ in RawFileHandler.requests_seen] == [
+            '/repos/o/r/contents/src/big.cs', f'/repos/o/r/git/blobs/{BLOB_SHA}'
+        ]
+        assert all(accept == 'application/vnd.github.raw' for _, accept in RawFileHandler.requests_seen)
+        
+        # 超过大小上限时不返回内容（调用方只使用diff）
+        blob_url = f'{api_base_url}/repos/o/r/git/blobs/{BLOB_SHA}'
+        assert _get_raw_text(session, blob_url, None, 10, max_bytes=1024 * 1024) is None
+        assert _get_raw_text(session, blob_url, None, 10, chunk_size=1000) == BIG_CONTENT
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+
+def make_archive(files):
+    """GitLab 格式的压缩包：路径前带一层 "<项目>-<sha>" 目录"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for path, content in files.items():
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(f'proj-abc/{path}')
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+ARCHIVE_FILES = {'src/app/A.cs': 'class A {}\n', 'src/app/B.cs': 'class B {}\n', 'src/lib/C.cs': 'class C {}\n'}
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """/projects/1/repository/archive.tar.gz 返回 ARCHIVE_FILES 的压缩包"""
+    
+    requests_seen = []
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        ArchiveHandler.requests_seen.append(self.path)
+        body = make_archive(ARCHIVE_FILES)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_files_from_archive_falls_back():
+    """有公共目录时只下载一次压缩包；没有公共目录或压缩包超过上限时返回 None（逐个获取）"""
+    ArchiveHandler.requests_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ArchiveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    session = create_session('gitlab', 'token')
+    try:
+        contents = get_files_at_commit(api_base_url, 1, 'abc', ['src/app/A.cs', 'src/lib/C.cs'], 'token', session=session)
+        assert contents == {'src/app/A.cs': 'class A {}\n', 'src/lib/C.cs': 'class C {}\n'}
+        assert len(ArchiveHandler.requests_seen) == 1
+        assert 'path=src' in ArchiveHandler.requests_seen[0]
+        
+        # 文件分布在根目录和 src 下，压缩包会是整个仓库，不发请求
+        assert get_files_at_commit(api_base_url, 1, 'abc', ['README.md', 'src/app/A.cs'], 'token', session=session) is None
+        assert len(ArchiveHandler.requests_seen) == 1
+        
+        assert _files_from_archive(session, api_base_url, 1, 'abc', ['src/app/A.cs'], 10, max_bytes=10) is None
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_session_semaphore_follows_redirect():
+    """每个主机只允许1个连接时，重定向不应等待自己持有的信号量"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RedirectHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = create_session('gitlab', 'token', rate_limiter=RateLimiter(rate=100), semaphore=threading.BoundedSemaphore(1))
+    result = {}
+    
+    def fetch():
+        result['response'] = session.get(f'http://127.0.0.1:{server.server_address[1]}/old', timeout=5)
+    
+    try:
+        thread = threading.Thread(target=fetch, daemon=True)
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive(), '重定向时请求被信号量阻塞'
+        assert result['response'].status_code == 200
+        assert result['response'].text == 'ok'
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_rate_limiter_healthy_budget_not_slower():
+    """额度充足时（GitHub 常见的 4990/5000）不应比之前固定的 0.1 秒间隔更慢"""
+    limiter = RateLimiter(rate=10, burst=1)
+    headers = {
+        'X-RateLimit-Limit': '5000',
+        'X-RateLimit-Remaining': '4990',
+        'X-RateLimit-Reset': str(int(time.time()) + 3500),
+    }
+    limiter.update(headers, 200)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.5
+
+
+def test_rate_limiter_low_budget_paces():
+    """剩余额度不多时按剩余额度分摊到重置前的时间里"""
+    limiter = RateLimiter(rate=10, burst=1, min_rate=0.5)
+    headers = {
+        'RateLimit-Limit': '600',
+        'RateLimit-Remaining': '20',
+        'RateLimit-Reset': '10',
+    }
+    limiter.update(headers, 200)
+    assert limiter.rate == 2.0
+
+
+def make_hunk(start, count):
+    return f'@@ -{start},{count} +{start},{count} @@\n' + '\n'.join(f'+line {start}-{k} ' + 'x' * 60 for k in range(count))
+
+
+def make_commit(files):
+    return {
+        'id': 'a' * 40, 'short_id': 'aaaaaaaa', 'title': '测试提交', 'author_name': '张三',
+        'authored_date': '2025-01-01T00:00:00+08:00', 'diff': {'success': True, 'files': files}
+    }
+
+
+def make_file_change(path, diff):
+    return {'old_path': path, 'new_path': path, 'diff': diff, 'additions': diff.count('\n+'), 'deletions': 0}
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 1
+    assert estimate_tokens('a' * 300) == 101
+    # 中文按每个字符一个token
+    assert estimate_tokens('中文' * 50) == 101
+    assert estimate_tokens('abc中') == 3
+
+
+def test_ai_review_chunks_fit_budget_and_keep_order():
+    """每个分块不超过预算；过大的文件按hunk拆分，单个过大的hunk按行拆分，分块顺序与文件、hunk顺序一致"""
+    files = [
+        make_file_change('a.cs', make_hunk(1, 3)),
+        make_file_change('b.cs', '\n'.join(make_hunk(i * 100 + 1, 20) for i in range(6))),
+        make_file_change('c.cs', make_hunk(1, 200)),
+    ]
+    chunks = list(iter_ai_review_chunks(make_commit(files), max_tokens=1500))
+    assert len(chunks) > 3
+    assert all(estimate_tokens(chunk) <= 1500 for chunk in chunks)
+    assert all(chunk.startswith(chunks[0][:200]) for chunk in chunks)
+    
+    # 依次拼接各分块的diff行，与原始改动的行顺序相同
+    joined = [line for chunk in chunks for line in chunk.split('\n') if line.startswith(('@@', '+line'))]
+    original = [line for f in files for line in f['diff'].split('\n')]
+    assert [line for line in joined if line.startswith('+')] == [line for line in original if line.startswith('+')]
+    headings = [line for chunk in chunks for line in chunk.split('\n') if line.startswith('### ')]
+    assert [h.split('`')[1] for h in headings] == sorted(h.split('`')[1] for h in headings)
+    assert any('（hunk 1-2/6）' in h for h in headings)
+    assert any('（hunk 1/1，第 2 段）' in h for h in headings)
+
+
+def test_ai_review_chunks_small_and_unsplittable():
+    """整个提交放得下时只有一个分块，与 format_for_ai_review 相同；没有hunk的过大内容整块产出"""
+    small = make_commit([make_file_change('a.cs', make_hunk(1, 3))])
+    assert list(iter_ai_review_chunks(small, max_tokens=8000)) == [format_for_ai_review(small)]
+    
+    binary = make_commit([make_file_change('a.cs', make_hunk(1, 3)), make_file_change('d.bin', 'Binary ' + 'y' * 9000)])
+    chunks = list(iter_ai_review_chunks(binary, max_tokens=1500))
+    assert len(chunks) == 2
+    assert 'y' * 9000 in chunks[1]
+    assert estimate_tokens(chunks[1]) > 1500
+    assert list(iter_ai_review_chunks({'diff': {'success': False}})) == []
+
+
+def slow_square(n):
+    # 越靠前的任务越慢，完成顺序与输入顺序相反
+    time.sleep(0.01 * (8 - n))
+    return n * n
+
+
+def test_map_in_order_keeps_order_and_bounds_window():
+    """结果按输入顺序产出；产出第 k 个结果时最多只读取了 k + window 个输入"""
+    consumed = []
+    
+    def inputs():
+        for n in range(8):
+            consumed.append(n)
+            yield n
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for result in _map_in_order(executor, slow_square, inputs(), window=3):
+            assert len(consumed) <= len(results) + 3
+            results.append(result)
+    assert results == [n * n for n in range(8)]
+    
+    # 默认窗口为进程（线程）数的2倍
+    consumed.clear()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = next(_map_in_order(executor, slow_square, inputs()))
+        assert first == 0
+        assert len(consumed) == 4
+
+
+def test_map_in_order_cancels_pending_when_closed():
+    """调用方中途停止时，还没开始的任务被取消"""
+    started = []
+    
+    def work(n):
+        started.append(n)
+        time.sleep(0.05)
+        return n
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = _map_in_order(executor, work, range(100), window=5)
+        assert next(results) == 0
+        results.close()
+    assert len(started) < 10
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+webhook_server 的单元测试（不访问外部网络，GitLab API 由本地的模拟服务代替）
+运行: python -m pytest -q test_webhook_server.py
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from webhook_server import MAX_BODY_BYTES, ReviewQueue, create_server, parse_push_event, push_range
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webhook_fixtures')
+TRUNCATED_IDS = [hashlib.sha1(f'truncated-{i}'.encode()).hexdigest() for i in range(25)]
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class CompareHandler(BaseHTTPRequestHandler):
+    """模拟 GitLab 的 /repository/compare 接口，返回 gitlab_push_truncated.json 对应的全部25个提交"""
+    
+    requests_seen = []
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        CompareHandler.requests_seen.append((url.path, parse_qs(url.query)))
+        commits = [
+            {'id': commit_id, 'short_id': commit_id[:8], 'title': f'批量迁移配置 {i + 1}/25',
+             'message': f'批量迁移配置 {i + 1}/25', 'author_name': '李四', 'author_email': 'lisi@tongbu.com'}
+            for i, commit_id in enumerate(TRUNCATED_IDS)
+        ]
+        body = json.dumps({'commits': commits}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_push_range_complete_payload():
+    """事件中的提交完整时直接使用"""
+    assert push_range({'X-Gitlab-Event': 'Push Hook'}, load_fixture('gitlab_push.json')) is None
+    assert push_range({'X-GitHub-Event': 'push'}, load_fixture('github_push.json')) is None
+
+
+def test_push_range_new_branch():
+    """新建分支时与默认分支比较"""
+    payload = load_fixture('gitlab_push.json')
+    payload['before'] = '0' * 40
+    payload['project']['default_branch'] = 'master'
+    assert push_range({'X-Gitlab-Event': 'Push Hook'}, payload) == ('master', payload['after'])
+
+
+def test_truncated_gitlab_push_queues_all_commits():
+    """GitLab 只带最新20个提交时，先返回202，由工作线程通过比较接口取回 before..after 的全部25个提交"""
+    payload = load_fixture('gitlab_push_truncated.json')
+    headers = {'X-Gitlab-Event': 'Push Hook'}
+    assert len(parse_push_event(headers, payload)[3]) == 20
+    assert push_range(headers, payload) == (payload['before'], payload['after'])
+    CompareHandler.requests_seen = []
+    
+    api = ThreadingHTTPServer(('127.0.0.1', 0), CompareHandler)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    config = {'access_token': 'token', 'base_url': f'http://127.0.0.1:{api.server_address[1]}', 'rate_limit': 100}
+    review_queue = ReviewQueue(config, max_size=100)  # 不启动工作线程，只检查入队的提交
+    server = create_server(review_queue, host='127.0.0.1', port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        response = requests.post(
+            f'http://127.0.0.1:{server.server_address[1]}/',
+            data=json.dumps(payload).encode('utf-8'),
+            headers=dict(headers, **{'Content-Type': 'application/json'}),
+            timeout=10
+        )
+        assert response.status_code == 202
+        assert response.json()['queued'] == 20
+        assert response.json()['range'] == f"{payload['before']}..{payload['after']}"
+        # 请求处理中不调用API
+        assert CompareHandler.requests_seen == []
+        
+        # 相当于工作线程取出范围任务
+        review_queue._run(*review_queue.queue.get_nowait())
+        path, query = CompareHandler.requests_seen[-1]
+        assert path == '/api/v4/projects/123/repository/compare'
+        assert query == {'from': [payload['before']], 'to': [payload['after']]}
+        queued = [review_queue.queue.get_nowait()[3]['id'] for _ in range(review_queue.queue.qsize())]
+        assert queued == TRUNCATED_IDS
+        assert review_queue.status()['accepted'] == 25
+    finally:
+        server.shutdown()
+        server.server_close()
+        api.shutdown()
+        api.server_close()
+        for session in review_queue.sessions.values():
+            session.close()
+
+
+def test_full_queue_rejects_range_without_api_call():
+    """队列已满时直接返回503，不调用比较接口"""
+    payload = load_fixture('gitlab_push_truncated.json')
+    config = {'access_token': 'token', 'base_url': 'http://127.0.0.1:9', 'rate_limit': 100}
+    review_queue = ReviewQueue(config, max_size=1)
+    review_queue.submit('gitlab', 1, [{'id': 'a' * 40}])
+    review_queue.list_push_commits = None  # 被调用时会报错
+    server = create_server(review_queue, host='127.0.0.1', port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        response = requests.post(
+            f'http://127.0.0.1:{server.server_address[1]}/',
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'X-Gitlab-Event': 'Push Hook', 'Content-Type': 'application/json'},
+            timeout=10
+        )
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+        assert review_queue.queue.qsize() == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_oversized_body_rejected():
+    """Content-Length 超过上限时返回413，不读取请求体"""
+    review_queue = ReviewQueue({'rate_limit': 100})
+    server = create_server(review_queue, host='127.0.0.1', port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    try:
+        connection.putrequest('POST', '/')
+        connection.putheader('X-Gitlab-Event', 'Push Hook')
+        connection.putheader('Content-Length', str(MAX_BODY_BYTES + 1))
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 413
+        assert review_queue.queue.qsize() == 0
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_failed_review_retried_on_redelivery():
+    """审核失败的提交不会被记住，重新投递时再次入队；审核成功后才去重"""
+    review_queue = ReviewQueue({'rate_limit': 100}, workers=1)
+    results = [False, True]
+    reviewed = []
+    release = threading.Event()
+    
+    def fake_review(platform, project_id, commit):
+        release.wait(10)
+        reviewed.append(commit['id'])
+        return results.pop(0)
+    
+    review_queue._review = fake_review
+    review_queue.start()
+    commit = {'id': 'b' * 40}
+    try:
+        assert review_queue.submit('gitlab', 1, [commit]) == (1, None)
+        # 排队或处理中的提交不会重复入队
+        assert review_queue.submit('gitlab', 1, [commit]) == (0, None)
+        release.set()
+        review_queue.queue.join()
+        assert review_queue.submit('gitlab', 1, [commit]) == (1, None)
+        review_queue.queue.join()
+        assert review_queue.submit('gitlab', 1, [commit]) == (0, None)
+        assert reviewed == [commit['id'], commit['id']]
+        assert review_queue.status()['duplicates'] == 2
+    finally:
+        review_queue.stop()
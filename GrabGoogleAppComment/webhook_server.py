@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推送事件（Webhook）接收服务
+接收 GitLab / GitHub 的 push 事件，把其中的新提交放入有界队列，
+由工作线程执行 get_commit_diff → format_for_ai_review 并保存审核文件。
+队列满时返回 503 + Retry-After，由推送方稍后重试（背压）
+"""
+
+import hashlib
+import hmac
+import json
+import math
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from diff_cache import DiffCache
+from file_cache import FileContentCache
+from reviews_scraper import (
+    PatchIndex,
+    INCREMENTAL_MAX_COMMITS,
+    RateLimiter,
+    create_session,
+    format_for_ai_review,
+    get_commit_diff,
+    get_compare_commits,
+    iter_ai_review_chunks,
+    load_config,
+    resolve_api_base_url,
+)
+
+# 分支被删除时推送事件中的 after 字段
+ZERO_SHA = '0' * 40
+
+# 请求体大小上限（GitHub 的推送事件最大 25MB），超出时返回 413，不读取请求体
+MAX_BODY_BYTES = 25 * 1024 * 1024
+
+
+def verify_request(headers, body, secret):
+    """
+    校验推送请求的来源
+    
+    参数:
+        headers: 请求头
+        body: 原始请求体（bytes）
+        secret: 配置的Webhook密钥（为空表示不校验）
+    
+    返回:
+        bool
+    """
+    if not secret:
+        return True
+    gitlab_token = headers.get('X-Gitlab-Token')
+    if gitlab_token is not None:
+        return hmac.compare_digest(gitlab_token, secret)
+    signature = headers.get('X-Hub-Signature-256')
+    if signature:
+        expected = 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+    return False
+
+
+def parse_push_event(headers, payload):
+    """
+    从推送事件中取出平台、项目和新提交
+    
+    参数:
+        headers: 请求头（用于判断平台和事件类型）
+        payload: 解析后的JSON请求体
+    
+    返回:
+        (platform, project_id, ref, commits) 元组，commits 为与 format_commit_item 相同结构的提交字典列表；
+        不是 push 事件或没有新提交（例如删除分支）时返回 None
+    """
+    if headers.get('X-Gitlab-Event') == 'Push Hook' or payload.get('object_kind') == 'push':
+        if payload.get('after') == ZERO_SHA:
+            return None
+        project_id = payload.get('project_id') or (payload.get('project') or {}).get('id')
+        commits = []
+        for item in payload.get('commits') or []:
+            message = item.get('message') or ''
+            author = item.get('author') or {}
+            commits.append({
+                'id': item.get('id'),
+                'short_id': (item.get('id') or '')[:8],
+                'title': item.get('title') or message.split('\n')[0],
+                'message': message,
+                'author_name': author.get('name'),
+                'author_email': author.get('email'),
+                'authored_date': item.get('timestamp'),
+                'web_url': item.get('url'),
+                'diff': None,
+                'files_changed': []
+            })
+        return 'gitlab', project_id, payload.get('ref'), commits
+    
+    if headers.get('X-GitHub-Event') == 'push':
+        if payload.get('deleted'):
+            return None
+        project_id = (payload.get('repository') or {}).get('full_name')
+        commits = []
+        for item in payload.get('commits') or []:
+            message = item.get('message') or ''
+            author = item.get('author') or {}
+            commits.append({
+                'sha': item.get('id'),
+                'short_sha': (item.get('id') or '')[:7],
+                'message': message,
+                'title': message.split('\n')[0],
+                'author_name': author.get('name'),
+                'author_email': author.get('email'),
+                'authored_date': item.get('timestamp'),
+                'html_url': item.get('url'),
+                'diff': None,
+                'files_changed': []
+            })
+        return 'github', project_id, payload.get('ref'), commits
+    
+    return None
+
+
+def push_range(headers, payload):
+    """
+    推送事件中的提交列表不完整时，返回需要通过API获取的提交范围
+    
+    - GitLab 的 commits 最多只有20个，total_commits_count 才是实际数量
+    - 新建分支（before 全为0）时，事件中的提交不能代表分支上的全部新提交，改为与默认分支比较
+    
+    参数:
+        headers: 请求头
+        payload: 解析后的JSON请求体
+    
+    返回:
+        (base, head) 元组（base 不包含），事件中的提交已完整或无法确定范围时返回 None
+    """
+    if headers.get('X-Gitlab-Event') == 'Push Hook' or payload.get('object_kind') == 'push':
+        default_branch = (payload.get('project') or {}).get('default_branch')
+    elif headers.get('X-GitHub-Event') == 'push':
+        default_branch = (payload.get('repository') or {}).get('default_branch')
+    else:
+        return None
+    
+    before, after = payload.get('before'), payload.get('after')
+    if not after or after == ZERO_SHA:
+        return None
+    if before == ZERO_SHA or payload.get('created'):
+        # 新建分支：与默认分支比较（推送的就是默认分支时无法确定范围，使用事件中的提交）
+        if not default_branch or payload.get('ref') == f'refs/heads/{default_branch}':
+            return None
+        return default_branch, after
+    total = payload.get('total_commits_count')
+    if total is not None and total > len(payload.get('commits') or []):
+        return before, after
+    return None
+
+
+class ReviewQueue:
+    """
+    有界任务队列 + 工作线程池
+    
+    一次推送中的提交要么全部入队，要么全部拒绝（推送方重试时不会重复处理一部分提交）；
+    排队中和最近审核成功的提交会被记住，同一提交推送到多个分支时只审核一次，
+    审核失败的提交不会被记住，推送方重新投递时会再次审核；
+    事件中的提交不完整时，提交范围由工作线程通过API获取，不阻塞请求处理；
+    cherry-pick 到其他分支的提交（SHA不同、改动相同）按补丁指纹复用之前生成的审核内容
+    """
+    
+    def __init__(self, config, workers=4, max_size=100, output_dir='代码提交记录', on_review=None, seen_limit=10000):
+        """
+        参数:
+            config: reviews_scraper.load_config 返回的配置（访问令牌、base_url、缓存等）
+            workers: 工作线程数
+            max_size: 队列中最多等待的提交数
+            output_dir: 审核文件保存目录
+            on_review: 回调函数 on_review(commit, formatted)（可选，默认保存为Markdown文件）；
+                       配置了 ai_review_max_tokens 且提交被拆分为多个分块时，按 on_review(commit, formatted, part) 逐块调用
+            seen_limit: 记住的已审核提交数量上限
+        """
+        self.config = config
+        self.workers = workers
+        self.max_size = max_size
+        self.output_dir = output_dir
+        self.on_review = on_review or self._save_review
+        self.seen_limit = seen_limit
+        
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.seen = OrderedDict()
+        self.pending = set()
+        self.threads = []
+        self.avg_seconds = 5.0
+        self.stats = {'accepted': 0, 'rejected': 0, 'duplicates': 0, 'same_patch': 0, 'processed': 0, 'failed': 0}
+        
+        self.sessions = {}
+        self.rate_limiter = RateLimiter(rate=config.get('rate_limit', 10), burst=max(1, workers))
+        self.diff_cache = DiffCache(config['diff_cache']) if config.get('diff_cache') else None
+        self.file_cache = FileContentCache(
+            memory_bytes=config.get('file_cache_memory_mb', 64) * 1024 * 1024,
+            disk_dir=config.get('file_cache_dir'),
+            disk_bytes=config.get('file_cache_disk_mb', 512) * 1024 * 1024
+        )
+        # 所有工作线程共用一个进程池执行上下文提取和文本拼接（format_processes 大于1时）
+        processes = config.get('format_processes') or 1
+        self.format_executor = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+        self.patch_index = PatchIndex() if config.get('dedup_patches', True) else None
+    
+    def start(self):
+        """启动工作线程"""
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def stop(self):
+        """处理完已入队的提交后停止工作线程，并关闭会话和缓存"""
+        if self.threads:
+            # 等待提交范围展开出的提交也处理完，再放入停止标记
+            self.queue.join()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        for session in self.sessions.values():
+            session.close()
+        if self.diff_cache is not None:
+            self.diff_cache.close()
+        if self.format_executor is not None:
+            self.format_executor.shutdown()
+    
+    def submit(self, platform, project_id, commits, commit_range=None):
+        """
+        把一次推送中的提交放入队列
+        
+        参数:
+            platform: 平台类型
+            project_id: 项目ID或仓库路径
+            commits: 事件中的提交列表
+            commit_range: (base, head) 元组（可选，见 push_range）；传入时只放入一个范围任务，
+                          由工作线程通过API获取范围内的提交再入队，commits 作为获取失败时的后备
+        
+        返回:
+            (accepted, retry_after) 元组：accepted 为入队的提交数（范围任务为事件中新提交的数量），
+            队列放不下时 accepted 为 None，retry_after 为建议的重试秒数
+        """
+        with self.lock:
+            new_commits = self._new_commits(platform, project_id, commits)
+            
+            pending = self.queue.qsize()
+            # 队列为空时总是接收（单次推送的提交数超过 max_size 也不会永远被拒绝）
+            if pending and pending + len(new_commits) > self.max_size:
+                self.stats['rejected'] += 1
+                # 按当前积压量和平均处理耗时估算多久之后有空位
+                retry_after = max(1, math.ceil(pending * self.avg_seconds / max(1, self.workers)))
+                return None, retry_after
+            
+            if commit_range is not None:
+                # 范围内的提交数由展开时统计
+                self.queue.put(('range', platform, project_id, (commit_range, commits)))
+            else:
+                self.stats['duplicates'] += len(commits) - len(new_commits)
+                self._put_commits(platform, project_id, new_commits)
+            return len(new_commits), None
+    
+    def list_push_commits(self, platform, project_id, base, head, fallback):
+        """
+        通过API获取一次推送 base..head 之间的提交（事件中的提交列表不完整时使用）
+        
+        参数:
+            platform: 平台类型
+            project_id: 项目ID或仓库路径
+            base: 起点（不包含）
+            head: 终点
+            fallback: 获取失败时使用的提交列表（事件中的提交）
+        
+        返回:
+            提交列表（旧的在前），最多 INCREMENTAL_MAX_COMMITS 个（超出时保留最新的）
+        """
+        try:
+            commits = get_compare_commits(
+                resolve_api_base_url(platform, self.config.get('base_url')), project_id, base, head,
+                self.config.get('access_token'), platform, session=self._session_for(platform)
+            )
+        except Exception as e:
+            print(f'获取推送范围 {base[:8]}..{head[:8]} 的提交失败，只处理事件中的 {len(fallback)} 个提交: {str(e)}')
+            return fallback
+        if len(commits) > INCREMENTAL_MAX_COMMITS:
+            print(f'推送范围 {base[:8]}..{head[:8]} 有 {len(commits)} 个提交，只处理最新的 {INCREMENTAL_MAX_COMMITS} 个')
+            commits = commits[-INCREMENTAL_MAX_COMMITS:]
+        return commits
+    
+    def status(self):
+        """返回队列状态字典"""
+        with self.lock:
+            return dict(self.stats, pending=self.queue.qsize(), max_size=self.max_size, workers=self.workers)
+    
+    def _new_commits(self, platform, project_id, commits):
+        """去掉排队中、已审核过和列表中重复的提交（需持有 self.lock）"""
+        new_commits = OrderedDict()
+        for commit in commits:
+            key = (platform, str(project_id), commit.get('id') or commit.get('sha'))
+            if key in self.seen or key in self.pending or key in new_commits:
+                continue
+            new_commits[key] = commit
+        return new_commits
+    
+    def _put_commits(self, platform, project_id, new_commits):
+        """把 _new_commits 的结果放入队列（需持有 self.lock）"""
+        for key, commit in new_commits.items():
+            self.pending.add(key)
+            self.queue.put(('commit', platform, project_id, commit))
+        self.stats['accepted'] += len(new_commits)
+    
+    def _expand_range(self, platform, project_id, commit_range, fallback):
+        """工作线程中获取推送范围内的提交并入队（已接收的推送不再受队列上限限制）"""
+        commits = self.list_push_commits(platform, project_id, *commit_range, fallback)
+        with self.lock:
+            new_commits = self._new_commits(platform, project_id, commits)
+            self.stats['duplicates'] += len(commits) - len(new_commits)
+            self._put_commits(platform, project_id, new_commits)
+    
+    def _session_for(self, platform):
+        with self.lock:
+            if platform not in self.sessions:
+                self.sessions[platform] = create_session(
+                    platform, self.config.get('access_token'),
+                    pool_size=max(10, self.workers),
+                    rate_limiter=self.rate_limiter
+                )
+            return self.sessions[platform]
+    
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            try:
+                self._run(*job)
+            finally:
+                self.queue.task_done()
+    
+    def _run(self, kind, platform, project_id, item):
+        if kind == 'range':
+            self._expand_range(platform, project_id, *item)
+            return
+        
+        key = (platform, str(project_id), item.get('id') or item.get('sha'))
+        start = time.monotonic()
+        success = False
+        try:
+            success = self._review(platform, project_id, item)
+        except Exception as e:
+            with self.lock:
+                self.stats['failed'] += 1
+            print(f'审核失败: {str(e)}')
+        finally:
+            elapsed = time.monotonic() - start
+            with self.lock:
+                self.avg_seconds = self.avg_seconds * 0.8 + elapsed * 0.2
+                # 只记住审核成功的提交，失败的提交在推送方重新投递时再次审核
+                self.pending.discard(key)
+                if success:
+                    self.seen[key] = True
+                    while len(self.seen) > self.seen_limit:
+                        self.seen.popitem(last=False)
+    
+    def _review(self, platform, project_id, commit):
+        """获取diff并生成审核内容，成功返回 True"""
+        api_base_url = resolve_api_base_url(platform, self.config.get('base_url'))
+        access_token = self.config.get('access_token')
+        session = self._session_for(platform)
+        commit_id = commit.get('id') or commit.get('sha')
+        
+        budget_mb = self.config.get('diff_budget_mb')
+        diff_result = get_commit_diff(
+            api_base_url, project_id, commit_id, access_token, platform,
+            session=session, cache=self.diff_cache,
+            byte_budget=int(budget_mb * 1024 * 1024) if budget_mb else None
+        )
+        if not diff_result['success']:
+            with self.lock:
+                self.stats['failed'] += 1
+            print(f'获取diff失败 ({commit_id[:8]}): {diff_result["error"]}')
+            return False
+        commit['diff'] = diff_result
+        commit['files_changed'] = diff_result['files']
+        if self.patch_index is not None and self.patch_index.add(commit):
+            with self.lock:
+                self.stats['same_patch'] += 1
+        
+        review_kwargs = dict(
+            api_base_url=api_base_url,
+            project_id=project_id,
+            access_token=access_token,
+            platform=platform,
+            session=session,
+            file_cache=self.file_cache,
+            archive_threshold=self.config.get('archive_threshold'),
+            executor=self.format_executor,
+            patch_index=self.patch_index
+        )
+        max_tokens = self.config.get('ai_review_max_tokens')
+        if max_tokens:
+            chunks = list(iter_ai_review_chunks(commit, max_tokens=max_tokens, **review_kwargs))
+        else:
+            formatted = format_for_ai_review(commit, **review_kwargs)
+            chunks = [formatted] if formatted else []
+        if len(chunks) == 1:
+            self.on_review(commit, chunks[0])
+        else:
+            for part, chunk in enumerate(chunks, 1):
+                self.on_review(commit, chunk, part)
+        with self.lock:
+            self.stats['processed'] += 1
+        return True
+    
+    def _save_review(self, commit, formatted, part=None):
+        """默认回调：每个提交保存为一个Markdown文件（按token预算拆分时每个分块一个文件）"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        short_id = commit.get('short_id') or commit.get('short_sha', '')
+        suffix = f'_{part}' if part else ''
+        output_file = os.path.join(self.output_dir, f'ai审核_{short_id}{suffix}.md')
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(formatted)
+        print(f'[成功] AI审核格式已保存到: {output_file}')
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """处理推送请求：POST 任意路径接收事件，GET /health 查看队列状态"""
+    
+    server_version = 'ReviewWebhook/1.0'
+    
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self._send_json(400, {'error': 'Content-Length 不合法'})
+        if length > MAX_BODY_BYTES:
+            # 不读取请求体，直接断开连接
+            self.close_connection = True
+            return self._send_json(413, {'error': f'请求体超过 {MAX_BODY_BYTES} 字节'})
+        body = self.rfile.read(length)
+        if not verify_request(self.headers, body, self.server.secret):
+            return self._send_json(401, {'error': '签名或令牌校验失败'})
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._send_json(400, {'error': '请求体不是合法的JSON'})
+        
+        event = parse_push_event(self.headers, payload)
+        if event is None:
+            return self._send_json(200, {'queued': 0, 'ignored': True})
+        
+        platform, project_id, ref, commits = event
+        # 事件中的提交不完整时只放入范围任务，先返回202，由工作线程调用API（推送方的超时时间通常只有10秒）
+        commit_range = push_range(self.headers, payload)
+        accepted, retry_after = self.server.review_queue.submit(platform, project_id, commits, commit_range)
+        if accepted is None:
+            return self._send_json(503, {'error': '队列已满，请稍后重试'}, {'Retry-After': str(retry_after)})
+        result = {'queued': accepted, 'ref': ref}
+        if commit_range is not None:
+            result['range'] = f'{commit_range[0]}..{commit_range[1]}'
+        return self._send_json(202, result)
+    
+    def do_GET(self):
+        if self.path.rstrip('/') == '/health':
+            return self._send_json(200, self.server.review_queue.status())
+        return self._send_json(404, {'error': 'not found'})
+    
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        print(f'[{self.log_date_time_string()}] {self.address_string()} {format % args}')
+
+
+def create_server(review_queue, host='0.0.0.0', port=8080, secret=None):
+    """
+    创建Webhook服务（调用方负责 serve_forever / shutdown）
+    
+    参数:
+        review_queue: ReviewQueue 实例（需已调用 start）
+        host: 监听地址
+        port: 监听端口（0 表示随机端口，测试时使用）
+        secret: Webhook密钥（GitLab 的 Secret Token / GitHub 的 Secret）
+    
+    返回:
+        ThreadingHTTPServer 对象
+    """
+    server = ThreadingHTTPServer((host, port), WebhookHandler)
+    server.review_queue = review_queue
+    server.secret = secret
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='接收GitLab/GitHub推送事件并生成AI审核格式')
+    parser.add_argument('--config', default='config.json', help='配置文件路径（默认: config.json）')
+    parser.add_argument('--host', help='监听地址（如果不传，从config.json读取，默认0.0.0.0）')
+    parser.add_argument('--port', type=int, help='监听端口（如果不传，从config.json读取，默认8080）')
+    parser.add_argument('--workers', type=int, help='工作线程数（如果不传，从config.json读取，默认4）')
+    parser.add_argument('--queue-size', type=int, help='队列中最多等待的提交数（如果不传，从config.json读取，默认100）')
+    
+    args = parser.parse_args()
+    config = load_config(args.config)
+    
+    review_queue = ReviewQueue(
+        config,
+        workers=args.workers or config.get('webhook_workers', 4),
+        max_size=args.queue_size or config.get('webhook_queue_size', 100)
+    )
+    review_queue.start()
+    server = create_server(
+        review_queue,
+        host=args.host or config.get('webhook_host', '0.0.0.0'),
+        port=args.port or config.get('webhook_port', 8080),
+        secret=config.get('webhook_secret')
+    )
+    print(f'Webhook服务已启动: http://{server.server_address[0]}:{server.server_address[1]}/（Ctrl+C 退出）')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\n正在停止，等待队列中的提交处理完成...')
+    finally:
+        server.server_close()
+        review_queue.stop()
+        print(review_queue.file_cache.summary())
@@ -4,17 +4,25 @@
 获取 Tongbu.Tui.Nms.Inner 项目的最新提交
 """
 
+import contextlib
 import json
+import sys
 from git_commits_fetcher import main
+import sync_state
 
 
-def fetch_tongbu_commits(branch='dev', per_page=20):
+def fetch_tongbu_commits(branch='dev', per_page=20, incremental=False, state_file='sync_state.json', ndjson_output=None,
+                         max_commits=None):
     """
     获取同步推项目的最新提交
     
     参数:
         branch: 分支名称，默认 'dev'
         per_page: 获取的提交数量，默认 20
+        incremental: 是否增量获取（只获取上次运行之后的新提交）
+        state_file: 增量模式下保存水位线的状态文件
+        ndjson_output: 可写的文本文件对象（可选），传入后提交逐条以NDJSON写出，不保存在结果中
+        max_commits: 增量模式最多获取的提交数（可选，默认500；水位线失效时不会遍历整个分支历史）
     
     返回:
         字典格式的结果
@@ -32,6 +40,13 @@ def fetch_tongbu_commits(branch='dev', per_page=20):
     print(f'  项目路径: http://git.server.tongbu.com/tuigroup/tongbu.tui.nms.inner')
     print(f'  分支: {branch}')
     print(f'  获取数量: {per_page}')
+    
+    # 增量模式：读取上次处理到的提交
+    since_sha = None
+    if incremental:
+        since_sha = sync_state.get_watermark(state_file, base_url, project_id, branch)
+        print(f'  增量起点: {since_sha[:8] if since_sha else "无（首次运行）"}')
+    
     print(f'=' * 80)
     print()
     
@@ -42,9 +57,15 @@ def fetch_tongbu_commits(branch='dev', per_page=20):
         platform=platform,
         base_url=base_url,
         per_page=per_page,
-        ref_name=branch
+        ref_name=branch,
+        since_sha=since_sha,
+        ndjson_output=ndjson_output,
+        max_commits=max_commits
     )
     
+    if incremental:
+        sync_state.update_from_result(state_file, base_url, project_id, branch, result)
+    
     return result
 
 
@@ -144,18 +165,62 @@ if __name__ == '__main__':
         '--output', 
         help='保存到 JSON 文件 (可选)'
     )
+    parser.add_argument(
+        '--format',
+        choices=['json', 'ndjson'],
+        default='json',
+        help='输出格式 (默认: json)；ndjson 每获取一条提交立即输出一行，未指定 --output 时写到标准输出'
+    )
     parser.add_argument(
         '--json-only',
         action='store_true',
         help='只输出 JSON 格式，不显示可读格式摘要'
     )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='增量获取：只获取上次运行之后的新提交'
+    )
+    parser.add_argument(
+        '--state-file',
+        default='sync_state.json',
+        help='增量模式的状态文件 (默认: sync_state.json)'
+    )
+    parser.add_argument(
+        '--max-commits',
+        type=int,
+        help='增量模式最多获取的提交数 (默认: 500)；超出仍没有找到水位线时视为水位线失效'
+    )
     
     args = parser.parse_args()
     
+    if args.format == 'ndjson':
+        # 流式输出：数据写到文件或标准输出，提示信息改写到标准错误，避免混入数据
+        ndjson_output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                result = fetch_tongbu_commits(
+                    branch=args.branch,
+                    per_page=args.per_page,
+                    incremental=args.incremental,
+                    state_file=args.state_file,
+                    ndjson_output=ndjson_output,
+                    max_commits=args.max_commits
+                )
+        finally:
+            if args.output:
+                ndjson_output.close()
+        if not result['success']:
+            print(f'❌ 获取失败: {result["error"]}', file=sys.stderr)
+        exit(0 if result['success'] else 1)
+    
     # 获取提交
     result = fetch_tongbu_commits(
         branch=args.branch,
-        per_page=args.per_page
+        per_page=args.per_page,
+        incremental=args.incremental,
+        state_file=args.state_file,
+        max_commits=args.max_commits
     )
     
     # 输出 JSON 格式
@@ -4,9 +4,12 @@
 使用配置文件获取提交（更安全的方式）
 """
 
+import contextlib
 import json
 import os
-from git_commits_fetcher import main
+import sys
+from git_commits_fetcher import main, ResponseCache
+import sync_state
 
 
 def load_config(config_file='config.json'):
@@ -40,7 +43,8 @@ def load_config(config_file='config.json'):
         return None
 
 
-def fetch_commits_with_config(branch=None, per_page=None, config_file='config.json'):
+def fetch_commits_with_config(branch=None, per_page=None, config_file='config.json', incremental=None, ndjson_output=None,
+                              max_commits=None):
     """
     使用配置文件获取提交
     
@@ -48,6 +52,10 @@ def fetch_commits_with_config(branch=None, per_page=None, config_file='config.js
         branch: 分支名称（可选，覆盖配置文件中的默认值）
         per_page: 获取数量（可选，覆盖配置文件中的默认值）
         config_file: 配置文件路径
+        incremental: 是否增量获取（可选，覆盖配置文件中的 incremental），
+                     增量模式只获取上次运行之后的新提交，水位线保存在 state_file 中
+        ndjson_output: 可写的文本文件对象（可选），传入后提交逐条以NDJSON写出，不保存在结果中
+        max_commits: 增量模式最多获取的提交数（可选，覆盖配置文件中的 max_commits，默认500）
     
     返回:
         结果字典
@@ -65,6 +73,16 @@ def fetch_commits_with_config(branch=None, per_page=None, config_file='config.js
     # 参数优先级：命令行参数 > 配置文件
     branch = branch or config.get('default_branch', 'dev')
     per_page = per_page or config.get('default_per_page', 20)
+    if incremental is None:
+        incremental = config.get('incremental', False)
+    state_file = config.get('state_file', 'sync_state.json')
+    if max_commits is None:
+        max_commits = config.get('max_commits')
+    
+    # 提交列表的条件请求缓存（定时轮询时分支没有变化则服务端返回304）
+    response_cache = None
+    if config.get('list_cache_dir'):
+        response_cache = ResponseCache(config['list_cache_dir'], config.get('list_cache_ttl', 30))
     
     print(f'=' * 80)
     print(f'使用配置获取提交:')
@@ -73,6 +91,13 @@ def fetch_commits_with_config(branch=None, per_page=None, config_file='config.js
     print(f'  Git站点: {config.get("base_url", "").replace("/api/v4", "")}')
     print(f'  分支: {branch}')
     print(f'  获取数量: {per_page}')
+    
+    # 增量模式：读取上次处理到的提交
+    since_sha = None
+    if incremental:
+        since_sha = sync_state.get_watermark(state_file, config.get('base_url'), config.get('project_id'), branch)
+        print(f'  增量起点: {since_sha[:8] if since_sha else "无（首次运行）"}')
+    
     print(f'=' * 80)
     print()
     
@@ -83,9 +108,17 @@ def fetch_commits_with_config(branch=None, per_page=None, config_file='config.js
         platform=config.get('platform', 'gitlab'),
         base_url=config.get('base_url'),
         per_page=per_page,
-        ref_name=branch
+        ref_name=branch,
+        since_sha=since_sha,
+        response_cache=response_cache,
+        ndjson_output=ndjson_output,
+        max_commits=max_commits,
+        repo_path=config.get('repo_path')
     )
     
+    if incremental:
+        sync_state.update_from_result(state_file, config.get('base_url'), config.get('project_id'), branch, result)
+    
     return result
 
 
@@ -113,19 +146,58 @@ if __name__ == '__main__':
         '--output',
         help='保存到 JSON 文件'
     )
+    parser.add_argument(
+        '--format',
+        choices=['json', 'ndjson'],
+        default='json',
+        help='输出格式 (默认: json)；ndjson 每获取一条提交立即输出一行，未指定 --output 时写到标准输出'
+    )
     parser.add_argument(
         '--json-only',
         action='store_true',
         help='只输出 JSON 格式'
     )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        default=None,
+        help='增量获取：只获取上次运行之后的新提交 (也可在配置文件中设置 incremental)'
+    )
+    parser.add_argument(
+        '--max-commits',
+        type=int,
+        help='增量模式最多获取的提交数 (覆盖配置文件中的 max_commits，默认 500)'
+    )
     
     args = parser.parse_args()
     
+    if args.format == 'ndjson':
+        # 流式输出：数据写到文件或标准输出，提示信息改写到标准错误，避免混入数据
+        ndjson_output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                result = fetch_commits_with_config(
+                    branch=args.branch,
+                    per_page=args.per_page,
+                    config_file=args.config,
+                    incremental=args.incremental,
+                    ndjson_output=ndjson_output,
+                    max_commits=args.max_commits
+                )
+        finally:
+            if args.output:
+                ndjson_output.close()
+        if not result['success']:
+            print(f'❌ 获取失败: {result["error"]}', file=sys.stderr)
+        exit(0 if result['success'] else 1)
+    
     # 获取提交
     result = fetch_commits_with_config(
         branch=args.branch,
         per_page=args.per_page,
-        config_file=args.config
+        config_file=args.config,
+        incremental=args.incremental,
+        max_commits=args.max_commits
     )
     
     # 输出结果
@@ -6,29 +6,182 @@ Git提交内容获取工具
 """
 
 import requests
+import contextlib
 import json
+import os
+import sys
 
+# 会话、翻页、条件请求缓存和本地仓库后端在 GrabGoogleAppComment 中实现，两个工具共用
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'GrabGoogleAppComment'))
+from api_client import ResponseCache, build_commits_request, create_session, iter_commit_items, write_ndjson_record
+from local_git import LocalRepository
 
-def main(access_token, project_id, platform='gitlab', base_url=None, per_page=20, ref_name=None):
+# 增量获取时最多获取的提交数：水位线不在分支上（强制推送、变基、分支重置）时不会遍历整个历史
+INCREMENTAL_MAX_COMMITS = 500
+
+
+def resolve_api_base_url(platform='gitlab', base_url=None):
     """
-    获取Git项目的最新提交内容
+    根据平台和自定义base_url得到API基础URL
+    
+    参数:
+        platform: 平台类型，'gitlab' 或 'github'
+        base_url: 自定义API基础URL（可选）
+    
+    返回:
+        API基础URL字符串
+    """
+    if base_url:
+        return base_url.rstrip('/')
+    elif platform == 'github':
+        return 'https://api.github.com'
+    return 'https://gitlab.com/api/v4'
+
+
+def format_commit_item(commit_item, platform='gitlab'):
+    """
+    将API返回的单条提交转换为统一的提交字典
+    
+    参数:
+        commit_item: API返回的提交对象
+        platform: 平台类型
+    
+    返回:
+        提交字典
+    """
+    if platform == 'gitlab':
+        return {
+            'id': commit_item.get('id'),
+            'short_id': commit_item.get('short_id'),
+            'title': commit_item.get('title'),
+            'message': commit_item.get('message'),
+            'author_name': commit_item.get('author_name'),
+            'author_email': commit_item.get('author_email'),
+            'authored_date': commit_item.get('authored_date'),
+            'committer_name': commit_item.get('committer_name'),
+            'committer_email': commit_item.get('committer_email'),
+            'committed_date': commit_item.get('committed_date'),
+            'web_url': commit_item.get('web_url'),
+        }
+    
+    # GitHub
+    commit_info = commit_item.get('commit', {})
+    author_info = commit_info.get('author', {})
+    committer_info = commit_info.get('committer', {})
+    return {
+        'sha': commit_item.get('sha'),
+        'short_sha': commit_item.get('sha', '')[:7],
+        'message': commit_info.get('message', ''),
+        'title': commit_info.get('message', '').split('\n')[0],
+        'author_name': author_info.get('name'),
+        'author_email': author_info.get('email'),
+        'authored_date': author_info.get('date'),
+        'committer_name': committer_info.get('name'),
+        'committer_email': committer_info.get('email'),
+        'committed_date': committer_info.get('date'),
+        'html_url': commit_item.get('html_url'),
+    }
+
+
+def iter_commits(access_token, project_id, platform='gitlab', base_url=None, ref_name=None, page_size=100,
+                 max_commits=None, session=None, prefetch=True, since_sha=None, response_cache=None):
+    """
+    流式获取提交列表，自动翻页，逐条产出格式化后的提交
     
     参数:
         access_token: API访问令牌
         project_id: 项目ID（GitLab）或仓库路径（GitHub格式：owner/repo）
-        platform: 平台类型，'gitlab' 或 'github'，默认 'gitlab'
+        platform: 平台类型，'gitlab' 或 'github'
+        base_url: 自定义API基础URL
+        ref_name: 分支或标签名称（可选）
+        page_size: 每页数量（GitLab/GitHub 最大 100）
+        max_commits: 最多产出的提交数量（None 表示遍历全部历史）
+        session: 共享的HTTP会话（可选，不传则内部创建并在遍历结束时关闭）
+        prefetch: 是否在处理当前页时预取下一页
+        since_sha: 水位线提交SHA（可选），遇到该提交即停止翻页，只产出比它新的提交
+        response_cache: ResponseCache 实例（可选，列表请求使用 ETag/Last-Modified 条件请求）
+    
+    返回:
+        生成器，逐条产出 format_commit_item 格式的提交字典
+    """
+    platform = platform.lower()
+    api_base_url = resolve_api_base_url(platform, base_url)
+    own_session = session is None
+    if own_session:
+        session = create_session(platform, access_token)
+    
+    items = iter_commit_items(
+        session, api_base_url, project_id, platform, ref_name, page_size, max_commits,
+        prefetch=prefetch, since_sha=since_sha, response_cache=response_cache
+    )
+    try:
+        for commit_item in items:
+            yield format_commit_item(commit_item, platform)
+    finally:
+        items.close()
+        if own_session:
+            session.close()
+
+
+def cap_incremental(commits, max_commits, since_sha, response):
+    """
+    限制增量获取的提交数量
+    
+    参数:
+        commits: iter_commits 的生成器（按 max_commits + 1 获取，用于判断是否还有更多提交）
+        max_commits: 最多产出的提交数量
+        since_sha: 水位线提交SHA
+        response: main 的结果字典，超出上限时设置 response['watermark_stale'] = True
+    
+    返回:
+        生成器，最多产出 max_commits 条提交；超出上限仍没有遇到水位线时打印警告，
+        水位线视为失效（调用方用本次最新的提交重新记录水位线）
+    """
+    try:
+        for count, commit_data in enumerate(commits):
+            if count >= max_commits:
+                response['watermark_stale'] = True
+                print(f'⚠️  最近 {max_commits} 条提交中没有找到水位线 {since_sha[:8]}'
+                      f'（分支可能被强制推送、变基或重置，或新提交超过上限），水位线视为失效，只获取最新 {max_commits} 条')
+                return
+            yield commit_data
+    finally:
+        commits.close()
+
+
+def main(access_token=None, project_id=None, platform='gitlab', base_url=None, per_page=20, ref_name=None, session=None, since_sha=None,
+         response_cache=None, ndjson_output=None, max_commits=None, repo_path=None):
+    """
+    获取Git项目的最新提交内容
+    
+    参数:
+        access_token: API访问令牌（platform='local' 时不需要）
+        project_id: 项目ID（GitLab）或仓库路径（GitHub格式：owner/repo）（platform='local' 时不需要）
+        platform: 平台类型，'gitlab'、'github' 或 'local'（本地仓库），默认 'gitlab'
         base_url: 自定义API基础URL（用于自托管GitLab等）
-        per_page: 返回的提交数量，默认20
+        per_page: 返回的提交数量，默认20，超过单页上限（100）时自动翻页
         ref_name: 分支或标签名称（可选）
+        session: 共享的HTTP会话（可选，不传则本次调用内部创建并在结束时关闭）
+        since_sha: 水位线提交SHA（可选），传入后只获取比它新的全部提交（per_page 作为每页数量），
+                   遇到该提交即停止翻页
+        response_cache: ResponseCache 实例（可选），列表请求使用 ETag/Last-Modified 条件请求，
+                        内容未变化时服务端返回304，直接使用本地缓存
+        ndjson_output: 可写的文本文件对象（可选），传入后每获取一条提交立即写出一行JSON，
+                       提交不再保存在返回的 commits 中（内存占用不随提交数量增长）
+        max_commits: 增量获取（传入 since_sha）时最多获取的提交数，默认 INCREMENTAL_MAX_COMMITS；
+                     超出仍没有遇到水位线时只保留最新的 max_commits 条，结果中 'watermark_stale' 为 True
+        repo_path: 本地仓库路径，platform='local' 时使用（提交字典与 GitLab 格式相同，web_url 为 None）
     
     返回:
         字典结构:
         {
             'success': bool,  # 是否成功获取
-            'commits': list,  # 提交列表
+            'commits': list,  # 提交列表（传入 ndjson_output 时为空列表）
             'count': int,     # 提交数量
             'error': str      # 错误信息（如果有）
         }
+        传入 ndjson_output 时另有 'newest_commit'：最新的一条提交（用于更新增量水位线），没有提交时为 None；
+        增量获取时另有 'watermark_stale'：水位线是否已失效
     """
     # 初始化返回字典，确保结构一致
     response = {
@@ -37,106 +190,79 @@ def main(access_token, project_id, platform='gitlab', base_url=None, per_page=20
         'count': 0,
         'error': None
     }
+    own_session = False
     
     try:
-        # 参数验证
-        if not access_token or not project_id:
-            response['error'] = '缺少必需参数: access_token 和 project_id'
-            return response
-        
         platform = platform.lower()
         
-        # 设置API基础URL
-        if base_url:
-            api_base_url = base_url.rstrip('/')
-        elif platform == 'gitlab':
-            api_base_url = 'https://gitlab.com/api/v4'
-        elif platform == 'github':
-            api_base_url = 'https://api.github.com'
-        else:
-            response['error'] = f'不支持的平台: {platform}，请使用 gitlab 或 github'
-            return response
-        
-        # 设置请求头
-        if platform == 'gitlab':
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-        else:  # GitHub
-            headers = {
-                'Authorization': f'token {access_token}',
-                'Accept': 'application/vnd.github.v3+json',
-                'Content-Type': 'application/json'
-            }
-        
-        # 构建API URL和参数
-        if platform == 'gitlab':
-            url = f'{api_base_url}/projects/{project_id}/repository/commits'
-            params = {
-                'per_page': per_page,
-                'order_by': 'created_at',
-                'sort': 'desc'
-            }
-            if ref_name:
-                params['ref_name'] = ref_name
-        else:  # GitHub
-            url = f'{api_base_url}/repos/{project_id}/commits'
-            params = {'per_page': per_page}
-            if ref_name:
-                params['sha'] = ref_name
-        
-        print(f'正在请求: {url}')
+        if since_sha:
+            max_commits = max_commits or INCREMENTAL_MAX_COMMITS
+            response['watermark_stale'] = False
+        # 增量获取多取一条，用于判断上限内是否遇到了水位线
+        list_limit = max_commits + 1 if since_sha else per_page
         
-        # 发起API请求
-        api_response = requests.get(url, headers=headers, params=params, timeout=30)
-        api_response.raise_for_status()
-        
-        commits_data = api_response.json()
-        
-        print(f'成功获取 {len(commits_data)} 条提交记录')
+        if platform == 'local':
+            # 本地仓库：一次 git log 读出提交列表，不访问API
+            if not repo_path:
+                response['error'] = '缺少必需参数: repo_path'
+                return response
+            print(f'正在读取本地仓库: {repo_path}')
+            local_commits = LocalRepository(repo_path).iter_commits(
+                ref_name,
+                max_commits=list_limit,
+                since_sha=since_sha,
+                include_diff=False
+            )
+            commits = (format_commit_item(commit_data, 'gitlab') for commit_data in local_commits)
+        else:
+            # 参数验证
+            if not access_token or not project_id:
+                response['error'] = '缺少必需参数: access_token 和 project_id'
+                return response
+            
+            # 设置API基础URL
+            if platform not in ('gitlab', 'github'):
+                response['error'] = f'不支持的平台: {platform}，请使用 gitlab、github 或 local'
+                return response
+            api_base_url = resolve_api_base_url(platform, base_url)
+            
+            # 创建共享会话（请求头在会话中只构建一次）
+            if session is None:
+                session = create_session(platform, access_token)
+                own_session = True
+            
+            url, _ = build_commits_request(api_base_url, project_id, platform, per_page, ref_name)
+            print(f'正在请求: {url}')
+            
+            # 获取并格式化提交数据（超过单页上限时自动翻页）
+            commits = iter_commits(
+                access_token, project_id, platform, base_url,
+                ref_name=ref_name,
+                page_size=per_page,
+                max_commits=list_limit,
+                session=session,
+                since_sha=since_sha,
+                response_cache=response_cache
+            )
+        if since_sha:
+            commits = cap_incremental(commits, max_commits, since_sha, response)
         
-        # 格式化提交数据
-        formatted_commits = []
+        if ndjson_output is not None:
+            # 流式输出：逐条写出，只保留最新的一条
+            response['newest_commit'] = None
+            for commit_data in commits:
+                if response['newest_commit'] is None:
+                    response['newest_commit'] = commit_data
+                write_ndjson_record(ndjson_output, commit_data)
+                response['count'] += 1
+        else:
+            response['commits'] = list(commits)
+            response['count'] = len(response['commits'])
         
-        if platform == 'gitlab':
-            for commit_item in commits_data:
-                formatted_commits.append({
-                    'id': commit_item.get('id'),
-                    'short_id': commit_item.get('short_id'),
-                    'title': commit_item.get('title'),
-                    'message': commit_item.get('message'),
-                    'author_name': commit_item.get('author_name'),
-                    'author_email': commit_item.get('author_email'),
-                    'authored_date': commit_item.get('authored_date'),
-                    'committer_name': commit_item.get('committer_name'),
-                    'committer_email': commit_item.get('committer_email'),
-                    'committed_date': commit_item.get('committed_date'),
-                    'web_url': commit_item.get('web_url'),
-                })
-        else:  # GitHub
-            for commit_item in commits_data:
-                commit_info = commit_item.get('commit', {})
-                author_info = commit_info.get('author', {})
-                committer_info = commit_info.get('committer', {})
-                formatted_commits.append({
-                    'sha': commit_item.get('sha'),
-                    'short_sha': commit_item.get('sha', '')[:7],
-                    'message': commit_info.get('message', ''),
-                    'title': commit_info.get('message', '').split('\n')[0],
-                    'author_name': author_info.get('name'),
-                    'author_email': author_info.get('email'),
-                    'authored_date': author_info.get('date'),
-                    'committer_name': committer_info.get('name'),
-                    'committer_email': committer_info.get('email'),
-                    'committed_date': committer_info.get('date'),
-                    'html_url': commit_item.get('html_url'),
-                })
+        print(f'成功获取 {response["count"]} 条提交记录')
         
         # 设置成功响应
         response['success'] = True
-        response['commits'] = formatted_commits
-        response['count'] = len(formatted_commits)
         
     except requests.exceptions.HTTPError as e:
         # HTTP错误处理
@@ -162,6 +288,10 @@ def main(access_token, project_id, platform='gitlab', base_url=None, per_page=20
         print(error_msg)
         response['error'] = error_msg
     
+    finally:
+        if own_session:
+            session.close()
+    
     # 返回结果字典，确保所有情况下都有相同的键
     return response
 
@@ -171,15 +301,48 @@ if __name__ == '__main__':
     import argparse
     
     parser = argparse.ArgumentParser(description='获取Git项目的最新提交内容')
-    parser.add_argument('--token', required=True, help='API访问令牌')
-    parser.add_argument('--project-id', required=True, help='项目ID (GitLab) 或仓库路径 (GitHub: owner/repo)')
-    parser.add_argument('--platform', default='gitlab', choices=['gitlab', 'github'], help='平台类型 (默认: gitlab)')
+    parser.add_argument('--token', help='API访问令牌 (gitlab/github 必需)')
+    parser.add_argument('--project-id', help='项目ID (GitLab) 或仓库路径 (GitHub: owner/repo) (gitlab/github 必需)')
+    parser.add_argument('--platform', default='gitlab', choices=['gitlab', 'github', 'local'], help='平台类型 (默认: gitlab)')
+    parser.add_argument('--repo-path', help='本地仓库路径 (--platform local 时使用)')
     parser.add_argument('--base-url', help='自定义API基础URL')
     parser.add_argument('--per-page', type=int, default=20, help='返回的提交数量 (默认: 20)')
     parser.add_argument('--ref', help='分支或标签名称')
     parser.add_argument('--output', help='保存到JSON文件')
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='json',
+                        help='输出格式 (默认: json)；ndjson 每获取一条提交立即输出一行，未指定 --output 时写到标准输出')
+    parser.add_argument('--list-cache-dir', help='提交列表的条件请求缓存目录（内容未变化时服务端返回304，不重新下载）')
+    parser.add_argument('--list-cache-ttl', type=float, default=30, help='该秒数内的重复请求直接使用缓存 (默认: 30)')
     
     args = parser.parse_args()
+    if args.platform == 'local':
+        if not args.repo_path:
+            parser.error('--platform local 需要 --repo-path')
+    elif not args.token or not args.project_id:
+        parser.error('--platform gitlab/github 需要 --token 和 --project-id')
+    
+    if args.format == 'ndjson':
+        # 流式输出：数据写到文件或标准输出，提示信息改写到标准错误，避免混入数据
+        ndjson_output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                result = main(
+                    access_token=args.token,
+                    project_id=args.project_id,
+                    platform=args.platform,
+                    base_url=args.base_url,
+                    per_page=args.per_page,
+                    ref_name=args.ref,
+                    repo_path=args.repo_path,
+                    response_cache=ResponseCache(args.list_cache_dir, args.list_cache_ttl) if args.list_cache_dir else None,
+                    ndjson_output=ndjson_output
+                )
+        finally:
+            if args.output:
+                ndjson_output.close()
+        if not result['success']:
+            print(f"错误: {result['error']}", file=sys.stderr)
+        sys.exit(0 if result['success'] else 1)
     
     # 调用main函数
     result = main(
@@ -188,7 +351,9 @@ if __name__ == '__main__':
         platform=args.platform,
         base_url=args.base_url,
         per_page=args.per_page,
-        ref_name=args.ref
+        ref_name=args.ref,
+        repo_path=args.repo_path,
+        response_cache=ResponseCache(args.list_cache_dir, args.list_cache_ttl) if args.list_cache_dir else None
     )
     
     # 输出结果
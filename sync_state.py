@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量同步状态（水位线）管理
+按 站点 + 项目 + 分支 记录最后处理过的提交SHA，保存在本地JSON文件中
+"""
+
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def make_key(base_url, project_id, ref_name):
+    """
+    生成水位线的键
+    
+    参数:
+        base_url: API基础URL或站点地址
+        project_id: 项目ID
+        ref_name: 分支或标签名称
+    
+    返回:
+        字符串键，例如 'http://git.server.tongbu.com/api/v4|508|dev'
+    """
+    return f'{(base_url or "").rstrip("/")}|{project_id}|{ref_name or ""}'
+
+
+def load_state(state_file='sync_state.json'):
+    """
+    读取状态文件
+    
+    参数:
+        state_file: 状态文件路径
+    
+    返回:
+        状态字典，文件不存在或损坏时返回空字典
+    """
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f'⚠️  读取同步状态失败 ({state_file}): {e}，将重新全量获取')
+        return {}
+
+
+def get_watermark(state_file, base_url, project_id, ref_name):
+    """
+    获取某个项目分支的水位线
+    
+    返回:
+        最后处理过的提交SHA，没有记录时返回 None
+    """
+    entry = load_state(state_file).get(make_key(base_url, project_id, ref_name))
+    return entry.get('sha') if entry else None
+
+
+@contextmanager
+def _state_lock(state_file):
+    """
+    在 '<状态文件>.lock' 上加排他锁，多个进程同时更新水位线时依次进行读取-合并-替换，
+    不会互相覆盖对方写入的项目分支
+    """
+    with open(f'{state_file}.lock', 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def set_watermark(state_file, base_url, project_id, ref_name, sha, committed_date=None):
+    """
+    更新某个项目分支的水位线
+    在文件锁内重新读取并合并其他进程的记录，写入唯一的临时文件后再替换，避免并发运行互相覆盖或中途退出导致状态文件损坏
+    
+    参数:
+        state_file: 状态文件路径
+        base_url: API基础URL或站点地址
+        project_id: 项目ID
+        ref_name: 分支或标签名称
+        sha: 最新处理过的提交SHA
+        committed_date: 该提交的时间（可选，仅用于查看）
+    """
+    with _state_lock(state_file):
+        state = load_state(state_file)
+        state[make_key(base_url, project_id, ref_name)] = {
+            'sha': sha,
+            'committed_date': committed_date
+        }
+        
+        f = tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', dir=os.path.dirname(os.path.abspath(state_file)),
+            prefix=os.path.basename(state_file) + '.', suffix='.tmp', delete=False
+        )
+        try:
+            with f:
+                json.dump(state, f, indent=2, ensure_ascii=False)
+            os.replace(f.name, state_file)
+        except BaseException:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+            raise
+
+
+def update_from_result(state_file, base_url, project_id, ref_name, result):
+    """
+    获取成功后，用结果中最新的提交更新水位线（没有新提交时保持不变）
+    
+    参数:
+        result: git_commits_fetcher.main 返回的结果字典（流式输出时使用其中的 newest_commit）
+    """
+    if not result.get('success'):
+        return
+    newest = result.get('newest_commit') or (result['commits'][0] if result.get('commits') else None)
+    if newest is None:
+        return
+    set_watermark(
+        state_file, base_url, project_id, ref_name,
+        newest.get('id') or newest.get('sha'),
+        newest.get('committed_date')
+    )
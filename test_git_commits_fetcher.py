@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+git_commits_fetcher 的单元测试（不访问外部网络）
+运行: python -m pytest -q test_git_commits_fetcher.py
+"""
+
+import json
+import shutil
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.pool import ThreadPool
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import sync_state
+from git_commits_fetcher import main
+
+COMMITS = [
+    {'id': f'{i:040x}', 'short_id': f'{i:08x}', 'title': f'提交 {i}', 'message': f'提交 {i}\n', 'author_name': '张三',
+     'author_email': 'zs@tongbu.com', 'authored_date': '2025-01-01T00:00:00+08:00', 'committer_name': '张三',
+     'committer_email': 'zs@tongbu.com', 'committed_date': '2025-01-01T00:00:00+08:00', 'web_url': None}
+    for i in range(10, 0, -1)
+]
+
+
+def _git(repo, *args):
+    subprocess.run(['git', '-C', str(repo), *args], check=True, capture_output=True)
+
+
+@pytest.fixture
+def local_repo(tmp_path):
+    if shutil.which('git') is None:
+        pytest.skip('需要 git')
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    _git(repo, 'init', '-q')
+    _git(repo, 'config', 'user.name', '测试')
+    _git(repo, 'config', 'user.email', 'test@example.com')
+    for i in range(3):
+        (repo / 'a.txt').write_text(f'{i}\n', encoding='utf-8')
+        _git(repo, 'add', 'a.txt')
+        _git(repo, 'commit', '-q', '-m', f'提交 {i}')
+    return repo
+
+
+class CommitsHandler(BaseHTTPRequestHandler):
+    """/projects/1/repository/commits，按 X-Next-Page 翻页"""
+    
+    pages_seen = []
+    
+    def log_message(self, *args):
+        pass
+    
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        page, per_page = int(query.get('page', 1)), int(query['per_page'])
+        CommitsHandler.pages_seen.append(page)
+        body = json.dumps(COMMITS[(page - 1) * per_page:page * per_page]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if page * per_page < len(COMMITS):
+            self.send_header('X-Next-Page', str(page + 1))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def base_url():
+    CommitsHandler.pages_seen = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CommitsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_incremental_stops_paginating_at_watermark(base_url, tmp_path):
+    """水位线在第二页时只请求两页，更新后的水位线是最新的提交"""
+    state_file = str(tmp_path / 'sync_state.json')
+    sync_state.set_watermark(state_file, base_url, 1, 'dev', COMMITS[5]['id'])
+    
+    since_sha = sync_state.get_watermark(state_file, base_url, 1, 'dev')
+    result = main('token', 1, 'gitlab', base_url, per_page=3, ref_name='dev', since_sha=since_sha)
+    assert result['success'], result['error']
+    assert [c['id'] for c in result['commits']] == [c['id'] for c in COMMITS[:5]]
+    assert result['watermark_stale'] is False
+    assert CommitsHandler.pages_seen == [1, 2]
+    
+    sync_state.update_from_result(state_file, base_url, 1, 'dev', result)
+    assert sync_state.get_watermark(state_file, base_url, 1, 'dev') == COMMITS[0]['id']
+
+
+def test_set_watermark_concurrent_updates_merge(tmp_path):
+    """多个线程同时更新不同分支的水位线，每一项都保留，且不留下临时文件"""
+    state_file = str(tmp_path / 'sync_state.json')
+    branches = [f'b{i}' for i in range(20)]
+    with ThreadPool(8) as pool:
+        pool.map(lambda branch: sync_state.set_watermark(state_file, 'http://x', 1, branch, branch * 20), branches)
+    
+    state = sync_state.load_state(state_file)
+    assert {key.split('|')[-1]: entry['sha'] for key, entry in state.items()} == {b: b * 20 for b in branches}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['sync_state.json', 'sync_state.json.lock']
+
+
+def test_main_local_without_token(local_repo):
+    """本地仓库不需要令牌和项目ID，提交字典与 GitLab 格式相同"""
+    result = main(platform='local', repo_path=str(local_repo), per_page=2)
+    assert result['success'], result['error']
+    assert result['count'] == 2
+    assert [c['title'] for c in result['commits']] == ['提交 2', '提交 1']
+    assert set(result['commits'][0]) == {
+        'id', 'short_id', 'title', 'message', 'author_name', 'author_email', 'authored_date',
+        'committer_name', 'committer_email', 'committed_date', 'web_url'
+    }
+    
+    since = main(platform='local', repo_path=str(local_repo), since_sha=result['commits'][1]['id'])
+    assert [c['title'] for c in since['commits']] == ['提交 2']
+    assert since['watermark_stale'] is False
+
+
+def test_main_local_requires_repo_path():
+    result = main(platform='local')
+    assert not result['success']
+    assert 'repo_path' in result['error']